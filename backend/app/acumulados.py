@@ -0,0 +1,191 @@
+import os
+
+import numpy as np
+import xarray as xr
+
+from app import bloques, indice_zonas, pool_datasets
+from app.procesar import variables_riesgo_fuzzy
+
+# Sumas acumuladas a lo largo de 'time' de las capas de riesgo, para promediar
+# cualquier ventana de meses sin recorrer la serie.
+#
+# Por cada NetCDF de riesgo la ingesta escribe en CARPETA_ACUMULADOS un NetCDF con el
+# mismo eje 'time' y, por cada variable de riesgo, un cubo (time, medida, lat, lon):
+#   medida 0: suma de los valores válidos de los pasos 0..t
+#   medida 1: cantidad de valores válidos (no NaN) de los pasos 0..t
+# El promedio de los pasos [a, b] (ignorando NaN, como mean de xarray) sale de la
+# diferencia de los pasos b y a-1: dos lecturas por ventana, sea de 3 o de 60 meses.
+# Coincide con el mean directo dentro de la tolerancia de punto flotante (restar dos
+# sumas acumuladas no suma en el mismo orden que mean), no necesariamente bit a bit.
+#
+# El archivo guarda en 'origen_acumulado' el tamaño y la fecha de modificación del
+# NetCDF de riesgo con que se generó; si éste se reescribe, el acumulado deja de usarse
+# (ver lectura) hasta que la ingesta lo regenere.
+
+CARPETA_ACUMULADOS = 'uploads/acumulados'
+
+# Arreglos float64 de un paso por variable que se mantienen a la vez al generar
+# (valores, máscara de válidos, sumas, cuentas y el bloque apilado que se escribe)
+COPIAS_ACUMULADO = 6
+
+# Compresión de los cubos (las sumas se guardan siempre en float64)
+CODIFICACION_ACUMULADO = {'dtype': 'float64', 'zlib': True, 'complevel': 1}
+
+
+def variables_riesgo(tipo_archivo):
+
+    # Variables que se acumulan de un NetCDF de riesgo: el índice crisp, o los agregados
+    # por clase y el riesgo fuzzy de la base de reglas activa (no las componentes).
+
+    if tipo_archivo == 'riesgo_crisp':
+        return ['riesgo_crisp']
+    return variables_riesgo_fuzzy(salida='agregados')
+
+
+def ruta_acumulado(ruta):
+    return os.path.join(CARPETA_ACUMULADOS, os.path.basename(ruta))
+
+
+def origen_archivo(ruta):
+
+    # Identifica la versión de un NetCDF de riesgo (las escrituras por bloques lo
+    # reemplazan entero, así que cambia si cambia su contenido).
+
+    info = os.stat(ruta)
+    return f"{info.st_size}:{info.st_mtime_ns}"
+
+
+def ultimo_paso(destino, variables):
+
+    # (pasos, {variable: último paso (medida, lat, lon)}) del acumulado 'destino', o
+    # None si no existe o no tiene exactamente 'variables'.
+
+    if not os.path.exists(destino):
+        return None
+    ds = pool_datasets.abrir_dataset(destino)
+    try:
+        if sorted(ds.data_vars) != sorted(variables) or ds.sizes['time'] == 0:
+            return None
+        n = ds.sizes['time']
+        return n, {v: ds[v][n - 1].values.astype(float) for v in variables}
+    finally:
+        pool_datasets.liberar_dataset(ds)
+
+
+def bloques_acumulados(ds, inicio, paso, previos, atributos):
+
+    # Genera los Datasets del acumulado de ds (sólo las variables a acumular) desde el
+    # paso 'inicio', en bloques de 'paso' pasos. 'previos' es el último paso ya
+    # acumulado ({variable: (medida, lat, lon)}) o None si se parte de cero.
+
+    T = ds.sizes['time']
+    for t0, t1 in bloques.iterar_bloques(T - inicio, paso):
+        a, b = inicio + t0, inicio + t1
+        datos = {}
+        for nombre in ds.data_vars:
+            valores = ds[nombre][a:b].values.astype(float)
+            validos = ~np.isnan(valores)
+            valores[~validos] = 0.0
+            cuentas = validos.astype(float)
+            if previos is not None:
+                # Sumar lo anterior al primer paso mantiene el mismo orden de sumas que
+                # un único cumsum sobre toda la serie
+                valores[0] += previos[nombre][0]
+                cuentas[0] += previos[nombre][1]
+            np.cumsum(valores, axis=0, out=valores)
+            np.cumsum(cuentas, axis=0, out=cuentas)
+            datos[nombre] = (("time", "medida", "lat", "lon"), np.stack([valores, cuentas], axis=1))
+        previos = {nombre: datos[nombre][1][-1] for nombre in datos}
+        yield xr.Dataset(datos, coords=ds.isel(time=slice(a, b)).coords, attrs=atributos)
+
+
+def generar_acumulado(ruta, variables, anexar=False, presupuesto=None):
+
+    # Escribe el acumulado de las 'variables' del NetCDF de riesgo 'ruta' (las que
+    # tenga). Con anexar=True, si el acumulado existente tiene las mismas variables y
+    # no más pasos que 'ruta', sólo se acumulan los pasos nuevos (series que crecen
+    # por el final, ver app.series); si no, se rehace completo.
+    # Retorna la ruta del acumulado, o None si 'ruta' no tiene ninguna de las variables.
+
+    os.makedirs(CARPETA_ACUMULADOS, exist_ok=True)
+    destino = ruta_acumulado(ruta)
+    ds_abierto = pool_datasets.abrir_dataset(ruta)
+    try:
+        variables = [v for v in variables if v in ds_abierto.data_vars]
+        if not variables:
+            return None
+        ds = ds_abierto[variables]
+        T = ds.sizes['time']
+
+        previos = ultimo_paso(destino, variables) if anexar else None
+        if previos is not None and previos[0] > T:
+            previos = None
+        inicio = previos[0] if previos is not None else 0
+
+        paso = bloques.pasos_por_bloque(
+            T - inicio, bloques.bytes_por_paso(ds, COPIAS_ACUMULADO), presupuesto
+        )
+        atributos = dict(indice_zonas.atributos_guardados(ds_abierto), origen_acumulado=origen_archivo(ruta))
+        generados = bloques_acumulados(ds, inicio, paso, previos and previos[1], atributos)
+        if previos is not None:
+            bloques.anexar_bloques(generados, destino, atributos={'origen_acumulado': atributos['origen_acumulado']})
+        else:
+            encoding = {v: dict(CODIFICACION_ACUMULADO) for v in variables}
+            bloques.guardar_bloques(generados, destino, encoding=encoding)
+        return destino
+    finally:
+        pool_datasets.liberar_dataset(ds_abierto)
+
+
+def vigente(ruta):
+
+    # Indica si el acumulado de 'ruta' existe y corresponde a su versión actual.
+
+    destino = ruta_acumulado(ruta)
+    if not os.path.exists(destino) or not os.path.exists(ruta):
+        return False
+    ds = pool_datasets.abrir_dataset(destino)
+    try:
+        return ds.attrs.get('origen_acumulado') == origen_archivo(ruta)
+    finally:
+        pool_datasets.liberar_dataset(ds)
+
+
+def lectura(ruta, variable, indice):
+
+    # Traduce la capa (ruta, variable, slice de pasos) de un promedio a la lectura
+    # equivalente sobre el acumulado: (ruta_acumulado, variable, [a-1, b]) con los
+    # pasos a..b del slice, o [b] si comienza en el primer paso. Retorna None si no
+    # hay acumulado vigente con esa variable (se promedia el archivo original).
+
+    destino = ruta_acumulado(ruta)
+    if not os.path.exists(destino) or indice.stop <= indice.start:
+        return None
+    try:
+        ds = pool_datasets.abrir_dataset(destino)
+    except (OSError, ValueError):
+        return None
+    try:
+        if ds.attrs.get('origen_acumulado') != origen_archivo(ruta) or variable not in ds.data_vars:
+            return None
+    finally:
+        pool_datasets.liberar_dataset(ds)
+
+    fin = indice.stop - 1
+    return destino, variable, [fin] if indice.start == 0 else [indice.start - 1, fin]
+
+
+def reducir_promedio(da):
+
+    # Promedio en el tiempo de una capa leída para un promedio: si viene del acumulado
+    # (dimensión 'medida', ver lectura) es la diferencia de sus pasos; si no, el mean
+    # de los pasos leídos.
+
+    if 'medida' not in da.dims:
+        return da.mean(dim='time', keep_attrs=True)
+    if da.sizes['time'] == 2:
+        da = da.isel(time=1) - da.isel(time=0)
+    else:
+        da = da.isel(time=0)
+    suma, validos = da.isel(medida=0), da.isel(medida=1)
+    return suma / validos.where(validos > 0)
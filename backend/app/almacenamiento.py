@@ -0,0 +1,78 @@
+import os
+
+import numpy as np
+
+# Perfiles de almacenamiento para las capas de pertenencia (pr_baja … t2m_alta) y de
+# riesgo (riesgo_*), cuyos valores están siempre en [0, 1].
+#
+#   - float64: sin cambios, float64 sin comprimir (por defecto)
+#   - float32: float32 con compresión zlib
+#   - uint16:  entero escalado (paso 1/65534) con zlib
+#   - uint8:   entero escalado (paso 1/254) con zlib
+#
+# En los perfiles enteros NaN se guarda como _FillValue y el valor real se recupera
+# con scale_factor; xarray (mask_and_scale) los decodifica a float de forma
+# transparente al leer, así que los lectores no necesitan cambios.
+# Respecto de float64, las pertenencias y riesgo_crisp difieren a lo sumo en medio
+# paso (1/508 en uint8); las capas de riesgo fuzzy se calculan desde pertenencias ya
+# cuantizadas y difieren hasta en un paso (≈1/254 en uint8).
+
+PERFILES = {
+    'float64': None,
+    'float32': {
+        'dtype': 'float32',
+        '_FillValue': np.float32(np.nan),
+        'zlib': True,
+        'complevel': 4,
+    },
+    'uint16': {
+        'dtype': 'uint16',
+        'scale_factor': 1.0 / 65534,
+        'add_offset': 0.0,
+        '_FillValue': np.uint16(65535),
+        'zlib': True,
+        'complevel': 4,
+    },
+    'uint8': {
+        'dtype': 'uint8',
+        'scale_factor': 1.0 / 254,
+        'add_offset': 0.0,
+        '_FillValue': np.uint8(255),
+        'zlib': True,
+        'complevel': 4,
+    },
+}
+
+
+def perfil_almacenamiento():
+
+    # Perfil configurado (PERFIL_ALMACENAMIENTO, por defecto 'float64'). Se lee en cada
+    # llamada para respetar el .env.
+
+    return os.getenv("PERFIL_ALMACENAMIENTO", "float64").strip().lower()
+
+
+def codificacion_capas(variables, perfil=None):
+
+    # Devuelve el 'encoding' de to_netcdf para las variables indicadas (todas con
+    # valores en [0, 1]) según el perfil, o None si el perfil no cambia nada.
+
+    if perfil is None:
+        perfil = perfil_almacenamiento()
+    if perfil not in PERFILES:
+        raise ValueError(f"Perfil de almacenamiento desconocido: {perfil}")
+    opciones = PERFILES[perfil]
+    if opciones is None:
+        return None
+    return {nombre: dict(opciones) for nombre in variables}
+
+
+def dtype_perfil(perfil=None):
+
+    # dtype con que el perfil guarda las capas en disco ('float64' si no las cambia).
+
+    if perfil is None:
+        perfil = perfil_almacenamiento()
+    if perfil not in PERFILES:
+        raise ValueError(f"Perfil de almacenamiento desconocido: {perfil}")
+    return (PERFILES[perfil] or {}).get('dtype', 'float64')
@@ -0,0 +1,184 @@
+import os
+import shutil
+
+import numpy as np
+import netCDF4
+from xarray.backends import NetCDF4DataStore
+
+from app import pool_datasets
+
+# Procesamiento por bloques de tiempo para la ingesta.
+#
+# Cada etapa (recorte, capas fuzzy, índices de riesgo) recorre el eje 'time' en
+# bloques cuyo tamaño se deriva de un presupuesto de memoria, lee cada bloque de
+# forma perezosa desde el NetCDF de entrada y lo escribe de inmediato en el NetCDF
+# de salida. Así la memoria máxima depende del presupuesto y no del largo de la serie.
+# Las etapas calculan cada paso de tiempo por separado, así que el resultado coincide
+# con el cálculo en memoria (un único bloque) dentro de la tolerancia de punto flotante.
+#
+# La biblioteca HDF5 no admite llamadas simultáneas desde varios hilos: todas las
+# escrituras (también la creación del archivo, ver crear_archivo) toman el candado
+# con que se abren y leen los datasets del pool (pool_datasets.CANDADO_HDF5), así
+# etapas de la ingesta y peticiones pueden correr en paralelo.
+
+
+def presupuesto_por_defecto():
+
+    # Presupuesto en bytes definido por PRESUPUESTO_BLOQUE_MB (memoria por bloque en MB),
+    # o None si no hay límite: todo el eje temporal se procesa como un único bloque
+    # (comportamiento en memoria). Se lee en cada llamada para respetar el .env.
+
+    megas = os.getenv("PRESUPUESTO_BLOQUE_MB", "").strip()
+    if not megas:
+        return None
+    return int(float(megas) * 1024 * 1024)
+
+
+def bytes_por_paso(obj, copias=1):
+
+    # Memoria aproximada (en float64) de 'copias' arreglos de un paso de tiempo de
+    # obj, que puede ser un DataArray o un Dataset (se suman sus variables con 'time').
+
+    variables = [obj] if not hasattr(obj, 'data_vars') else list(obj.data_vars.values())
+    celdas = 0
+    for var in variables:
+        if 'time' in var.dims:
+            celdas += int(np.prod([n for d, n in var.sizes.items() if d != 'time']))
+    return celdas * np.dtype(np.float64).itemsize * copias
+
+
+def pasos_por_bloque(n_tiempo, bytes_paso, presupuesto=None):
+
+    # Cantidad de pasos de tiempo por bloque para no superar 'presupuesto' bytes
+    # (al menos 1). Sin presupuesto, un único bloque con todo el eje temporal.
+
+    if presupuesto is None:
+        presupuesto = presupuesto_por_defecto()
+    if presupuesto is None or bytes_paso <= 0:
+        return max(n_tiempo, 1)
+    return int(max(1, min(n_tiempo, presupuesto // bytes_paso)))
+
+
+def iterar_bloques(n_tiempo, paso):
+
+    # Genera los rangos (t0, t1) que cubren [0, n_tiempo) en bloques de 'paso'.
+
+    for t0 in range(0, n_tiempo, paso):
+        yield t0, min(t0 + paso, n_tiempo)
+
+
+def guardar_bloques(bloques, ruta, encoding=None):
+
+    # Escribe en 'ruta' una secuencia de Datasets consecutivos a lo largo de 'time'.
+    # El primer bloque crea el archivo (ver crear_archivo); los siguientes se agregan
+    # con netCDF4.
+    # Se escribe en un archivo temporal que reemplaza a 'ruta' al terminar, y antes se
+    # sacan del pool los handles abiertos de 'ruta' (ver app.pool_datasets).
+    # Retorna la ruta escrita.
+
+    pool_datasets.invalidar_dataset(ruta)
+    ruta_tmp = f"{ruta}.tmp"
+    nc = None
+    t0 = 0
+    try:
+        for ds in bloques:
+            if nc is None:
+                nc = crear_archivo(ds, ruta_tmp, encoding)
+            else:
+                agregar_bloque(nc, ds, t0)
+            t0 += ds.sizes['time']
+        if nc is not None:
+            cerrar(nc)
+            nc = None
+            os.replace(ruta_tmp, ruta)
+    finally:
+        if nc is not None:
+            cerrar(nc)
+        if os.path.exists(ruta_tmp):
+            os.remove(ruta_tmp)
+    return ruta
+
+
+def crear_archivo(ds, ruta, encoding=None):
+
+    # Crea 'ruta' con el bloque ds (con 'time' ilimitado y la misma codificación que
+    # to_netcdf) y lo retorna abierto con netCDF4 para agregar los bloques siguientes.
+    # to_netcdf crea variables y atributos sin tomar su candado, por eso se escribe con
+    # el almacén de xarray y todo dentro de CANDADO_HDF5. El bloque se carga antes,
+    # para no tener el candado tomado mientras se calcula.
+
+    ds = ds.load()
+    with pool_datasets.CANDADO_HDF5:
+        almacen = NetCDF4DataStore.open(ruta, mode='w', lock=pool_datasets.CANDADO_HDF5)
+        try:
+            ds.dump_to_store(almacen, encoding=encoding, unlimited_dims=['time'])
+        finally:
+            almacen.close()
+        return netCDF4.Dataset(ruta, 'a')
+
+
+def anexar_bloques(bloques, ruta, atributos=None):
+
+    # Agrega al final del eje 'time' de 'ruta' (un NetCDF con 'time' ilimitado, como
+    # los que escribe guardar_bloques) una secuencia de Datasets consecutivos con las
+    # mismas variables. Se agrega sobre una copia que reemplaza a 'ruta' al terminar,
+    # así los lectores nunca ven el archivo a medio escribir. 'atributos' (opcional)
+    # actualiza los atributos globales del archivo.
+    # Retorna la cantidad de pasos agregados.
+
+    pool_datasets.invalidar_dataset(ruta)
+    ruta_tmp = f"{ruta}.tmp"
+    shutil.copyfile(ruta, ruta_tmp)
+    with pool_datasets.CANDADO_HDF5:
+        nc = netCDF4.Dataset(ruta_tmp, 'a')
+        t0 = n0 = len(nc.dimensions['time'])
+    try:
+        for ds in bloques:
+            agregar_bloque(nc, ds, t0)
+            t0 += ds.sizes['time']
+        if atributos:
+            with pool_datasets.CANDADO_HDF5:
+                nc.setncatts(atributos)
+        cerrar(nc)
+        nc = None
+        os.replace(ruta_tmp, ruta)
+    finally:
+        if nc is not None:
+            cerrar(nc)
+        if os.path.exists(ruta_tmp):
+            os.remove(ruta_tmp)
+    return t0 - n0
+
+
+def agregar_bloque(nc, ds, t0):
+
+    # Copia las variables con dimensión 'time' del bloque ds en el archivo abierto nc,
+    # a partir del paso t0. netCDF4 aplica scale_factor/_FillValue al escribir.
+    # Los valores se leen antes de tomar CANDADO_HDF5, para no tenerlo tomado mientras
+    # se calcula un bloque perezoso.
+
+    n = ds.sizes['time']
+    escrituras = []
+    for nombre, var in ds.variables.items():
+        if 'time' not in var.dims:
+            continue
+        indice = [slice(None)] * var.ndim
+        indice[var.dims.index('time')] = slice(t0, t0 + n)
+        escrituras.append((nombre, tuple(indice), var.values))
+
+    with pool_datasets.CANDADO_HDF5:
+        for nombre, indice, valores in escrituras:
+            destino = nc.variables[nombre]
+            if destino.dtype.kind in 'iu' and valores.dtype.kind == 'f':
+                # NaN → _FillValue en variables enteras empaquetadas. netCDF4 igual
+                # convierte al entero los NaN que quedan bajo la máscara (y numpy avisa
+                # 'invalid value encountered in cast'), pero esos valores no se guardan.
+                with np.errstate(invalid='ignore'):
+                    destino[indice] = np.ma.masked_invalid(valores)
+                continue
+            destino[indice] = valores
+
+
+def cerrar(nc):
+    with pool_datasets.CANDADO_HDF5:
+        nc.close()
@@ -0,0 +1,112 @@
+import os
+import threading
+from collections import OrderedDict
+
+from app.ubicaciones import MACROZONAS
+
+# Caché en memoria de GeoTIFF ya generados.
+#
+# Los NetCDF de la ingesta no cambian una vez escritos, así que un GeoTIFF queda
+# determinado por (NetCDF de origen, su mtime, variable, índice de tiempo, zona).
+# Se guardan los bytes del TIFF con desalojo LRU bajo un presupuesto total en bytes;
+# si /upload reescribe un NetCDF, sus entradas se invalidan explícitamente (y además
+# el mtime nuevo cambia la clave).
+
+CACHE = OrderedDict()            # clave → bytes del TIFF, de menos a más reciente
+ESTADISTICAS = {'aciertos': 0, 'fallos': 0, 'desalojos': 0, 'invalidaciones': 0, 'bytes': 0}
+CANDADO_CACHE = threading.Lock()
+
+
+def presupuesto_bytes():
+
+    # Presupuesto de la caché en bytes (CACHE_GEOTIFF_MB en MB, 0 = desactivada). Se lee
+    # en cada llamada para respetar el .env.
+
+    return int(float(os.getenv("CACHE_GEOTIFF_MB", "256")) * 1024 * 1024)
+
+
+def clave_geotiff(ruta_netcdf, var_name, indice_tiempo, zona, valor):
+
+    # Clave de caché de un GeoTIFF. Para país y macro-zonas el valor no importa.
+    # Para GeoTIFF multibanda ruta_netcdf es una lista de rutas (una por archivo de
+    # origen) y var_name la tupla de variables.
+
+    z = zona.strip().lower()
+    v = '' if z == 'pais' or z in MACROZONAS else valor.strip().lower()
+    if isinstance(ruta_netcdf, (list, tuple)):
+        ruta = tuple(os.path.abspath(r) for r in ruta_netcdf)
+        mtime = tuple(os.path.getmtime(r) for r in ruta_netcdf)
+    else:
+        ruta = os.path.abspath(ruta_netcdf)
+        mtime = os.path.getmtime(ruta_netcdf)
+    return (ruta, mtime, var_name, indice_tiempo, z, v)
+
+
+def obtener(clave):
+
+    # Bytes cacheados para la clave (y la marca como la más reciente), o None.
+
+    with CANDADO_CACHE:
+        datos = CACHE.get(clave)
+        if datos is None:
+            ESTADISTICAS['fallos'] += 1
+            return None
+        CACHE.move_to_end(clave)
+        ESTADISTICAS['aciertos'] += 1
+        return datos
+
+
+def guardar(clave, datos):
+
+    # Agrega una entrada y desaloja las menos usadas hasta respetar el presupuesto.
+    # Un TIFF más grande que todo el presupuesto no se cachea.
+
+    presupuesto = presupuesto_bytes()
+    if len(datos) > presupuesto:
+        return
+    with CANDADO_CACHE:
+        anterior = CACHE.pop(clave, None)
+        if anterior is not None:
+            ESTADISTICAS['bytes'] -= len(anterior)
+        CACHE[clave] = datos
+        ESTADISTICAS['bytes'] += len(datos)
+        while ESTADISTICAS['bytes'] > presupuesto:
+            _, viejo = CACHE.popitem(last=False)
+            ESTADISTICAS['bytes'] -= len(viejo)
+            ESTADISTICAS['desalojos'] += 1
+
+
+def geotiff_cacheado(clave, generar):
+
+    # Devuelve los bytes del GeoTIFF para la clave, generándolo si no está en caché.
+
+    datos = obtener(clave)
+    if datos is not None:
+        return datos
+    return generar_y_guardar(clave, generar)
+
+
+def generar_y_guardar(clave, generar):
+
+    # Llama a generar() (que retorna los bytes del TIFF) y guarda el resultado en caché.
+
+    datos = generar()
+    guardar(clave, datos)
+    return datos
+
+
+def invalidar(ruta_netcdf):
+
+    # Elimina todas las entradas generadas a partir de ruta_netcdf (también las
+    # multibanda que lo incluyen).
+
+    ruta = os.path.abspath(ruta_netcdf)
+    with CANDADO_CACHE:
+        for clave in [c for c in CACHE if ruta in (c[0] if isinstance(c[0], tuple) else (c[0],))]:
+            ESTADISTICAS['bytes'] -= len(CACHE.pop(clave))
+            ESTADISTICAS['invalidaciones'] += 1
+
+
+def estadisticas():
+    with CANDADO_CACHE:
+        return dict(ESTADISTICAS, entradas=len(CACHE), presupuesto=presupuesto_bytes())
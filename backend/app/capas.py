@@ -0,0 +1,98 @@
+from app import catalogo, reglas
+from app.procesar import VARIABLES_RIESGO_FUZZY
+
+# Capas que sirve /api/layer.
+#
+# Cada capa es una variable de un NetCDF registrado en la tabla 'archivos'; la entrada
+# indica cómo encontrar ese archivo en el catálogo (tipo_archivo, prefijo del nombre y
+# si debe ser un riesgo final; ver app.catalogo).
+
+CAPAS = {
+    'pr':        {'tipo_archivo': 'pr',  'prefijo': None,         'riesgo_final': False, 'descripcion': 'precipitación'},
+    'pr_baja':   {'tipo_archivo': 'pr',  'prefijo': 'fuzzy_pr_',  'riesgo_final': False, 'descripcion': 'fuzzy de precipitación'},
+    'pr_media':  {'tipo_archivo': 'pr',  'prefijo': 'fuzzy_pr_',  'riesgo_final': False, 'descripcion': 'fuzzy de precipitación'},
+    'pr_alta':   {'tipo_archivo': 'pr',  'prefijo': 'fuzzy_pr_',  'riesgo_final': False, 'descripcion': 'fuzzy de precipitación'},
+    't2m':       {'tipo_archivo': 't2m', 'prefijo': None,         'riesgo_final': False, 'descripcion': 'temperatura'},
+    't2m_baja':  {'tipo_archivo': 't2m', 'prefijo': 'fuzzy_t2m_', 'riesgo_final': False, 'descripcion': 'fuzzy de temperatura'},
+    't2m_media': {'tipo_archivo': 't2m', 'prefijo': 'fuzzy_t2m_', 'riesgo_final': False, 'descripcion': 'fuzzy de temperatura'},
+    't2m_alta':  {'tipo_archivo': 't2m', 'prefijo': 'fuzzy_t2m_', 'riesgo_final': False, 'descripcion': 'fuzzy de temperatura'},
+    'riesgo_crisp': {'tipo_archivo': 'riesgo_crisp', 'prefijo': None, 'riesgo_final': True, 'descripcion': 'riesgo_crisp'},
+}
+CAPA_RIESGO_FUZZY = {'tipo_archivo': 'riesgo_fuzzy', 'prefijo': None, 'riesgo_final': True, 'descripcion': 'riesgo_fuzzy'}
+# Todas las variables del NetCDF de riesgo fuzzy (componentes, agregados y riesgo_fuzzy)
+for _var in VARIABLES_RIESGO_FUZZY:
+    CAPAS[_var] = CAPA_RIESGO_FUZZY
+
+
+def spec_capa(nombre):
+
+    # Entrada de CAPAS para 'nombre'; las variables de una base de reglas propia
+    # (BASE_REGLAS_RUTA, ver app.reglas) también son capas de riesgo fuzzy.
+
+    if nombre in CAPAS:
+        return CAPAS[nombre]
+    if nombre in reglas.base_activa()['variables']:
+        return CAPA_RIESGO_FUZZY
+    return None
+
+
+def rango_promedio(fila, promedio):
+
+    # Pasos (slice) del archivo de 'fila' que entran en el promedio:
+    #   - promedio = n meses: los últimos n meses publicados (o todos, si hay menos)
+    #   - promedio = (desde, hasta) ("YYYY-MM"): esos meses, que deben estar en el archivo
+
+    fin = catalogo.indice_fila(fila, fila['fecha_final_datos'])
+    if not isinstance(promedio, tuple):
+        return slice(max(0, fin - promedio + 1), fin + 1)
+
+    desde, hasta = promedio
+    if catalogo.indice_mes(desde, fila['fecha_inicial_datos']) < 0:
+        raise ValueError(
+            f"La ventana {desde}:{hasta} comienza antes de los datos disponibles ({fila['fecha_inicial_datos'][:7]})"
+        )
+    return slice(catalogo.indice_fila(fila, desde), catalogo.indice_fila(fila, hasta) + 1)
+
+
+def resolver_capas(nombres, fecha=None, promedio=None):
+
+    # Resuelve cada capa a (ruta_netcdf, variable, indice_tiempo), en el orden pedido.
+    #   - con 'fecha' ("YYYY-MM") se usa el archivo que cubre ese mes y su índice
+    #   - con 'promedio' se usa un slice de pasos (ver rango_promedio): con n meses, del
+    #     archivo más reciente; con (desde, hasta), del archivo que cubre 'hasta'
+    # Lanza ValueError si la petición es inválida (400) y LookupError si no hay
+    # archivo para alguna capa (404).
+
+    desconocidas = [n for n in nombres if spec_capa(n) is None]
+    if desconocidas:
+        raise ValueError(f"Capa desconocida: {', '.join(desconocidas)}")
+    if not nombres:
+        raise ValueError("No se indicó ninguna capa")
+    if isinstance(promedio, tuple):
+        if catalogo.indice_mes(promedio[1], promedio[0]) < 0:
+            raise ValueError(f"Ventana inválida: {promedio[0]} es posterior a {promedio[1]}")
+        fecha = promedio[1]
+
+    resultado = []
+    for nombre in nombres:
+        spec = spec_capa(nombre)
+        fila = catalogo.buscar(spec['tipo_archivo'], fecha, spec['prefijo'], spec['riesgo_final'])
+        if not fila:
+            if fecha:
+                raise LookupError(f"No hay datos de {spec['descripcion']} para {fecha}")
+            raise LookupError(f"No se encontró archivo de {spec['descripcion']}")
+        if spec['tipo_archivo'] == 'riesgo_fuzzy' and fila.get('variables') \
+                and nombre not in fila['variables'].split(','):
+            # Con SALIDA_RIESGO_FUZZY=agregados no se guardan las componentes
+            raise LookupError(f"El archivo de {spec['descripcion']} no guarda la capa {nombre}")
+
+        if promedio is not None:
+            indice = rango_promedio(fila, promedio)
+        else:
+            meses = catalogo.indice_mes(fila['fecha_final_datos'], fila['fecha_inicial_datos']) + 1
+            relativo = catalogo.indice_mes(fecha, fila['fecha_inicial_datos'])
+            if relativo < 0 or relativo >= meses:
+                raise ValueError(f"Índice de tiempo fuera de rango (0–{meses - 1})")
+            indice = catalogo.indice_fila(fila, fecha)
+        resultado.append((fila['ruta'], nombre, indice))
+    return resultado
@@ -0,0 +1,167 @@
+import os
+import time
+import datetime
+import threading
+
+from app.database import obtener_conexion, liberar_conexion
+
+# Catálogo en memoria de la tabla 'archivos'.
+#
+# La tabla sólo cambia en /upload, así que las rutas de lectura resuelven
+# (tipo de archivo, mes) → (ruta, índice de tiempo) desde memoria en vez de consultar
+# la BD en cada petición. El catálogo se carga en la primera consulta, /upload lo
+# refresca al terminar y cada resolución queda memorizada en un dict hasta el
+# siguiente refresco.
+
+# 'vista' = {'filas': [...], 'resoluciones': {...}}; se reemplaza entera en cada
+# refresco, así una consulta nunca mezcla filas viejas con resoluciones nuevas
+CATALOGO = {'vista': None, 'cargado': 0.0}
+CANDADO_CATALOGO = threading.Lock()
+
+
+def leer_archivos(conn=None):
+
+    # Lee de la BD las filas de 'archivos' como dicts, de la más reciente a la más
+    # antigua (por fecha_final_datos y luego fecha_subida). Usa 'conn' si se entrega
+    # (p.ej. la de /upload, que ya tiene una prestada); si no, una del pool.
+
+    propia = conn is None
+    if propia:
+        conn = obtener_conexion()
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT nombre, ruta, variables, tipo_archivo, nombre_base,
+                   fecha_inicial_datos, fecha_final_datos, es_riesgo_final, fecha_subida,
+                   desfase
+            FROM archivos
+        """)
+        columnas = [c[0] for c in cur.description]
+        filas = [dict(zip(columnas, fila)) for fila in cur.fetchall()]
+        cur.close()
+    finally:
+        if propia:
+            liberar_conexion(conn)
+
+    filas.sort(key=lambda f: str(f['fecha_subida'] or ''), reverse=True)
+    filas.sort(key=lambda f: f['fecha_final_datos'] or '', reverse=True)
+    return filas
+
+
+def refrescar(conn=None):
+
+    # Recarga el catálogo desde la BD y descarta las resoluciones memorizadas.
+    # Retorna la vista nueva.
+
+    vista = {'filas': leer_archivos(conn), 'resoluciones': {}}
+    with CANDADO_CATALOGO:
+        CATALOGO['vista'] = vista
+        CATALOGO['cargado'] = time.monotonic()
+    return vista
+
+
+def invalidar():
+
+    # Marca el catálogo para recargarlo en la próxima consulta.
+
+    with CANDADO_CATALOGO:
+        CATALOGO['vista'] = None
+
+
+def ttl_catalogo():
+
+    # Segundos tras los cuales el catálogo se recarga aunque nadie lo haya refrescado
+    # (CATALOGO_TTL_S; 0 = nunca, útil si varios procesos comparten la BD y sólo uno
+    # recibe los /upload). Se lee en cada consulta para respetar el .env.
+
+    return float(os.getenv("CATALOGO_TTL_S", "0"))
+
+
+def vista_catalogo():
+
+    # Vista vigente del catálogo (cargándola desde la BD si hace falta).
+
+    vista = CATALOGO['vista']
+    ttl = ttl_catalogo()
+    vencido = ttl > 0 and time.monotonic() - CATALOGO['cargado'] > ttl
+    if vista is None or vencido:
+        vista = refrescar()
+    return vista
+
+
+def buscar(tipo_archivo, fecha=None, prefijo=None, riesgo_final=False):
+
+    # Fila más reciente de 'archivos' del tipo pedido (con nombre que empieza por
+    # 'prefijo' y marcada como riesgo final, si se indica) que cubre 'fecha'
+    # ("YYYY-MM"; None = la más reciente). Equivale a la consulta
+    #   SELECT … WHERE tipo_archivo = … AND fecha_inicial_datos <= fecha
+    #   AND fecha_final_datos >= fecha ORDER BY fecha_final_datos DESC LIMIT 1
+    # Retorna el dict de la fila o None.
+
+    vista = vista_catalogo()
+    clave = (tipo_archivo, fecha, prefijo, riesgo_final)
+    if clave in vista['resoluciones']:
+        return vista['resoluciones'][clave]
+
+    encontrada = None
+    for fila in vista['filas']:
+        if fila['tipo_archivo'] != tipo_archivo:
+            continue
+        if prefijo and not fila['nombre'].startswith(prefijo):
+            continue
+        if riesgo_final and not fila['es_riesgo_final']:
+            continue
+        if fecha and not (fila['fecha_inicial_datos'] <= fecha <= fila['fecha_final_datos']):
+            continue
+        encontrada = fila
+        break
+
+    vista['resoluciones'][clave] = encontrada
+    return encontrada
+
+
+def indice_mes(fecha, fecha_inicial):
+
+    # Índice de tiempo de 'fecha' ("YYYY-MM") en un NetCDF que comienza en fecha_inicial.
+
+    pedida  = datetime.datetime.strptime(fecha.strip()[:7], "%Y-%m").date()
+    inicial = datetime.datetime.strptime(fecha_inicial[:7], "%Y-%m").date()
+    return (pedida.year - inicial.year) * 12 + (pedida.month - inicial.month)
+
+
+def indice_fila(fila, fecha):
+
+    # Índice de tiempo de 'fecha' dentro del NetCDF de la fila. Las series de la
+    # ingesta incremental publican una ventana que comienza en el paso 'desfase'.
+
+    return (fila.get('desfase') or 0) + indice_mes(fecha, fila['fecha_inicial_datos'])
+
+
+def resolver(tipo_archivo, fecha, prefijo=None, riesgo_final=False):
+
+    # (ruta, índice de tiempo) del NetCDF que cubre 'fecha', o None si no hay.
+
+    fila = buscar(tipo_archivo, fecha, prefijo, riesgo_final)
+    if fila is None:
+        return None
+    return fila['ruta'], indice_fila(fila, fecha)
+
+
+def meses_disponibles(tipo_archivo, riesgo_final=False):
+
+    # Meses ("YYYY-MM", ordenados) cubiertos por algún archivo del tipo indicado.
+
+    fechas = set()
+    for fila in vista_catalogo()['filas']:
+        if fila['tipo_archivo'] != tipo_archivo or (riesgo_final and not fila['es_riesgo_final']):
+            continue
+        año_ini, mes_ini = map(int, fila['fecha_inicial_datos'].split("-")[:2])
+        año_fin, mes_fin = map(int, fila['fecha_final_datos'].split("-")[:2])
+        # Genera todos los meses entre inicio y fin
+        while (año_ini < año_fin) or (año_ini == año_fin and mes_ini <= mes_fin):
+            fechas.add(f"{año_ini}-{mes_ini:02d}")
+            mes_ini += 1
+            if mes_ini > 12:
+                mes_ini = 1
+                año_ini += 1
+    return sorted(fechas)
@@ -1,10 +1,149 @@
 import psycopg2
+import psycopg2.pool
 import os
+import sqlite3
+import threading
 
-def get_connection():
-    return psycopg2.connect(
+# Conexiones a la BD del catálogo ('archivos').
+#
+# El motor se elige con CATALOGO_BACKEND:
+#   - 'postgres' (por defecto): servidor PostgreSQL según DB_HOST/DB_USER/…
+#   - 'sqlite': archivo SQLite local en modo WAL (SQLITE_RUTA), para instalaciones de
+#     un solo equipo sin servidor de BD
+# El esquema es el mismo en ambos (ver app.migraciones) y las consultas se escriben
+# una sola vez con marcadores %s; en SQLite se traducen al vuelo.
+#
+# get_connection() abre una conexión nueva (la cierra quien la pidió). Las rutas usan
+# en cambio conn = obtener_conexion() … liberar_conexion(conn), que en PostgreSQL
+# reutiliza conexiones de un pool en vez de pagar el establecimiento de cada una.
+
+# Pool de PostgreSQL y semáforo que limita las conexiones prestadas a DB_POOL_MAX (si
+# el pool está agotado se espera a que se libere una en vez de fallar). Se crean en el
+# primer uso (ver obtener_pool)
+POOL = None
+CUPOS = None
+CANDADO_POOL = threading.Lock()
+
+BACKENDS = ('postgres', 'sqlite')
+
+
+def backend_catalogo():
+
+    # Motor configurado. Se lee en cada llamada para respetar el .env, que server.py
+    # carga después de importar los módulos.
+
+    backend = os.getenv("CATALOGO_BACKEND", "postgres").strip().lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"CATALOGO_BACKEND desconocido: {backend} (use {', '.join(BACKENDS)})")
+    return backend
+
+
+def ruta_sqlite():
+    return os.getenv("SQLITE_RUTA", "uploads/catalogo.sqlite")
+
+
+def parametros_conexion():
+    return dict(
         host=os.getenv("DB_HOST", "localhost"),
         user=os.getenv("DB_USER", "postgres"),
         password=os.getenv("DB_PASSWORD", "password"),
         dbname=os.getenv("DB_NAME", "riesgo_hidrico")
     )
+
+
+class CursorSQLite(sqlite3.Cursor):
+
+    # Cursor que acepta el SQL escrito para psycopg2 (marcadores %s).
+
+    def execute(self, sql, parametros=()):
+        return super().execute(traducir_sql(sql), parametros)
+
+    def executemany(self, sql, parametros):
+        return super().executemany(traducir_sql(sql), parametros)
+
+
+class ConexionSQLite(sqlite3.Connection):
+
+    def cursor(self, factory=CursorSQLite):
+        return super().cursor(factory)
+
+
+def traducir_sql(sql):
+
+    # Pasa el SQL de estilo psycopg2 a sqlite3: %s → ? y %% → %.
+
+    return sql.replace('%s', '?').replace('%%', '%')
+
+
+def conectar_sqlite():
+
+    # Abre el archivo SQLite del catálogo en modo WAL (lectores concurrentes con un
+    # escritor) y con espera ante bloqueos en vez de fallar de inmediato.
+
+    ruta = ruta_sqlite()
+    os.makedirs(os.path.dirname(ruta) or '.', exist_ok=True)
+    conn = sqlite3.connect(ruta, timeout=30, factory=ConexionSQLite)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def get_connection():
+    if backend_catalogo() == 'sqlite':
+        return conectar_sqlite()
+    return psycopg2.connect(**parametros_conexion())
+
+
+def tamano_pool():
+
+    # (mínimo abiertas, máximo simultáneas) del pool según DB_POOL_MIN/DB_POOL_MAX. Se
+    # lee al crear el pool, igual que backend_catalogo, para respetar el .env.
+
+    return int(os.getenv("DB_POOL_MIN", "1")), int(os.getenv("DB_POOL_MAX", "8"))
+
+
+def obtener_pool():
+
+    # Pool compartido por los hilos del proceso (se crea en el primer uso, junto con
+    # el semáforo CUPOS del mismo tamaño).
+
+    global POOL, CUPOS
+    with CANDADO_POOL:
+        if POOL is None:
+            minimo, maximo = tamano_pool()
+            POOL = psycopg2.pool.ThreadedConnectionPool(minimo, maximo, **parametros_conexion())
+            CUPOS = threading.BoundedSemaphore(maximo)
+        return POOL
+
+
+def obtener_conexion():
+
+    # Presta una conexión (del pool en PostgreSQL; en SQLite abrir el archivo local es
+    # barato y cada hilo usa la suya). Cada llamada debe emparejarse con liberar_conexion.
+
+    if backend_catalogo() == 'sqlite':
+        return conectar_sqlite()
+
+    pool = obtener_pool()
+    CUPOS.acquire()
+    try:
+        return pool.getconn()
+    except Exception:
+        CUPOS.release()
+        raise
+
+
+def liberar_conexion(conn):
+
+    # Devuelve la conexión. Una transacción pendiente se descarta (rollback) y una
+    # conexión rota se cierra en vez de reutilizarse.
+
+    if isinstance(conn, sqlite3.Connection):
+        conn.rollback()
+        conn.close()
+        return
+
+    try:
+        obtener_pool().putconn(conn, close=bool(conn.closed))
+    finally:
+        CUPOS.release()
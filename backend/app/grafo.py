@@ -0,0 +1,171 @@
+import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from app.database import obtener_conexion, liberar_conexion
+
+# Grafo de dependencias (DAG) de los artefactos de la ingesta.
+#
+# Cada etapa es un nodo con las etapas de las que depende ('entradas'). Un nodo queda
+# listo cuando sus entradas se resolvieron y se ejecuta en un pool de hilos, así las
+# etapas independientes (p.ej. las capas fuzzy de pr y t2m, o el riesgo crisp junto a
+# las capas fuzzy) corren a la vez.
+#
+# Al resolverse, cada nodo produce {'ruta', 'huella', …}. Su huella se calcula con las
+# huellas de sus entradas; si coincide con la que quedó registrada al generarlo, y el
+# archivo sigue en disco, el nodo se reutiliza sin recalcular. Así sólo se reconstruye
+# lo que está aguas abajo de una entrada que cambió. Las huellas de las entradas con
+# que se generó cada archivo quedan en archivos.entradas, para saber qué lo invalidó.
+#
+# Un nodo es un dict con:
+#   'entradas'  : nombres de los nodos de los que depende (por defecto ninguno)
+#   'clave'     : artefacto que produce; dos nodos con la misma clave (de trabajos
+#                 distintos) no se ejecutan a la vez
+#   'actual'    : actual(cur) → {'ruta', 'huella', 'entradas'} de lo registrado, o None
+#   'huella'    : huella(*huellas_entradas) → huella que tendría el nodo recalculado
+#   'construir' : construir(*resultados_entradas) → {'ruta', …} (None: no hay datos
+#                 para generarlo, p.ej. meses sin traslape). Puede devolver 'huella'
+#                 y 'estado' para imponerlos. Sin 'construir' el nodo es una fuente:
+#                 sólo se consulta lo registrado
+#   'registrar' : registrar(cur, resultado) guarda el resultado en el catálogo;
+#                 resultado trae además 'entradas' (huella de cada entrada) y
+#                 'anterior' (ruta registrada antes, o None)
+# Un nodo cuya entrada no se pudo resolver queda 'omitida' (p.ej. el riesgo cuando aún
+# no se sube la otra variable).
+
+# Candados por artefacto (ver candado_artefacto)
+CANDADOS_ARTEFACTO = {}
+CANDADO_ARTEFACTOS = threading.Lock()
+
+
+def etapas_workers():
+
+    # Etapas de un mismo trabajo que se ejecutan a la vez (INGESTA_ETAPAS_WORKERS). Cada
+    # etapa reserva su propio presupuesto de memoria por bloques (ver app.bloques).
+
+    return max(1, int(os.getenv("INGESTA_ETAPAS_WORKERS", "2")))
+
+
+def candado_artefacto(clave):
+
+    # Candado asociado a 'clave' (se crea en el primer uso).
+
+    with CANDADO_ARTEFACTOS:
+        return CANDADOS_ARTEFACTO.setdefault(clave, threading.Lock())
+
+
+def entradas_registradas(texto):
+    return json.loads(texto) if texto else {}
+
+
+def vigente(actual, huella_nodo):
+
+    # Lo registrado se puede reutilizar si se generó con las mismas entradas y su
+    # archivo sigue en disco.
+
+    return (
+        actual is not None and bool(actual['ruta'])
+        and actual['huella'] == huella_nodo and os.path.exists(actual['ruta'])
+    )
+
+
+def cambios(actual, huellas):
+
+    # Entradas cuya huella cambió respecto de lo registrado (motivo de la reconstrucción).
+
+    if actual is None:
+        return []
+    previas = actual.get('entradas') or {}
+    return [nombre for nombre, h in huellas.items() if previas.get(nombre) != h]
+
+
+def resolver_nodo(nombre, nodo, entradas, avisar):
+
+    # Resuelve un nodo cuyas entradas ya están resueltas ('entradas': nombre → resultado
+    # o None). Corre en un hilo del pool, con su propia conexión a la BD.
+    # Retorna el resultado del nodo, o None si quedó omitido.
+
+    if any(resultado is None for resultado in entradas.values()):
+        avisar(nombre, 'omitida')
+        return None
+
+    with candado_artefacto(nodo['clave']):
+        conn = obtener_conexion()
+        try:
+            cur = conn.cursor()
+            actual = nodo['actual'](cur)
+
+            if 'construir' not in nodo:
+                if actual is not None and not os.path.exists(actual['ruta']):
+                    actual = None
+                cur.close()
+                avisar(nombre, 'reutilizada' if actual else 'omitida')
+                return actual
+
+            huellas = {e: resultado['huella'] for e, resultado in entradas.items()}
+            huella_nodo = nodo['huella'](*huellas.values())
+            if vigente(actual, huella_nodo):
+                cur.close()
+                avisar(nombre, 'reutilizada')
+                return actual
+
+            motivo = cambios(actual, huellas)
+            avisar(nombre, 'en_proceso', f"cambió {', '.join(motivo)}" if motivo else None)
+            resultado = nodo['construir'](*entradas.values())
+            if resultado is None:
+                cur.close()
+                avisar(nombre, 'omitida')
+                return None
+
+            resultado.setdefault('huella', huella_nodo)
+            resultado['entradas'] = huellas
+            resultado['anterior'] = actual and actual['ruta']
+            nodo['registrar'](cur, resultado)
+            conn.commit()
+            cur.close()
+            avisar(nombre, resultado.pop('estado', 'completada'))
+            return resultado
+        finally:
+            liberar_conexion(conn)
+
+
+def ejecutar_grafo(nodos, avisar, resueltos=None, workers=None):
+
+    # Ejecuta los nodos de 'nodos' (nombre → nodo) respetando sus dependencias, con
+    # hasta 'workers' nodos a la vez. 'resueltos' son resultados ya conocidos que los
+    # nodos pueden usar como entradas. avisar(nombre, estado, motivo=None) se llama
+    # desde los hilos del pool, de a una llamada por vez; al reconstruir un nodo ya
+    # registrado, 'motivo' indica qué entradas cambiaron.
+    # Retorna nombre → resultado (None para los nodos omitidos). Si un nodo falla, se
+    # espera a los que estaban en curso y se propaga el error.
+
+    resultados = dict(resueltos or {})
+    pendientes = {nombre: nodo for nombre, nodo in nodos.items() if nombre not in resultados}
+    en_curso   = {}
+    candado_aviso = threading.Lock()
+
+    def avisar_en_orden(nombre, estado, motivo=None):
+        with candado_aviso:
+            avisar(nombre, estado, motivo)
+
+    with ThreadPoolExecutor(max_workers=workers or etapas_workers(), thread_name_prefix='etapa') as ejecutor:
+        while pendientes or en_curso:
+            listos = [
+                nombre for nombre, nodo in pendientes.items()
+                if all(e in resultados for e in nodo.get('entradas', ()))
+            ]
+            for nombre in listos:
+                nodo = pendientes.pop(nombre)
+                entradas = {e: resultados[e] for e in nodo.get('entradas', ())}
+                futuro = ejecutor.submit(resolver_nodo, nombre, nodo, entradas, avisar_en_orden)
+                en_curso[futuro] = nombre
+
+            if not en_curso:
+                raise ValueError(f"Dependencias sin resolver en el grafo: {', '.join(pendientes)}")
+
+            hechos, _ = wait(en_curso, return_when=FIRST_COMPLETED)
+            for futuro in hechos:
+                resultados[en_curso.pop(futuro)] = futuro.result()
+
+    return resultados
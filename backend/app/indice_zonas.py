@@ -0,0 +1,325 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+
+import numpy as np
+from rasterio.transform import from_origin
+from affine import Affine
+from rasterio import features
+
+from app.ubicaciones import ZONE_MAP, MACROZONAS, capa_zonas
+
+# Índice de zonas por rejilla.
+#
+# Para cada rejilla NetCDF distinta (identificada por una firma de sus arreglos lat/lon)
+# se rasterizan una sola vez las regiones, provincias y comunas como rasters de
+# etiquetas enteras (etiqueta = fila del shapefile, -1 = fuera de toda zona). Los
+# rasters se guardan en disco como .npy y se abren con memory-map, de modo que
+# recortar una zona se reduce a comparar etiquetas en vez de leer y rasterizar el
+# shapefile en cada petición.
+#
+# Los rasters se guardan en orientación canónica (latitudes Norte→Sur, longitudes
+# Oeste→Este), con la misma transformación que usa generar_geotiff_zona. Si los
+# shapefiles cambian (mtime distinto) el índice de la rejilla se reconstruye.
+#
+# La ingesta deja todos los NetCDF en esa orientación canónica y les agrega como
+# atributos globales la firma y el transform de la rejilla (ver orientar_dataset), así
+# que al leerlos no hay que invertir ejes ni recalcular nada. Los archivos anteriores,
+# sin esos atributos, se siguen leyendo orientándolos al vuelo.
+
+# Índices abiertos en este proceso, por firma de rejilla
+INDICES = {}
+CANDADO_INDICES = threading.Lock()
+
+# Atributos globales con que la ingesta marca un NetCDF en orientación canónica
+ATRIBUTOS_REJILLA = ('orientacion', 'firma_rejilla', 'transform')
+ORIENTACION_CANONICA = 'lat norte-sur, lon oeste-este'
+
+
+def orientar_rejilla(lats, lons):
+
+    # Devuelve (lats, lons, voltear_lat, voltear_lon) con la rejilla en orientación
+    # canónica: latitudes descendentes y longitudes ascendentes.
+
+    voltear_lat = lats[0] < lats[-1]
+    voltear_lon = lons[0] > lons[-1]
+    if voltear_lat:
+        lats = lats[::-1]
+    if voltear_lon:
+        lons = lons[::-1]
+    return lats, lons, voltear_lat, voltear_lon
+
+
+def firma_rejilla(lats, lons):
+
+    # Firma corta de la rejilla (en orientación canónica), usada como nombre del índice.
+
+    lats, lons, _, _ = orientar_rejilla(np.asarray(lats), np.asarray(lons))
+    h = hashlib.sha1()
+    h.update(np.ascontiguousarray(lats, dtype=np.float64).tobytes())
+    h.update(b'|')
+    h.update(np.ascontiguousarray(lons, dtype=np.float64).tobytes())
+    return h.hexdigest()[:16]
+
+
+def transform_rejilla(lats, lons):
+
+    # Transformación affine de la rejilla canónica (igual a la de generar_geotiff_zona).
+
+    dx = float(lons[1] - lons[0])
+    dy = float(lats[0] - lats[1])
+    return from_origin(west=lons.min(), north=lats.max(), xsize=dx, ysize=dy)
+
+
+def atributos_rejilla(lats, lons):
+
+    # Atributos globales que describen una rejilla ya orientada (ver orientar_dataset).
+
+    return {
+        'orientacion': ORIENTACION_CANONICA,
+        'firma_rejilla': firma_rejilla(lats, lons),
+        'transform': [float(c) for c in list(transform_rejilla(lats, lons))[:6]],
+    }
+
+
+def orientar_dataset(ds):
+
+    # Devuelve ds en orientación canónica (invirtiendo lat/lon de forma perezosa si
+    # hace falta) y con los atributos de su rejilla. Se aplica una sola vez, al ingerir.
+
+    lats, lons, voltear_lat, voltear_lon = orientar_rejilla(ds['lat'].values, ds['lon'].values)
+    if voltear_lat:
+        ds = ds.isel(lat=slice(None, None, -1))
+    if voltear_lon:
+        ds = ds.isel(lon=slice(None, None, -1))
+    return ds.assign_attrs(atributos_rejilla(lats, lons))
+
+
+def atributos_guardados(ds):
+
+    # Atributos de rejilla presentes en ds, para copiarlos a los archivos derivados.
+
+    return {k: ds.attrs[k] for k in ATRIBUTOS_REJILLA if k in ds.attrs}
+
+
+def rejilla_dataset(ds):
+
+    # Describe la rejilla de ds como dict con 'lats', 'lons' (canónicas), 'voltear_lat',
+    # 'voltear_lon' (ejes del archivo invertidos), 'firma' y 'transform'.
+    # Si el archivo viene de la ingesta se toma tal cual de sus atributos; si no
+    # (archivos anteriores) se orienta y se calcula aquí.
+
+    if all(k in ds.attrs for k in ATRIBUTOS_REJILLA):
+        return {
+            'lats': ds['lat'].values,
+            'lons': ds['lon'].values,
+            'voltear_lat': False,
+            'voltear_lon': False,
+            'firma': str(ds.attrs['firma_rejilla']),
+            'transform': Affine(*(float(c) for c in ds.attrs['transform'][:6])),
+        }
+    lats, lons, voltear_lat, voltear_lon = orientar_rejilla(ds['lat'].values, ds['lon'].values)
+    return {
+        'lats': lats,
+        'lons': lons,
+        'voltear_lat': voltear_lat,
+        'voltear_lon': voltear_lon,
+        'firma': firma_rejilla(lats, lons),
+        'transform': transform_rejilla(lats, lons),
+    }
+
+
+def mtimes_shapefiles():
+    return {nivel: os.path.getmtime(shp) for nivel, (shp, _) in ZONE_MAP.items()}
+
+
+def construir_indice(lats, lons, carpeta):
+
+    # Rasteriza los tres niveles de zona sobre la rejilla y los guarda en 'carpeta'
+    # (etiquetas .npy + meta.json). Escribe en una carpeta temporal y la renombra al
+    # final, para que un índice a medio escribir nunca quede visible.
+
+    lats, lons, _, _ = orientar_rejilla(np.asarray(lats), np.asarray(lons))
+    transform = transform_rejilla(lats, lons)
+    forma = (len(lats), len(lons))
+
+    meta = {
+        'forma': list(forma),
+        'transform': list(transform)[:6],
+        'mtimes': mtimes_shapefiles(),
+        'nombres': {},
+        'macrozonas': {},
+    }
+
+    os.makedirs(os.path.dirname(carpeta) or '.', exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=os.path.dirname(carpeta) or '.')
+    try:
+        for nivel, (_, campo) in ZONE_MAP.items():
+            gdf = capa_zonas(nivel)
+            etiquetas = features.rasterize(
+                [(geom, i) for i, geom in enumerate(gdf.geometry)],
+                out_shape=forma,
+                transform=transform,
+                fill=-1,
+                dtype='int16'
+            )
+            np.save(os.path.join(tmp, f"{nivel}.npy"), etiquetas)
+            meta['nombres'][nivel] = [str(n).strip() for n in gdf[campo]]
+
+        # Macro-zonas: etiquetas de región que las componen (país = todas)
+        regiones = meta['nombres']['region']
+        meta['macrozonas']['pais'] = list(range(len(regiones)))
+        for macro, lista in MACROZONAS.items():
+            meta['macrozonas'][macro] = [i for i, n in enumerate(regiones) if n in lista]
+
+        with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+        if os.path.isdir(carpeta):
+            shutil.rmtree(carpeta)
+        os.replace(tmp, carpeta)
+    except Exception:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+
+def abrir_indice(carpeta):
+
+    # Abre un índice guardado (rasters con memory-map). Retorna None si la carpeta no
+    # contiene un índice completo o si los shapefiles cambiaron desde que se construyó.
+
+    ruta_meta = os.path.join(carpeta, 'meta.json')
+    if not os.path.exists(ruta_meta):
+        return None
+    with open(ruta_meta, encoding='utf-8') as f:
+        meta = json.load(f)
+    if meta['mtimes'] != mtimes_shapefiles():
+        return None
+    indice = dict(meta)
+    indice['etiquetas'] = {
+        nivel: np.load(os.path.join(carpeta, f"{nivel}.npy"), mmap_mode='r')
+        for nivel in ZONE_MAP
+    }
+    # nombre normalizado → etiquetas (puede haber nombres repetidos)
+    indice['buscar'] = {}
+    for nivel, nombres in meta['nombres'].items():
+        tabla = {}
+        for i, nombre in enumerate(nombres):
+            tabla.setdefault(nombre.lower(), []).append(i)
+        indice['buscar'][nivel] = tabla
+    return indice
+
+
+def carpeta_indices():
+
+    # Carpeta de los índices en disco (CARPETA_INDICES_ZONAS). Se lee en cada llamada
+    # para respetar el .env.
+
+    return os.getenv("CARPETA_INDICES_ZONAS", "uploads/indices_zonas")
+
+
+def cargar_indices_guardados(carpeta=None):
+
+    # Abre con memory-map todos los índices guardados en disco (al iniciar el servidor).
+
+    carpeta = carpeta or carpeta_indices()
+    if not os.path.isdir(carpeta):
+        return
+    for firma in os.listdir(carpeta):
+        indice = abrir_indice(os.path.join(carpeta, firma))
+        if indice is not None:
+            with CANDADO_INDICES:
+                INDICES[firma] = indice
+
+
+def obtener_indice(rejilla):
+
+    # Índice de zonas para la rejilla (ver rejilla_dataset): desde memoria, desde disco
+    # o construyéndolo la primera vez que se ve esa rejilla.
+
+    firma = rejilla['firma']
+    indice = INDICES.get(firma)
+    if indice is not None and indice['mtimes'] == mtimes_shapefiles():
+        return indice
+
+    with CANDADO_INDICES:
+        carpeta = os.path.join(carpeta_indices(), firma)
+        indice = abrir_indice(carpeta)
+        if indice is None:
+            construir_indice(rejilla['lats'], rejilla['lons'], carpeta)
+            indice = abrir_indice(carpeta)
+        INDICES[firma] = indice
+    return indice
+
+
+def etiquetas_zona(indice, zona, valor):
+
+    # Devuelve (nivel, etiquetas) que componen la zona pedida.
+
+    z = zona.strip().lower()
+    if z in indice['macrozonas']:
+        etiquetas = indice['macrozonas'][z]
+        if not etiquetas:
+            raise ValueError(f"No se encontraron regiones para la zona '{zona}'")
+        return 'region', etiquetas
+
+    if z not in ZONE_MAP:
+        raise ValueError(f"Zona inválida: {zona}")
+    etiquetas = indice['buscar'][z].get(valor.strip().lower())
+    if not etiquetas:
+        raise ValueError(f"No se encontró {zona} con nombre '{valor}'")
+    return z, etiquetas
+
+
+def mascara_zona(rejilla, zona, valor):
+
+    # Máscara booleana (lat, lon) de la zona sobre la rejilla, en orientación canónica
+    # (latitudes Norte→Sur, longitudes Oeste→Este).
+
+    indice = obtener_indice(rejilla)
+    nivel, etiquetas = etiquetas_zona(indice, zona, valor)
+    raster = indice['etiquetas'][nivel]
+    if len(etiquetas) == 1:
+        return raster == etiquetas[0]
+    if zona.strip().lower() == 'pais':
+        return raster >= 0
+    return np.isin(raster, etiquetas)
+
+
+def ventana_mascara(mask):
+
+    # Ventana (slice de filas, slice de columnas) que encierra los píxeles de la
+    # máscara. Si la zona no tiene píxeles en la rejilla se devuelve la rejilla completa.
+
+    filas = np.flatnonzero(mask.any(axis=1))
+    if filas.size == 0:
+        return slice(None), slice(None)
+    columnas = np.flatnonzero(mask.any(axis=0))
+    return slice(filas[0], filas[-1] + 1), slice(columnas[0], columnas[-1] + 1)
+
+
+def ventana_en_origen(ventana, n, volteado):
+
+    # Traduce un slice sobre un eje orientado al slice equivalente en el eje original
+    # de largo n (reflejado si el eje estaba invertido).
+
+    inicio, fin, _ = ventana.indices(n)
+    if volteado:
+        return slice(n - fin, n - inicio)
+    return slice(inicio, fin)
+
+
+def etiquetas_regiones(rejilla):
+
+    # Raster de etiquetas de región en la orientación del archivo (la misma que los
+    # datos leídos del NetCDF).
+
+    raster = obtener_indice(rejilla)['etiquetas']['region']
+    if rejilla['voltear_lat']:
+        raster = raster[::-1, :]
+    if rejilla['voltear_lon']:
+        raster = raster[:, ::-1]
+    return np.ascontiguousarray(raster)
@@ -0,0 +1,687 @@
+import os
+import json
+import uuid
+import hashlib
+import threading
+import traceback
+
+from app import acumulados, almacenamiento, cache_geotiff, catalogo, grafo, reglas, series
+from app.database import obtener_conexion, liberar_conexion
+from app.pool_datasets import abrir_dataset, liberar_dataset, invalidar_dataset
+from app.procesar import (
+    recortar_ultimos_5_anos,
+    generar_capas_fuzzy,
+    calcular_indice_riesgo_fuzzy,
+    calcular_indice_riesgo_crisp,
+    calcular_fecha_desde_indice,
+    salida_riesgo_fuzzy,
+    variables_riesgo_fuzzy
+)
+
+# Pipeline de ingesta de un NetCDF subido (pr o t2m).
+#
+# Las etapas forman un grafo de dependencias (ver app.grafo): recorte → capas fuzzy de
+# cada variable, recortes de pr y t2m → riesgo crisp, capas fuzzy de pr y t2m → riesgo
+# fuzzy. Las etapas independientes corren a la vez y cada una registra en la tabla
+# 'archivos' lo que genera. Las etapas de riesgo combinan pr y t2m, así que sólo
+# corren cuando ya está el archivo de la otra variable (si no, quedan 'omitida' hasta
+# la próxima subida). Lo llaman los trabajadores de app.trabajos.
+#
+# Las etapas de riesgo dejan además, por cada NetCDF de riesgo, sus sumas acumuladas
+# en el tiempo para los promedios por ventana (ver app.acumulados).
+#
+# Cada subida se identifica por el sha256 de su contenido (tabla 'subidas', junto con
+# el recorte y las capas fuzzy que se derivaron de ella) y cada archivo generado guarda
+# en archivos.huella la huella de sus entradas. Una etapa cuya huella coincide con la
+# registrada, y cuyo archivo sigue en disco, no se recalcula ('reutilizada'): volver a
+# subir el mismo archivo sólo hace consultas al catálogo.
+
+ETAPAS = ('recorte_pr', 'recorte_t2m', 'fuzzy_pr', 'fuzzy_t2m', 'riesgo_crisp', 'riesgo_fuzzy')
+
+VARIABLES = ('pr', 't2m')
+
+MODOS = ('completa', 'incremental')
+
+CARPETA_FUZZY = 'uploads/fuzzy'
+
+# Las series de la ingesta incremental se actualizan de a una subida por vez
+CANDADO_SERIES = threading.Lock()
+
+# Bytes que se leen por vez al guardar o hashear un archivo subido
+TAMANO_TROZO = 1 << 20
+
+
+def sin_aviso(etapa, estado, motivo=None):
+    pass
+
+
+def huella(*partes):
+
+    # Huella de un archivo derivado: sha256 de las huellas de sus entradas y de los
+    # parámetros que cambian su contenido.
+
+    return hashlib.sha256("|".join(str(p) for p in partes).encode()).hexdigest()
+
+
+def hash_archivo(ruta):
+    h = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for trozo in iter(lambda: f.read(TAMANO_TROZO), b''):
+            h.update(trozo)
+    return h.hexdigest()
+
+
+def buscar_subida(cur, hash_subida):
+
+    # Fila de 'subidas' con ese hash como dict, o None.
+
+    cur.execute(
+        "SELECT hash, nombre, ruta, recortado, fuzzy FROM subidas WHERE hash=%s",
+        (hash_subida,)
+    )
+    fila = cur.fetchone()
+    if fila is None:
+        return None
+    return dict(zip(('hash', 'nombre', 'ruta', 'recortado', 'fuzzy'), fila))
+
+
+def registrar_subida(cur, hash_subida, nombre, ruta):
+
+    # Asocia 'ruta' al contenido 'hash_subida'. Si en esa ruta había otro contenido,
+    # su fila se borra (el archivo en disco ya fue reemplazado).
+
+    cur.execute("DELETE FROM subidas WHERE ruta=%s AND hash<>%s", (ruta, hash_subida))
+    cur.execute("""
+        INSERT INTO subidas (hash, nombre, ruta, fecha_subida)
+        VALUES (%s,%s,%s,CURRENT_TIMESTAMP)
+        ON CONFLICT (hash) DO UPDATE
+        SET nombre=excluded.nombre, ruta=excluded.ruta, fecha_subida=CURRENT_TIMESTAMP
+    """, (hash_subida, nombre, ruta))
+
+
+def guardar_subida(stream, nombre, carpeta):
+
+    # Copia el archivo subido a carpeta/nombre calculando su sha256 mientras llega.
+    # Si ese mismo contenido ya estaba subido y sigue en disco, la copia se descarta y
+    # se usa el archivo existente (sin invalidar los datasets abiertos sobre él).
+    # Retorna (ruta, hash, repetida).
+
+    os.makedirs(carpeta, exist_ok=True)
+    ruta     = os.path.join(carpeta, nombre)
+    ruta_tmp = f"{ruta}.{uuid.uuid4().hex}.subiendo"
+    h = hashlib.sha256()
+    try:
+        with open(ruta_tmp, 'wb') as f:
+            for trozo in iter(lambda: stream.read(TAMANO_TROZO), b''):
+                h.update(trozo)
+                f.write(trozo)
+        hash_subida = h.hexdigest()
+
+        conn = obtener_conexion()
+        try:
+            cur = conn.cursor()
+            previa = buscar_subida(cur, hash_subida)
+            if previa and os.path.exists(previa['ruta']):
+                cur.close()
+                return previa['ruta'], hash_subida, True
+
+            invalidar_dataset(ruta)
+            os.replace(ruta_tmp, ruta)
+            registrar_subida(cur, hash_subida, nombre, ruta)
+            conn.commit()
+            cur.close()
+        finally:
+            liberar_conexion(conn)
+        return ruta, hash_subida, False
+    finally:
+        if os.path.exists(ruta_tmp):
+            os.remove(ruta_tmp)
+
+
+def huella_registrada(cur, ruta):
+    cur.execute("SELECT huella FROM archivos WHERE ruta=%s", (ruta,))
+    fila = cur.fetchone()
+    return fila[0] if fila else None
+
+
+def registrar_archivo(cur, ruta, variables, tipo_archivo, nombre_base, huella_archivo,
+                      riesgo_final=False, anterior=None, vista=None, entradas=None):
+
+    # Registra (o actualiza) en 'archivos' un NetCDF generado por la ingesta, con los
+    # 60 meses que cubre y la huella de sus entradas. 'anterior' es la ruta con que el
+    # mismo artefacto estaba registrado, si cambió (por defecto, la misma 'ruta').
+    # Para las series de la ingesta incremental, 'vista' (ver app.series.vista) indica
+    # la ventana de meses publicada y su desfase dentro del archivo. 'entradas' son las
+    # huellas de cada entrada (ver app.grafo).
+
+    if vista is None:
+        vista = {
+            'nombre_base'  : nombre_base,
+            'fecha_inicial': calcular_fecha_desde_indice(nombre_base, 1),
+            'fecha_final'  : calcular_fecha_desde_indice(nombre_base, 60),
+            'desfase'      : 0,
+        }
+    entradas_json = json.dumps(entradas) if entradas is not None else None
+
+    cur.execute("SELECT 1 FROM archivos WHERE ruta=%s", (anterior or ruta,))
+    if cur.fetchone():
+        cur.execute("""
+            UPDATE archivos
+            SET nombre=%s, ruta=%s, variables=%s, nombre_base=%s,
+                fecha_inicial_datos=%s, fecha_final_datos=%s, desfase=%s,
+                huella=%s, entradas=%s, fecha_subida=CURRENT_TIMESTAMP
+            WHERE ruta=%s
+        """, (
+            os.path.basename(ruta), ruta, variables, vista['nombre_base'],
+            vista['fecha_inicial'], vista['fecha_final'], vista['desfase'],
+            huella_archivo, entradas_json, anterior or ruta
+        ))
+        return
+
+    cur.execute("""
+        INSERT INTO archivos (
+          nombre, ruta, variables, tipo_archivo,
+          nombre_base, fecha_subida,
+          fecha_inicial_datos, fecha_final_datos,
+          es_riesgo_final, huella, desfase, entradas
+        ) VALUES (%s,%s,%s,%s,%s,CURRENT_TIMESTAMP,%s,%s,%s,%s,%s,%s)
+    """, (
+        os.path.basename(ruta),
+        ruta,
+        variables,
+        tipo_archivo,
+        vista['nombre_base'],
+        vista['fecha_inicial'],
+        vista['fecha_final'],
+        riesgo_final,
+        huella_archivo,
+        vista['desfase'],
+        entradas_json
+    ))
+
+
+def preparar_subida(cur, crisp_path, hash_subida=None):
+
+    # Fila de 'subidas' del archivo a ingerir (registrándola si hace falta; el hash se
+    # calcula leyendo el archivo si no se entrega).
+
+    if hash_subida is None:
+        hash_subida = hash_archivo(crisp_path)
+    subida = buscar_subida(cur, hash_subida)
+    if subida is None or subida['ruta'] != crisp_path:
+        registrar_subida(cur, hash_subida, os.path.basename(crisp_path), crisp_path)
+        subida = buscar_subida(cur, hash_subida)
+    return subida
+
+
+def modo_ingesta():
+
+    # Modo de ingesta (INGESTA_MODO): 'completa' (por defecto) rehace las copias de 60
+    # meses en cada subida; 'incremental' anexa sólo los meses nuevos a las series
+    # (ver procesar_incremental). Se lee en cada ingesta para respetar el .env.
+
+    modo = os.getenv("INGESTA_MODO", "completa").strip().lower()
+    if modo not in MODOS:
+        raise ValueError(f"INGESTA_MODO desconocido: {modo} (use {', '.join(MODOS)})")
+    return modo
+
+
+def variable_subida(ruta):
+
+    # Variable ('pr' o 't2m') del NetCDF subido; sólo lee los metadatos.
+
+    ds = abrir_dataset(ruta)
+    try:
+        for variable in VARIABLES:
+            if variable in ds.data_vars:
+                return variable
+    finally:
+        liberar_dataset(ds)
+    raise ValueError("No se reconoce variable 'pr' o 't2m'")
+
+
+def fila_archivo(cur, condicion, parametros):
+
+    # {'ruta', 'huella', 'entradas'} del archivo registrado que cumple 'condicion', o None.
+
+    cur.execute(f"SELECT ruta, huella, entradas FROM archivos WHERE {condicion}", parametros)
+    fila = cur.fetchone()
+    if fila is None:
+        return None
+    return {'ruta': fila[0], 'huella': fila[1], 'entradas': grafo.entradas_registradas(fila[2])}
+
+
+def registrado(ruta):
+
+    # Función 'actual' de un nodo cuyo archivo tiene ruta fija (ver app.grafo).
+
+    return lambda cur: fila_archivo(cur, "ruta=%s", (ruta,)) if ruta else None
+
+
+def variables_fuzzy(variable):
+    return ','.join([f"{variable}_baja", f"{variable}_media", f"{variable}_alta"])
+
+
+def variables_archivo(ruta):
+    ds = abrir_dataset(ruta)
+    try:
+        return ",".join(ds.data_vars.keys())
+    finally:
+        liberar_dataset(ds)
+
+
+def atributo_archivo(ruta, atributo):
+    ds = abrir_dataset(ruta)
+    try:
+        return ds.attrs.get(atributo)
+    finally:
+        liberar_dataset(ds)
+
+
+def huella_riesgo_fuzzy(h_pr, h_t2m, perfil):
+
+    # Huella del riesgo fuzzy: además de sus entradas, depende de la base de reglas
+    # activa y de las variables que se guardan (ver app.reglas).
+
+    return huella('riesgo_fuzzy', h_pr, h_t2m, perfil, salida_riesgo_fuzzy(), reglas.base_activa()['huella'])
+
+
+def acumular(ruta, tipo_archivo, anexar=False):
+
+    # Genera los acumulados del NetCDF de riesgo 'ruta' (ver app.acumulados) y retorna
+    # el resultado del nodo que lo produjo.
+
+    acumulados.generar_acumulado(ruta, acumulados.variables_riesgo(tipo_archivo), anexar=anexar)
+    return {'ruta': ruta}
+
+
+def registrar_resultado(cur, resultado, variables, tipo_archivo, nombre_base, riesgo_final=False, vista=None):
+
+    # Registra el archivo que produjo un nodo del grafo, con su huella y las de sus
+    # entradas, y descarta sus GeoTIFF cacheados.
+
+    cache_geotiff.invalidar(resultado['ruta'])
+    registrar_archivo(
+        cur, resultado['ruta'], variables, tipo_archivo, nombre_base, resultado['huella'],
+        riesgo_final=riesgo_final, anterior=resultado['anterior'], vista=vista,
+        entradas=resultado['entradas']
+    )
+
+
+def registrar_fuzzy(cur, resultado, variable, nombre_base, vista=None):
+    registrar_resultado(cur, resultado, variables_fuzzy(variable), variable, nombre_base, vista=vista)
+    cur.execute(
+        "UPDATE subidas SET fuzzy=%s WHERE recortado=%s", (resultado['ruta'], resultado['recortado'])
+    )
+
+
+def nodo_recorte(crisp_path, subida):
+
+    # Recorte de los últimos 60 meses de la subida. No depende de otros nodos: su
+    # huella es el hash de la subida.
+
+    def registrar(cur, resultado):
+        nombre = os.path.basename(resultado['ruta'])
+        tipo, nombre_base = nombre.split("_")[0], nombre.split("_")[1]
+        registrar_resultado(cur, resultado, tipo, tipo, nombre_base)
+        cur.execute("UPDATE subidas SET recortado=%s WHERE hash=%s", (resultado['ruta'], subida['hash']))
+
+    return {
+        'clave'    : ('recorte', subida['hash']),
+        'actual'   : registrado(subida['recortado']),
+        'huella'   : lambda: subida['hash'],
+        'construir': lambda: {'ruta': recortar_ultimos_5_anos(crisp_path)},
+        'registrar': registrar,
+    }
+
+
+def nodos_completa(carpeta_rec, nombre_base, variable):
+
+    # Grafo de la ingesta completa del mes 'nombre_base', a partir del recorte de
+    # 'variable' (ya resuelto): el recorte de la otra variable es una fuente (lo
+    # generó su propia subida) y de ambos dependen las capas fuzzy y los riesgos.
+    #
+    #   recorte_pr ──┬── fuzzy_pr ──┐
+    #                ├── riesgo_crisp├── riesgo_fuzzy
+    #   recorte_t2m ─┴── fuzzy_t2m ─┘
+
+    perfil = almacenamiento.perfil_almacenamiento()
+    nodos  = {}
+
+    for v in VARIABLES:
+        if v != variable:
+            ruta_rec = os.path.join(carpeta_rec, f"{v}_{nombre_base}_recortado.nc")
+            nodos[f"recorte_{v}"] = {'clave': ('recorte', ruta_rec), 'actual': registrado(ruta_rec)}
+
+        nodos[f"fuzzy_{v}"] = {
+            'entradas' : (f"recorte_{v}",),
+            'clave'    : ('fuzzy', v, nombre_base),
+            'actual'   : registrado(os.path.join(CARPETA_FUZZY, f"fuzzy_{v}_{nombre_base}.nc")),
+            'huella'   : lambda h_rec: huella('fuzzy', h_rec, perfil),
+            'construir': lambda rec: {
+                'ruta'     : generar_capas_fuzzy(rec['ruta'], carpeta_salida=CARPETA_FUZZY)['archivo_salida'],
+                'recortado': rec['ruta'],
+            },
+            'registrar': lambda cur, resultado, v=v: registrar_fuzzy(cur, resultado, v, nombre_base),
+        }
+
+    nodos['riesgo_crisp'] = {
+        'entradas' : ('recorte_pr', 'recorte_t2m'),
+        'clave'    : ('riesgo_crisp', nombre_base),
+        'actual'   : lambda cur: fila_archivo(
+            cur, "tipo_archivo='riesgo_crisp' AND nombre_base=%s", (nombre_base,)
+        ),
+        'huella'   : lambda h_pr, h_t2m: huella('riesgo_crisp', h_pr, h_t2m, perfil),
+        'construir': lambda pr, t2m: acumular(
+            calcular_indice_riesgo_crisp(pr['ruta'], t2m['ruta'])['archivo'], 'riesgo_crisp'
+        ),
+        'registrar': lambda cur, resultado: registrar_resultado(
+            cur, resultado, 'riesgo_crisp', 'riesgo_crisp', nombre_base, riesgo_final=True
+        ),
+    }
+
+    nodos['riesgo_fuzzy'] = {
+        'entradas' : ('fuzzy_pr', 'fuzzy_t2m'),
+        'clave'    : ('riesgo_fuzzy', nombre_base),
+        'actual'   : lambda cur: fila_archivo(
+            cur, "tipo_archivo='riesgo_fuzzy' AND nombre_base=%s", (nombre_base,)
+        ),
+        'huella'   : lambda h_pr, h_t2m: huella_riesgo_fuzzy(h_pr, h_t2m, perfil),
+        'construir': lambda pr, t2m: acumular(
+            calcular_indice_riesgo_fuzzy(pr['ruta'], t2m['ruta'])['archivo'], 'riesgo_fuzzy'
+        ),
+        'registrar': lambda cur, resultado: registrar_resultado(
+            cur, resultado, variables_archivo(resultado['ruta']), 'riesgo_fuzzy', nombre_base, riesgo_final=True
+        ),
+    }
+    return nodos
+
+
+def nombre_resultado(resultado):
+    return resultado and os.path.basename(resultado['ruta'])
+
+
+def procesar_archivo(crisp_path, avisar=sin_aviso, hash_subida=None):
+
+    # Ejecuta la ingesta completa de 'crisp_path' (ya guardado en uploads/crisp, con
+    # sha256 'hash_subida'; si no se entrega se calcula leyendo el archivo).
+    # Primero se resuelve el recorte (que fija el mes) y luego el resto del grafo del
+    # mes (ver nodos_completa); sólo se recalculan los nodos cuyas entradas cambiaron.
+    # avisar(etapa, estado, motivo=None) se llama al empezar y terminar cada etapa, con
+    # estado 'en_proceso', 'completada', 'reutilizada' u 'omitida' (y, al reconstruir
+    # un archivo ya registrado, el motivo: qué entradas cambiaron).
+    # Retorna un dict con los nombres de los archivos generados.
+
+    if modo_ingesta() == 'incremental':
+        return procesar_incremental(crisp_path, avisar, hash_subida)
+
+    conn = None
+    try:
+        conn = obtener_conexion()
+        cur  = conn.cursor()
+        subida = preparar_subida(cur, crisp_path, hash_subida)
+        hash_subida = subida['hash']
+        conn.commit()
+        cur.close()
+
+        variable = variable_subida(crisp_path)
+        resultados = grafo.ejecutar_grafo(
+            {f"recorte_{variable}": nodo_recorte(crisp_path, subida)}, avisar
+        )
+        recortado   = resultados[f"recorte_{variable}"]
+        nombre_base = os.path.basename(recortado['ruta']).split("_")[1]  # 'YYYY-MM'
+
+        resultados = grafo.ejecutar_grafo(
+            nodos_completa(os.path.dirname(recortado['ruta']), nombre_base, variable),
+            avisar, resueltos=resultados
+        )
+
+        # Las rutas de lectura resuelven los archivos desde el catálogo en memoria
+        catalogo.refrescar(conn)
+
+        return {
+            'mensaje'     : 'Archivos procesados correctamente',
+            'hash'        : hash_subida,
+            'nombre_base' : nombre_base,
+            'recortado'   : nombre_resultado(recortado),
+            'riesgo_crisp': nombre_resultado(resultados['riesgo_crisp']),
+            'fuzzy'       : nombre_resultado(resultados[f"fuzzy_{variable}"]),
+            'riesgo_fuzzy': nombre_resultado(resultados['riesgo_fuzzy'])
+        }
+
+    except Exception:
+        traceback.print_exc()
+        # Lo que alcanzó a registrarse se verá en la próxima consulta al catálogo
+        catalogo.invalidar()
+        raise
+
+    finally:
+        if conn is not None:
+            liberar_conexion(conn)
+
+
+def ventana_crisp():
+
+    # Ventana (inicio_pr, inicio_t2m, pasos) de los últimos VENTANA_MESES meses comunes
+    # de las series de pr y t2m, y etiqueta de su último mes; None si no se traslapan.
+
+    meses_pr  = series.meses_serie(series.ruta_serie('pr'))
+    meses_t2m = series.meses_serie(series.ruta_serie('t2m'))
+    if len(meses_pr) == 0 or len(meses_t2m) == 0:
+        return None
+    fin    = min(meses_pr[-1], meses_t2m[-1])
+    inicio = max(meses_pr[0], meses_t2m[0], fin - series.VENTANA_MESES + 1)
+    if inicio > fin:
+        return None
+    ventana = (int(inicio - meses_pr[0]), int(inicio - meses_t2m[0]), int(fin - inicio + 1))
+    return ventana, series.etiqueta_mes(fin)
+
+
+def nodo_serie(crisp_path, subida, variable):
+
+    # Incorpora la subida a la serie de su variable. La huella de la serie es el hash
+    # de la última subida que calza con ella; si la subida no agrega meses, la serie
+    # conserva su huella y lo derivado sigue vigente.
+
+    def construir():
+        res_serie = series.actualizar_serie(crisp_path)
+        if res_serie['accion'] in ('creada', 'reconstruida'):
+            # Lo derivado de la serie anterior ya no corresponde
+            series.descartar(series.ruta_serie(f"fuzzy_{variable}"), series.ruta_serie('riesgo_fuzzy'))
+        resultado = {'ruta': res_serie['ruta'], 'accion': res_serie['accion'], 'nuevos': res_serie['nuevos']}
+        if res_serie['accion'] == 'sin_cambios':
+            resultado['estado'] = 'reutilizada'
+        return resultado
+
+    def registrar(cur, resultado):
+        if resultado['accion'] == 'sin_cambios':
+            resultado['huella'] = huella_registrada(cur, resultado['ruta']) or resultado['huella']
+        vista_rec = series.vista(resultado['ruta'])
+        registrar_resultado(cur, resultado, variable, variable, vista_rec['nombre_base'], vista=vista_rec)
+        cur.execute("UPDATE subidas SET recortado=%s WHERE hash=%s", (resultado['ruta'], subida['hash']))
+
+    return {
+        'clave'    : ('serie', variable),
+        'actual'   : registrado(subida['recortado']),
+        'huella'   : lambda: subida['hash'],
+        'construir': construir,
+        'registrar': registrar,
+    }
+
+
+def construir_fuzzy_serie(rec, variable, perfil):
+
+    # Anexa a la serie fuzzy los meses de la serie 'rec' que aún no tienen membresías
+    # (o la rehace si ya no calza con ella).
+
+    ruta_fuzzy = series.ruta_serie(f"fuzzy_{variable}")
+    meses_rec, meses_fuzzy = series.meses_serie(rec['ruta']), series.meses_serie(ruta_fuzzy)
+    extensible = (
+        len(meses_fuzzy) > 0
+        and meses_fuzzy[0] == meses_rec[0]
+        and meses_fuzzy[-1] <= meses_rec[-1]
+        and series.perfil_coincide(ruta_fuzzy, f"{variable}_baja", perfil)
+    )
+    if not extensible:
+        series.descartar(ruta_fuzzy, series.ruta_serie('riesgo_fuzzy'))
+        generar_capas_fuzzy(rec['ruta'], ruta_salida=ruta_fuzzy)
+    elif len(meses_fuzzy) < len(meses_rec):
+        generar_capas_fuzzy(rec['ruta'], ventana=(len(meses_fuzzy), None), ruta_salida=ruta_fuzzy, anexar=True)
+    return {'ruta': ruta_fuzzy, 'recortado': rec['ruta']}
+
+
+def construir_riesgo_serie(pr, t2m, perfil):
+
+    # Anexa a la serie de riesgo fuzzy los meses comunes de ambas series fuzzy que le
+    # faltan (o la rehace si ya no calza con ellas). None si no se traslapan.
+
+    ruta_riesgo = series.ruta_serie('riesgo_fuzzy')
+    meses_pr, meses_t2m = series.meses_serie(pr['ruta']), series.meses_serie(t2m['ruta'])
+    inicio = max(meses_pr[0], meses_t2m[0])
+    fin    = min(meses_pr[-1], meses_t2m[-1])
+    if inicio > fin:
+        return None
+    meses_riesgo = series.meses_serie(ruta_riesgo)
+    extensible = (
+        len(meses_riesgo) > 0
+        and meses_riesgo[0] == inicio
+        and meses_riesgo[-1] <= fin
+        and series.perfil_coincide(ruta_riesgo, 'riesgo_fuzzy', perfil)
+        and variables_archivo(ruta_riesgo).split(',') == variables_riesgo_fuzzy()
+        and atributo_archivo(ruta_riesgo, 'huella_reglas') == reglas.base_activa()['huella']
+    )
+    desde = meses_riesgo[-1] + 1 if extensible else inicio
+    # Los acumulados crecen con la serie si estaban al día con ella
+    anexar_acumulado = extensible and acumulados.vigente(ruta_riesgo)
+    if not extensible:
+        series.descartar(ruta_riesgo)
+    if desde <= fin:
+        calcular_indice_riesgo_fuzzy(
+            pr['ruta'], t2m['ruta'],
+            ventana=(int(desde - meses_pr[0]), int(desde - meses_t2m[0]), int(fin - desde + 1)),
+            ruta_salida=ruta_riesgo, anexar=extensible
+        )
+    if desde <= fin or not anexar_acumulado:
+        acumular(ruta_riesgo, 'riesgo_fuzzy', anexar=anexar_acumulado)
+    return {'ruta': ruta_riesgo, 'estado': 'completada' if desde <= fin else 'reutilizada'}
+
+
+def construir_crisp_serie(pr, t2m):
+    calculo = ventana_crisp()
+    if calculo is None:
+        return None
+    ventana, _ = calculo
+    res_crisp = calcular_indice_riesgo_crisp(pr['ruta'], t2m['ruta'], ventana=ventana)
+    acumular(res_crisp['archivo'], 'riesgo_crisp')
+    return {'ruta': res_crisp['archivo'], 'nombre_base': res_crisp['nombre_base'], 'pasos': ventana[2]}
+
+
+def crisp_serie_actual(cur):
+    calculo = ventana_crisp()
+    if calculo is None:
+        return None
+    return fila_archivo(cur, "tipo_archivo='riesgo_crisp' AND nombre_base=%s", (calculo[1],))
+
+
+def nodos_incremental(crisp_path, subida, variable):
+
+    # Grafo de la ingesta incremental: el mismo de nodos_completa, pero sobre las
+    # series de app.series (rutas fijas), así que cabe en una sola ejecución.
+
+    perfil = almacenamiento.perfil_almacenamiento()
+    nodos  = {f"recorte_{variable}": nodo_serie(crisp_path, subida, variable)}
+
+    for v in VARIABLES:
+        if v != variable:
+            nodos[f"recorte_{v}"] = {'clave': ('serie', v), 'actual': registrado(series.ruta_serie(v))}
+
+        def registrar(cur, resultado, v=v):
+            vista_fuzzy = series.vista(resultado['ruta'])
+            registrar_fuzzy(cur, resultado, v, vista_fuzzy['nombre_base'], vista=vista_fuzzy)
+
+        nodos[f"fuzzy_{v}"] = {
+            'entradas' : (f"recorte_{v}",),
+            'clave'    : ('serie', f"fuzzy_{v}"),
+            'actual'   : registrado(series.ruta_serie(f"fuzzy_{v}")),
+            'huella'   : lambda h_rec: huella('fuzzy', h_rec, perfil),
+            'construir': lambda rec, v=v: construir_fuzzy_serie(rec, v, perfil),
+            'registrar': registrar,
+        }
+
+    # El riesgo crisp se normaliza con los extremos de toda la ventana, así que se
+    # recalcula completo sobre los últimos meses comunes de ambas series
+    nodos['riesgo_crisp'] = {
+        'entradas' : ('recorte_pr', 'recorte_t2m'),
+        'clave'    : ('serie', 'riesgo_crisp'),
+        'actual'   : crisp_serie_actual,
+        'huella'   : lambda h_pr, h_t2m: huella('riesgo_crisp', h_pr, h_t2m, perfil),
+        'construir': construir_crisp_serie,
+        'registrar': lambda cur, resultado: registrar_resultado(
+            cur, resultado, 'riesgo_crisp', 'riesgo_crisp', resultado['nombre_base'], riesgo_final=True,
+            vista=series.vista_ventana(resultado['nombre_base'], resultado['pasos'])
+        ),
+    }
+
+    def registrar_riesgo(cur, resultado):
+        vista_riesgo = series.vista(resultado['ruta'])
+        registrar_resultado(
+            cur, resultado, variables_archivo(resultado['ruta']), 'riesgo_fuzzy',
+            vista_riesgo['nombre_base'], riesgo_final=True, vista=vista_riesgo
+        )
+
+    nodos['riesgo_fuzzy'] = {
+        'entradas' : ('fuzzy_pr', 'fuzzy_t2m'),
+        'clave'    : ('serie', 'riesgo_fuzzy'),
+        'actual'   : registrado(series.ruta_serie('riesgo_fuzzy')),
+        'huella'   : lambda h_pr, h_t2m: huella_riesgo_fuzzy(h_pr, h_t2m, perfil),
+        'construir': lambda pr, t2m: construir_riesgo_serie(pr, t2m, perfil),
+        'registrar': registrar_riesgo,
+    }
+    return nodos
+
+
+def procesar_incremental(crisp_path, avisar=sin_aviso, hash_subida=None):
+
+    # Ingesta incremental (INGESTA_MODO=incremental): el archivo se incorpora a la
+    # serie de su variable (ver app.series) y sólo se calculan los meses que la serie
+    # no tenía, tanto de las capas fuzzy como del riesgo fuzzy (ver nodos_incremental).
+    # Mismos argumentos y resultado que procesar_archivo.
+
+    conn = None
+    try:
+        conn = obtener_conexion()
+        cur  = conn.cursor()
+        subida = preparar_subida(cur, crisp_path, hash_subida)
+        hash_subida = subida['hash']
+        conn.commit()
+        cur.close()
+
+        variable = variable_subida(crisp_path)
+        with CANDADO_SERIES:
+            resultados = grafo.ejecutar_grafo(nodos_incremental(crisp_path, subida, variable), avisar)
+
+        recortado = resultados[f"recorte_{variable}"]
+
+        # Las rutas de lectura resuelven los archivos desde el catálogo en memoria
+        catalogo.refrescar(conn)
+
+        return {
+            'mensaje'     : 'Archivos procesados correctamente',
+            'modo'        : 'incremental',
+            'hash'        : hash_subida,
+            'nombre_base' : series.vista(recortado['ruta'])['nombre_base'],
+            'meses_nuevos': recortado.get('nuevos', 0),
+            'recortado'   : nombre_resultado(recortado),
+            'riesgo_crisp': nombre_resultado(resultados['riesgo_crisp']),
+            'fuzzy'       : nombre_resultado(resultados[f"fuzzy_{variable}"]),
+            'riesgo_fuzzy': nombre_resultado(resultados['riesgo_fuzzy'])
+        }
+
+    except Exception:
+        traceback.print_exc()
+        catalogo.invalidar()
+        raise
+
+    finally:
+        if conn is not None:
+            liberar_conexion(conn)
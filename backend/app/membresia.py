@@ -0,0 +1,99 @@
+import numpy as np
+
+# Funciones de pertenencia trapezoidales en forma cerrada.
+#
+# Reemplazan el esquema de scikit-fuzzy (muestrear el trapecio sobre un universo
+# discreto y leerlo con interp_membership): cada grado se calcula directamente a
+# partir de los vértices, sin universos intermedios ni error de discretización.
+# Todas las funciones operan sobre arrays de cualquier forma, aceptan vértices
+# escalares o broadcastables contra x, buffers de salida (out=) y float32.
+# Los NaN de entrada se conservan como NaN en la salida.
+
+CATEGORIAS = ('baja', 'media', 'alta')
+
+
+def vertices_trapecios(m, M):
+
+    # Vértices (a, b, c, d) de los trapecios baja/media/alta para un rango [m, M],
+    # con la misma partición en octavos usada en todo el proyecto.
+    # m y M pueden ser escalares o arrays (p.ej. uno por mes y región).
+
+    L8 = (M - m) / 8.0
+    L2 = (M + m) / 2.0
+    return {
+        'baja':  (m,        m,      m+L8,   m+3*L8),
+        'media': (L2-3*L8,  L2-L8,  L2+L8,  L2+3*L8),
+        'alta':  (M-3*L8,   M-L8,   M,      M),
+    }
+
+
+def preparar_salida(x, out, *vertices):
+
+    # Devuelve el buffer de salida: 'out' si se entregó, o uno nuevo con la forma
+    # broadcast de x y los vértices. Se conserva float32 si x es float32.
+
+    if out is not None:
+        return out
+    dtype = x.dtype if x.dtype in (np.float32, np.float64) else np.float64
+    forma = np.broadcast_shapes(x.shape, *(np.shape(v) for v in vertices))
+    return np.empty(forma, dtype=dtype)
+
+
+def trapmf(x, a, b, c, d, out=None):
+
+    # Grado de pertenencia de x al trapecio (a, b, c, d), con a <= b <= c <= d:
+    #   0 fuera de [a, d], (x-a)/(b-a) en la subida, 1 en [b, c], (d-x)/(d-c) en la bajada.
+    # Un flanco de ancho cero (a == b o c == d) se comporta como un hombro vertical,
+    # igual que fuzz.trapmf.
+
+    x = np.asarray(x)
+    out = preparar_salida(x, out, a, b, c, d)
+    aux = np.empty_like(out)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Flanco de subida (±inf si a == b, NaN sólo en x == a == b)
+        np.subtract(x, a, out=out)
+        np.divide(out, np.subtract(b, a), out=out)
+        # Flanco de bajada (±inf si c == d, NaN sólo en x == c == d)
+        np.subtract(d, x, out=aux)
+        np.divide(aux, np.subtract(d, c), out=aux)
+
+    # fmin ignora el NaN de un flanco degenerado en su vértice (donde el otro flanco
+    # ya vale >= 1), pero conserva el NaN cuando x es NaN (ambos flancos son NaN)
+    np.fmin(out, aux, out=out)
+    np.clip(out, 0.0, 1.0, out=out)
+
+    # Trapecio reducido a un punto (a == b == c == d): ambos flancos dan 0/0
+    punto = np.logical_and(np.equal(a, b), np.equal(b, c)) & np.equal(c, d)
+    if np.any(punto):
+        np.copyto(out, 1.0, where=np.equal(x, b) & punto)
+
+    return out
+
+
+def membresias(x, m, M, out=None):
+
+    # Grados de pertenencia baja/media/alta de x para los trapecios del rango [m, M].
+    # 'out' puede ser una tupla con tres buffers (baja, media, alta).
+    # Retorna la tupla (baja, media, alta).
+
+    x = np.asarray(x)
+    if out is None:
+        out = (None, None, None)
+    vertices = vertices_trapecios(m, M)
+    return tuple(
+        trapmf(x, *vertices[cat], out=buf)
+        for cat, buf in zip(CATEGORIAS, out)
+    )
+
+
+def membresia_baja(x, m, M, out=None):
+    return trapmf(x, *vertices_trapecios(m, M)['baja'], out=out)
+
+
+def membresia_media(x, m, M, out=None):
+    return trapmf(x, *vertices_trapecios(m, M)['media'], out=out)
+
+
+def membresia_alta(x, m, M, out=None):
+    return trapmf(x, *vertices_trapecios(m, M)['alta'], out=out)
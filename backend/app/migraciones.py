@@ -0,0 +1,115 @@
+from app import database
+
+# Migraciones del esquema del catálogo ('archivos', 'subidas' y la cola de ingesta
+# 'trabajos').
+#
+# Las mismas migraciones se aplican sobre PostgreSQL y SQLite: el SQL es común y sólo
+# las piezas que cambian entre motores van como marcadores {…} (ver DIALECTOS). Cada
+# migración aplicada queda registrada en la tabla schema_migraciones, así que
+# aplicar_migraciones() se puede llamar en cada arranque.
+
+DIALECTOS = {
+    'postgres': {'id': 'SERIAL PRIMARY KEY'},
+    'sqlite':   {'id': 'INTEGER PRIMARY KEY AUTOINCREMENT'},
+}
+
+# (versión, descripción, SQL), en orden de aplicación
+MIGRACIONES = [
+    (1, "tabla archivos", """
+        CREATE TABLE IF NOT EXISTS archivos (
+            id                  {id},
+            nombre              TEXT NOT NULL,
+            ruta                TEXT NOT NULL,
+            variables           TEXT,
+            tipo_archivo        TEXT NOT NULL,
+            nombre_base         TEXT,
+            fecha_subida        TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            fecha_inicial_datos TEXT,
+            fecha_final_datos   TEXT,
+            es_riesgo_final     BOOLEAN DEFAULT FALSE
+        )
+    """),
+    (2, "índice por tipo de archivo y fecha final", """
+        CREATE INDEX IF NOT EXISTS archivos_tipo_fecha_final
+        ON archivos (tipo_archivo, fecha_final_datos)
+    """),
+    (3, "tabla trabajos (cola de ingesta)", """
+        CREATE TABLE IF NOT EXISTS trabajos (
+            id          TEXT PRIMARY KEY,
+            archivo     TEXT NOT NULL,
+            ruta        TEXT NOT NULL,
+            estado      TEXT NOT NULL,
+            etapas      TEXT,
+            resultado   TEXT,
+            error       TEXT,
+            creado      TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            actualizado TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """),
+    (4, "huella de las entradas de cada archivo", """
+        ALTER TABLE archivos ADD COLUMN huella TEXT
+    """),
+    (5, "tabla subidas (hash del contenido y archivos derivados)", """
+        CREATE TABLE IF NOT EXISTS subidas (
+            hash         TEXT PRIMARY KEY,
+            nombre       TEXT NOT NULL,
+            ruta         TEXT NOT NULL,
+            recortado    TEXT,
+            fuzzy        TEXT,
+            fecha_subida TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """),
+    (6, "hash de la subida en trabajos", """
+        ALTER TABLE trabajos ADD COLUMN hash TEXT
+    """),
+    (7, "desfase de la ventana publicada dentro de cada archivo", """
+        ALTER TABLE archivos ADD COLUMN desfase INTEGER DEFAULT 0
+    """),
+    (8, "huellas de las entradas con que se generó cada archivo", """
+        ALTER TABLE archivos ADD COLUMN entradas TEXT
+    """),
+]
+
+
+def aplicar_migraciones(conn=None):
+
+    # Aplica las migraciones pendientes en el backend configurado (o en 'conn').
+    # Retorna la lista de versiones aplicadas.
+
+    propia = conn is None
+    if propia:
+        conn = database.obtener_conexion()
+    try:
+        dialecto = DIALECTOS[database.backend_catalogo()]
+        cur = conn.cursor()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migraciones (
+                version     INTEGER PRIMARY KEY,
+                descripcion TEXT,
+                aplicada    TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        conn.commit()
+
+        cur.execute("SELECT version FROM schema_migraciones")
+        hechas = {fila[0] for fila in cur.fetchall()}
+        aplicadas = []
+        for version, descripcion, sql in MIGRACIONES:
+            if version in hechas:
+                continue
+            cur.execute(sql.format(**dialecto))
+            cur.execute(
+                "INSERT INTO schema_migraciones (version, descripcion) VALUES (%s, %s)",
+                (version, descripcion)
+            )
+            conn.commit()
+            aplicadas.append(version)
+        cur.close()
+        return aplicadas
+    finally:
+        if propia:
+            database.liberar_conexion(conn)
+
+
+if __name__ == '__main__':
+    print("Migraciones aplicadas:", aplicar_migraciones() or "ninguna (esquema al día)")
@@ -0,0 +1,132 @@
+import os
+import threading
+from collections import OrderedDict
+
+import xarray as xr
+
+# Pool de datasets NetCDF abiertos (sólo lectura) compartido por todo el proceso.
+#
+# Las peticiones leen una y otra vez los mismos archivos recortado/fuzzy/riesgo; en vez
+# de abrir y cerrar cada vez (parseo de cabecera, decodificación de coordenadas,
+# syscalls), se reutiliza el mismo handle. Los handles se indexan por (ruta, mtime),
+# así que un archivo reescrito nunca se sirve con el handle viejo.
+#
+# Uso: ds = abrir_dataset(ruta) … liberar_dataset(ds), en lugar de xr.open_dataset
+# … ds.close(). Un handle desalojado (por LRU o por invalidación) mientras alguien lo
+# usa se cierra cuando el último usuario lo libera.
+#
+# La biblioteca HDF5 no admite llamadas simultáneas desde varios hilos. Todo acceso a
+# NetCDF del proceso (aperturas, lecturas de los datasets del pool y las escrituras de
+# app.bloques) toma CANDADO_HDF5. Es reentrante porque la apertura se hace con el
+# candado tomado y xarray lo vuelve a tomar al obtener el handle.
+
+POOL = OrderedDict()   # (ruta, mtime) → entrada, de menos a más reciente
+ENTRADAS = {}          # id(ds) → entrada (para liberar_dataset)
+CANDADO_POOL = threading.Lock()
+CANDADO_HDF5 = threading.RLock()
+
+
+def max_datasets_abiertos():
+
+    # Cantidad máxima de datasets abiertos en el pool (MAX_DATASETS_ABIERTOS; 0 = sin
+    # pool: se cierran al liberar). Se lee en cada llamada para respetar el .env.
+
+    return max(0, int(os.getenv("MAX_DATASETS_ABIERTOS", "16")))
+
+
+def clave_dataset(ruta):
+    ruta = os.path.abspath(ruta)
+    return ruta, os.path.getmtime(ruta)
+
+
+def abrir_dataset(ruta):
+
+    # Devuelve un dataset abierto (decode_times=False) para ruta, reutilizando el del
+    # pool si el archivo no cambió. Cada llamada debe emparejarse con liberar_dataset.
+
+    clave = clave_dataset(ruta)
+    sobrantes = []
+    with CANDADO_POOL:
+        entrada = POOL.get(clave)
+        if entrada is not None:
+            POOL.move_to_end(clave)
+            entrada['usos'] += 1
+            return entrada['ds']
+        # Versiones anteriores del mismo archivo ya no sirven. Se cierran antes de
+        # abrir la nueva: HDF5 reutiliza un archivo que siga abierto en el proceso.
+        for vieja in [c for c in POOL if c[0] == clave[0]]:
+            sobrantes.extend(desalojar(vieja))
+    for viejo in sobrantes:
+        viejo.close()
+
+    # Abrir fuera de CANDADO_POOL para no bloquear a las demás peticiones. xarray toma
+    # su candado sólo al obtener el handle y lee después los atributos y filtros de las
+    # variables sin él, así que toda la apertura va dentro de CANDADO_HDF5, que es
+    # también el candado que usa el dataset en sus lecturas y al cerrarse.
+    with CANDADO_HDF5:
+        ds = xr.open_dataset(ruta, decode_times=False, lock=CANDADO_HDF5)
+
+    sobrantes = []
+    with CANDADO_POOL:
+        entrada = POOL.get(clave)
+        if entrada is not None:
+            # Otro hilo lo abrió mientras tanto: se usa ese y se descarta el nuestro
+            sobrantes.append(ds)
+        else:
+            entrada = {'ds': ds, 'usos': 0, 'desalojado': False}
+            POOL[clave] = entrada
+            ENTRADAS[id(ds)] = entrada
+        entrada['usos'] += 1
+
+        maximo = max_datasets_abiertos()
+        while len(POOL) > maximo:
+            sobrantes.extend(desalojar(next(iter(POOL))))
+
+    for viejo in sobrantes:
+        viejo.close()
+    return entrada['ds']
+
+
+def liberar_dataset(ds):
+
+    # Devuelve al pool un dataset obtenido con abrir_dataset (no lo cierra, salvo que
+    # haya sido desalojado mientras estaba en uso).
+
+    with CANDADO_POOL:
+        entrada = ENTRADAS.get(id(ds))
+        if entrada is None or entrada['ds'] is not ds:
+            cerrar = True
+        else:
+            entrada['usos'] -= 1
+            cerrar = entrada['desalojado'] and entrada['usos'] == 0
+            if cerrar:
+                del ENTRADAS[id(ds)]
+    if cerrar:
+        ds.close()
+
+
+def desalojar(clave):
+
+    # Saca la entrada del pool (con el candado tomado). Retorna los datasets que se
+    # pueden cerrar ya; los que están en uso se cierran al liberarlos.
+
+    entrada = POOL.pop(clave)
+    if entrada['usos'] > 0:
+        entrada['desalojado'] = True
+        return []
+    del ENTRADAS[id(entrada['ds'])]
+    return [entrada['ds']]
+
+
+def invalidar_dataset(ruta):
+
+    # Desaloja todos los handles de ruta. Se llama antes de reescribir un archivo, para
+    # no mantenerlo abierto (y bloqueado por HDF5) mientras se escribe.
+
+    ruta = os.path.abspath(ruta)
+    with CANDADO_POOL:
+        cerrables = []
+        for clave in [c for c in POOL if c[0] == ruta]:
+            cerrables.extend(desalojar(clave))
+    for ds in cerrables:
+        ds.close()
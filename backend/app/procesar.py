@@ -1,24 +1,74 @@
 import os
 import datetime
-import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import get_context, shared_memory
 from dateutil.relativedelta import relativedelta
 
 import xarray as xr
 import numpy as np
-import skfuzzy as fuzz
-import geopandas as gpd
-from rasterio.transform import from_origin
-from rasterio.transform import from_bounds
 from rasterio.crs import CRS
-from rasterio import features
+from rasterio.io import MemoryFile
 from affine import Affine
-import rasterio
 
-ZONE_MAP = {
-    'region':    ('shapefiles/regiones/Regional.shp',     'Region'),
-    'provincia': ('shapefiles/provincias/Provincias.shp', 'Provincia'),
-    'comuna':    ('shapefiles/comunas/comunas.shp',       'Comuna')
-}
+from app import almacenamiento, bloques, indice_zonas, membresia, pool_datasets, reglas
+
+
+# Arreglos float64 de un paso de tiempo que cada etapa mantiene en memoria a la vez
+# (entradas, salidas y temporales). Convierte el presupuesto de bloque en pasos.
+COPIAS_RECORTE      = 2
+COPIAS_FUZZY        = 12
+COPIAS_CRISP        = 6
+# Riesgo fuzzy: auxiliares del kernel y la codificación al escribir, más un buffer por
+# cada membresía de entrada y por cada variable que se calcula (ver
+# calcular_indice_riesgo_fuzzy)
+COPIAS_RIESGO_FUZZY = 4
+
+# Atributos del índice crisp con los extremos usados para normalizar (ver
+# calcular_indice_riesgo_crisp)
+ATRIBUTOS_EXTREMOS = ('pr_min', 'pr_max', 't2m_min', 't2m_max')
+
+# Variables del NetCDF de riesgo fuzzy con la base de reglas del proyecto (componentes,
+# agregados por clase y riesgo_fuzzy; ver app.reglas)
+VARIABLES_RIESGO_FUZZY = reglas.compilar(reglas.BASE_REGLAS)['variables']
+
+# Qué guarda calcular_indice_riesgo_fuzzy según SALIDA_RIESGO_FUZZY
+SALIDAS_RIESGO_FUZZY = ('completa', 'agregados')
+
+
+def workers_fuzzy():
+
+    # Procesos usados por generar_capas_fuzzy (FUZZY_WORKERS; 1 = en serie). Se lee en
+    # cada llamada para respetar el .env.
+
+    return max(1, int(os.getenv("FUZZY_WORKERS", "1")))
+
+
+def salida_riesgo_fuzzy():
+
+    # Salida configurada (SALIDA_RIESGO_FUZZY): 'completa' (por defecto) guarda también
+    # las nueve componentes; 'agregados' sólo las tres clases y riesgo_fuzzy. Se lee en
+    # cada llamada para respetar el .env.
+
+    salida = os.getenv("SALIDA_RIESGO_FUZZY", "completa").strip().lower()
+    if salida not in SALIDAS_RIESGO_FUZZY:
+        raise ValueError(
+            f"SALIDA_RIESGO_FUZZY desconocida: {salida} (use {', '.join(SALIDAS_RIESGO_FUZZY)})"
+        )
+    return salida
+
+
+def variables_riesgo_fuzzy(base=None, salida=None):
+
+    # Variables que se guardan con la base compilada 'base' (por defecto la activa,
+    # ver reglas.base_activa) y la salida indicada (por defecto SALIDA_RIESGO_FUZZY).
+
+    if base is None:
+        base = reglas.base_activa()
+    if salida is None:
+        salida = salida_riesgo_fuzzy()
+    return base['variables'] if salida == 'completa' else base['agregados']
+
 
 def limpiar_atributos_conflictivos(ds):
     
@@ -45,140 +95,130 @@ def generar_nombre_base(ds):
         return datetime.datetime.now().strftime('%Y-%m')
 
 
-def recortar_ultimos_5_anos(ruta_archivo, carpeta_salida="uploads/recortado"):
+def recortar_ultimos_5_anos(ruta_archivo, carpeta_salida="uploads/recortado", presupuesto=None):
     
     # Abre un NetCDF y guarda los últimos 60 pasos temporales en un nuevo archivo.
+    # La copia se hace por bloques de tiempo (ver app.bloques) y queda en orientación
+    # canónica (Norte→Sur / Oeste→Este) con la firma y el transform de la rejilla como
+    # atributos, que heredan todos los archivos derivados (ver app.indice_zonas).
     # Retorna la ruta al .nc recortado.
     
     os.makedirs(carpeta_salida, exist_ok=True)
-    ds = xr.open_dataset(ruta_archivo, decode_times=False)
-    if 'time' not in ds.dims or ds.sizes['time'] < 60:
-        raise ValueError("El archivo no tiene al menos 60 pasos de tiempo")
-    tipo = 'pr' if 'pr' in ds.data_vars else 't2m' if 't2m' in ds.data_vars else 'desconocido'
-    ds_rec = ds.isel(time=slice(-60, None))
-    nombre_base = generar_nombre_base(ds_rec)
-    ds_rec = limpiar_atributos_conflictivos(ds_rec)
-    ruta_salida = os.path.join(carpeta_salida, f"{tipo}_{nombre_base}_recortado.nc")
-    ds_rec.to_netcdf(ruta_salida)
-    ds.close()
+    ds = pool_datasets.abrir_dataset(ruta_archivo)
+    try:
+        if 'time' not in ds.dims or ds.sizes['time'] < 60:
+            raise ValueError("El archivo no tiene al menos 60 pasos de tiempo")
+        tipo = 'pr' if 'pr' in ds.data_vars else 't2m' if 't2m' in ds.data_vars else 'desconocido'
+        ds_rec = indice_zonas.orientar_dataset(ds.isel(time=slice(-60, None)))
+        nombre_base = generar_nombre_base(ds_rec)
+        ruta_salida = os.path.join(carpeta_salida, f"{tipo}_{nombre_base}_recortado.nc")
+
+        T = ds_rec.sizes['time']
+        paso = bloques.pasos_por_bloque(T, bloques.bytes_por_paso(ds_rec, COPIAS_RECORTE), presupuesto)
+        bloques.guardar_bloques(
+            (limpiar_atributos_conflictivos(ds_rec.isel(time=slice(t0, t1)))
+             for t0, t1 in bloques.iterar_bloques(T, paso)),
+            ruta_salida
+        )
+    finally:
+        pool_datasets.liberar_dataset(ds)
     return ruta_salida
 
 
-def generar_capas_fuzzy(ruta_archivo, carpeta_salida="uploads/fuzzy"):
-    os.makedirs(carpeta_salida, exist_ok=True)
-
-    # 1) Abrir el NetCDF original
-    ds_crisp = xr.open_dataset(ruta_archivo, decode_times=False)
-    if 'pr' in ds_crisp.data_vars:
-        var = 'pr'
-    elif 't2m' in ds_crisp.data_vars:
-        var = 't2m'
-    else:
-        ds_crisp.close()
-        raise ValueError("No se reconoce variable 'pr' o 't2m'")
-
-    da = ds_crisp[var]                        # DataArray (time, lat, lon)
-    datos = da.values.astype(float)         # numpy array
-
-    # 2) Log10 si es precipitación
-    if var == 'pr':
-        datos = np.log10(datos + 0.1)
-
-    # 3) Guardar rejilla original
-    orig_lons = ds_crisp.lon.values.copy()
-    orig_lats = ds_crisp.lat.values.copy()
-    T, Y, X = datos.shape
-
-    # 4) Rasterizar regiones
-    regiones = (gpd.read_file("shapefiles/regiones/Regional.shp")
-                    .to_crs(epsg=4326)
-                    .assign(rid=lambda df: np.arange(len(df))))
-    transform = from_bounds(
-        orig_lons.min(), orig_lats.max(),
-        orig_lons.max(), orig_lats.min(),
-        width=X, height=Y
-    )
-    mask2d = features.rasterize(
-        [(g, rid) for g, rid in zip(regiones.geometry, regiones.rid)],
-        out_shape=(Y, X),
-        transform=transform,
-        fill=-1,
-        dtype='int16'
-    )
+def generar_capas_fuzzy(ruta_archivo, carpeta_salida="uploads/fuzzy", workers=None, presupuesto=None, perfil=None,
+                        ventana=None, ruta_salida=None, anexar=False):
 
-    mask3d_invalid = np.broadcast_to(mask2d[None, :, :] == -1, datos.shape)
-    # 5) Preparar arrays fuzzy
-    baja  = np.zeros_like(datos);  baja [np.isnan(datos)] = np.nan
-    media = np.zeros_like(datos); media[np.isnan(datos)] = np.nan
-    alta  = np.zeros_like(datos);  alta [np.isnan(datos)] = np.nan
-
-    baja [mask3d_invalid] = np.nan
-    media[mask3d_invalid] = np.nan
-    alta [mask3d_invalid] = np.nan
-
-    # 6) Calcular membresías
-    for rid in np.unique(mask2d):
-        if rid < 0: 
-            continue
-        region_mask2d = (mask2d == rid)
-
-        for t in range(T):
-            datos_t    = datos[t, :, :]
-            valid_mask = region_mask2d & ~np.isnan(datos_t)
-            if not valid_mask.any():
-                continue
+    # Calcula las membresías baja/media/alta de cada mes y las guarda en
+    # carpeta_salida/fuzzy_<var>_<YYYY-MM>.nc (o en 'ruta_salida').
+    # Con ventana=(inicio, pasos) sólo se procesan esos pasos de tiempo de la entrada
+    # (pasos=None: hasta el final) y con anexar=True se agregan al final de
+    # 'ruta_salida' en vez de reescribirlo (ingesta incremental, ver app.series).
 
-            vals = datos_t[valid_mask]          #Solo este mes
-            m, M = float(vals.min()), float(vals.max())
-            L8   = (M - m) / 8.0
-            L2   = (M + m) / 2.0
-            uni  = np.linspace(m, M, 1000)
-
-            mf_low  = fuzz.trapmf(uni, [m,    m,    m+L8,   m+3*L8])
-            mf_med  = fuzz.trapmf(uni, [L2-3*L8, L2-L8, L2+L8, L2+3*L8])
-            mf_high = fuzz.trapmf(uni, [M-3*L8,   M-L8,   M,      M])
-
-            v = datos_t[valid_mask]
-            baja [t, valid_mask] = fuzz.interp_membership(uni, mf_low,  v)
-            media[t, valid_mask] = fuzz.interp_membership(uni, mf_med,  v)
-            alta [t, valid_mask] = fuzz.interp_membership(uni, mf_high, v)
-
-    # 7) Voltear arrays si la rejilla original está invertida
-    #    latitudes
-    if orig_lats[0] < orig_lats[-1]:
-        baja  = baja[:, ::-1, :]
-        media = media[:, ::-1, :]
-        alta  = alta[:, ::-1, :]
-        orig_lats = orig_lats[::-1]
-    #    longitudes
-    if orig_lons[0] > orig_lons[-1]:
-        baja  = baja[:, :, ::-1]
-        media = media[:, :, ::-1]
-        alta  = alta[:, :, ::-1]
-        orig_lons = orig_lons[::-1]
-
-    # 8) Crear DataArrays fuzzy con las coords corregidas
-    coords = {'time': ds_crisp.time, 'lat': orig_lats, 'lon': orig_lons}
-    dims = ('time', 'lat', 'lon')
-    da_baja  = xr.DataArray(baja,  dims=dims, coords=coords, name=f"{var}_baja")
-    da_media = xr.DataArray(media, dims=dims, coords=coords, name=f"{var}_media")
-    da_alta  = xr.DataArray(alta,  dims=dims, coords=coords, name=f"{var}_alta")
-
-    # 9) Montar y ordenar Dataset de salida
-    ds_out = ds_crisp.assign({
-        da_baja.name:  da_baja,
-        da_media.name: da_media,
-        da_alta.name:  da_alta
-    })
-    ds_out = ds_out.transpose('time','lat','lon')
+    os.makedirs(carpeta_salida, exist_ok=True)
+    if workers is None:
+        workers = workers_fuzzy()
 
-    # 10) Guardar y cerrar
-    ds_out = limpiar_atributos_conflictivos(ds_out)
-    nombre_base = generar_nombre_base(ds_out)
-    ruta_salida = os.path.join(carpeta_salida, f"fuzzy_{var}_{nombre_base}.nc")
-    ds_out.to_netcdf(ruta_salida)
-    ds_crisp.close()
-    ds_out.close()
+    # 1) Abrir el NetCDF original (los datos se leen por bloques de tiempo)
+    ds_abierto = pool_datasets.abrir_dataset(ruta_archivo)
+    try:
+        ds_crisp = ventana_tiempo(ds_abierto, *(ventana or (0, None)))
+        if 'pr' in ds_crisp.data_vars:
+            var = 'pr'
+        elif 't2m' in ds_crisp.data_vars:
+            var = 't2m'
+        else:
+            raise ValueError("No se reconoce variable 'pr' o 't2m'")
+
+        da = ds_crisp[var]                        # DataArray (time, lat, lon)
+
+        # 2) Rejilla del archivo (los recortes de la ingesta ya vienen en orientación canónica)
+        rejilla = indice_zonas.rejilla_dataset(ds_crisp)
+        T, Y, X = da.shape
+
+        # 3) Etiquetas de región sobre la rejilla (índice de zonas, en la orientación de los datos)
+        mask2d = indice_zonas.etiquetas_regiones(rejilla)
+
+        # 4) Orientación de salida: latitudes Norte→Sur y longitudes Oeste→Este
+        voltear_lat = rejilla['voltear_lat']
+        voltear_lon = rejilla['voltear_lon']
+        lats_out = rejilla['lats']
+        lons_out = rejilla['lons']
+
+        paso = bloques.pasos_por_bloque(T, bloques.bytes_por_paso(da, COPIAS_FUZZY), presupuesto)
+
+        def bloques_fuzzy():
+            with fuzzificador(mask2d, (paso, Y, X), workers) as fuzzificar:
+                for t0, t1 in bloques.iterar_bloques(T, paso):
+                    ds_blk = ds_crisp.isel(time=slice(t0, t1))
+                    datos = ds_blk[var].values.astype(float)
+
+                    # 5) Log10 si es precipitación
+                    if var == 'pr':
+                        datos = np.log10(datos + 0.1)
+
+                    # 6) Calcular membresías por (mes, región)
+                    baja, media, alta = fuzzificar(datos)
+
+                    # 7) Voltear arrays si la rejilla original está invertida (archivos
+                    #    recortados antes de la orientación en la ingesta)
+                    if voltear_lat:
+                        baja, media, alta = baja[:, ::-1, :], media[:, ::-1, :], alta[:, ::-1, :]
+                    if voltear_lon:
+                        baja, media, alta = baja[:, :, ::-1], media[:, :, ::-1], alta[:, :, ::-1]
+
+                    # 8) Crear DataArrays fuzzy con las coords corregidas
+                    coords = {'time': ds_blk.time, 'lat': lats_out, 'lon': lons_out}
+                    dims = ('time', 'lat', 'lon')
+                    da_baja  = xr.DataArray(baja,  dims=dims, coords=coords, name=f"{var}_baja")
+                    da_media = xr.DataArray(media, dims=dims, coords=coords, name=f"{var}_media")
+                    da_alta  = xr.DataArray(alta,  dims=dims, coords=coords, name=f"{var}_alta")
+
+                    # 9) Montar y ordenar Dataset de salida del bloque
+                    ds_out = ds_blk.assign({
+                        da_baja.name:  da_baja,
+                        da_media.name: da_media,
+                        da_alta.name:  da_alta
+                    })
+                    ds_out = ds_out.transpose('time','lat','lon')
+                    if voltear_lat or voltear_lon:
+                        ds_out = ds_out.assign_attrs(
+                            indice_zonas.atributos_rejilla(lats_out, lons_out)
+                        )
+                    yield limpiar_atributos_conflictivos(ds_out)
+
+        # 10) Guardar (o anexar) bloque a bloque y cerrar
+        nombre_base = generar_nombre_base(ds_crisp)
+        if ruta_salida is None:
+            ruta_salida = os.path.join(carpeta_salida, f"fuzzy_{var}_{nombre_base}.nc")
+        if anexar:
+            bloques.anexar_bloques(bloques_fuzzy(), ruta_salida)
+        else:
+            encoding = almacenamiento.codificacion_capas(
+                [f"{var}_{cat}" for cat in membresia.CATEGORIAS], perfil
+            )
+            bloques.guardar_bloques(bloques_fuzzy(), ruta_salida, encoding=encoding)
+    finally:
+        pool_datasets.liberar_dataset(ds_abierto)
 
     return {
         'archivo_salida': ruta_salida,
@@ -188,128 +228,470 @@ def generar_capas_fuzzy(ruta_archivo, carpeta_salida="uploads/fuzzy"):
     }
 
 
-def calcular_indice_riesgo_fuzzy(pr_path, t2m_path, carpeta_salida="uploads/riesgo_fuzzy"):
-    # Genera un NetCDF con las nueve componentes:
-    #  - riesgo_alto_A:  pr_baja
-    #  - riesgo_alto_B:  t2m_alta
-    #  - riesgo_medio_A: pr_media
-    #  - riesgo_medio_B: t2m_media
-    #  - riesgo_medio_C: min(pr_media, t2m_media)
-    #  - riesgo_medio_D: max(pr_media, t2m_media)
-    #  - riesgo_medio_E: (pr_media + t2m_media) / 2
-    #  - riesgo_bajo_A:  pr_alta
-    #  - riesgo_bajo_B:  t2m_baja
+def calcular_membresias(datos, mask2d, workers=1):
+
+    # Calcula los cubos baja/media/alta (time, lat, lon) de 'datos' usando las regiones
+    # de mask2d (etiqueta -1 = fuera de toda región → NaN).
+    # Con workers > 1 el eje temporal se divide en tramos que se procesan en un
+    # ProcessPoolExecutor; el resultado es idéntico al cálculo en serie.
+
+    with fuzzificador(mask2d, datos.shape, workers) as fuzzificar:
+        return fuzzificar(datos)
+
+
+@contextmanager
+def fuzzificador(mask2d, forma_max, workers=1):
+
+    # Prepara el cálculo de membresías para bloques de hasta forma_max = (t, lat, lon)
+    # y entrega una función fuzzificar(datos) -> (baja, media, alta).
+    # En serie, la agrupación de píxeles por región se calcula una sola vez. Con
+    # workers > 1 se crea un único pool de procesos para todos los bloques: la entrada
+    # y las tres salidas viven en memoria compartida, cada proceso recibe la máscara de
+    # regiones una sola vez (al iniciarse) y escribe su tramo de meses directamente en
+    # la salida, sin devolver arrays serializados.
+    # Los procesos se inician con 'spawn' y no con fork: el pool se crea desde los hilos
+    # de la ingesta, y un fork de un proceso con hilos puede heredar tomado un candado
+    # (HDF5, pool de conexiones, catálogo) y quedar bloqueado.
+
+    if workers <= 1 or forma_max[0] <= 1:
+        pixeles, inicios = agrupar_pixeles_por_region(mask2d)
+
+        def fuzzificar(datos):
+            cubos = tuple(np.empty(datos.shape) for _ in membresia.CATEGORIAS)
+            fuzzificar_bloque(datos, pixeles, inicios, cubos)
+            return cubos
+
+        yield fuzzificar
+        return
+
+    forma_max = tuple(forma_max)
+    nbytes = int(np.prod(forma_max)) * np.dtype(np.float64).itemsize
+    entrada = shared_memory.SharedMemory(create=True, size=nbytes)
+    salida  = shared_memory.SharedMemory(create=True, size=3 * nbytes)
+    try:
+        datos_compartidos = np.ndarray(forma_max, dtype=np.float64, buffer=entrada.buf)
+        cubos_compartidos = np.ndarray((3,) + forma_max, dtype=np.float64, buffer=salida.buf)
+
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=get_context('spawn'),
+            initializer=iniciar_trabajador_fuzzy,
+            initargs=(mask2d, entrada.name, salida.name, forma_max)
+        ) as pool:
+
+            def fuzzificar(datos):
+                T = datos.shape[0]
+                datos_compartidos[:T] = datos
+
+                # Más tramos que procesos para repartir mejor la carga
+                n_tramos = min(T, 2 * workers)
+                limites = np.linspace(0, T, n_tramos + 1).astype(int)
+                list(pool.map(fuzzificar_bloque_compartido, limites[:-1], limites[1:]))
+
+                cubos = cubos_compartidos[:, :T].copy()
+                return cubos[0], cubos[1], cubos[2]
+
+            yield fuzzificar
+
+        del datos_compartidos, cubos_compartidos
+    finally:
+        entrada.close()
+        entrada.unlink()
+        salida.close()
+        salida.unlink()
+
+
+def fuzzificar_bloque(datos, pixeles, inicios, cubos):
+
+    # Escribe en 'cubos' (tres arrays (t, lat, lon)) las membresías de un bloque de
+    # meses 'datos' (t, lat, lon). Los píxeles fuera de región quedan en NaN.
+
+    T = datos.shape[0]
+    valores = datos.reshape(T, -1)[:, pixeles]   # (time, píxeles) ordenado por región
+    minimos, maximos = calcular_extremos_por_region(valores, inicios)
+    resultados = membresias_por_grupo(valores, inicios, minimos, maximos)
+    for cubo, res in zip(cubos, resultados):
+        plano = cubo.reshape(T, -1)
+        plano[:] = np.nan
+        plano[:, pixeles] = res
+
+
+# Estado de cada proceso trabajador (memoria compartida y agrupación de píxeles)
+TRABAJADOR_FUZZY = {}
+
+
+def iniciar_trabajador_fuzzy(mask2d, nombre_entrada, nombre_salida, forma):
+    # Los procesos del pool comparten el resource tracker del proceso principal,
+    # que es quien libera los bloques al terminar
+    entrada = shared_memory.SharedMemory(name=nombre_entrada)
+    salida  = shared_memory.SharedMemory(name=nombre_salida)
+    pixeles, inicios = agrupar_pixeles_por_region(mask2d)
+    TRABAJADOR_FUZZY.update({
+        'entrada': entrada,
+        'salida':  salida,
+        'datos':   np.ndarray(forma, dtype=np.float64, buffer=entrada.buf),
+        'cubos':   np.ndarray((3,) + tuple(forma), dtype=np.float64, buffer=salida.buf),
+        'pixeles': pixeles,
+        'inicios': inicios,
+    })
+
+
+def fuzzificar_bloque_compartido(t0, t1):
+    estado = TRABAJADOR_FUZZY
+    fuzzificar_bloque(
+        estado['datos'][t0:t1],
+        estado['pixeles'],
+        estado['inicios'],
+        tuple(cubo[t0:t1] for cubo in estado['cubos'])
+    )
+    return t0, t1
+
+
+def agrupar_pixeles_por_region(mask2d):
+
+    # Ordena los píxeles que pertenecen a alguna región (etiqueta >= 0) según su región.
+    # Retorna:
+    #   - pixeles: índices planos (lat*lon) de esos píxeles, agrupados por región
+    #   - inicios: posición donde comienza cada región dentro de 'pixeles'
+
+    plano   = mask2d.ravel()
+    pixeles = np.flatnonzero(plano >= 0)
+    pixeles = pixeles[np.argsort(plano[pixeles], kind='stable')]
+    _, inicios = np.unique(plano[pixeles], return_index=True)
+    return pixeles, inicios
+
+
+def calcular_extremos_por_region(valores, inicios):
+
+    # Mínimo y máximo de cada (mes, región) ignorando NaN, en una sola reducción
+    # segmentada sobre los píxeles ya agrupados por región.
+    # Retorna dos arrays (time, regiones); NaN donde la región no tiene datos ese mes.
+
+    if valores.shape[1] == 0:
+        vacio = np.full((valores.shape[0], 0), np.nan)
+        return vacio, vacio.copy()
+    minimos = np.fmin.reduceat(valores, inicios, axis=1)
+    maximos = np.fmax.reduceat(valores, inicios, axis=1)
+    return minimos, maximos
+
+
+def membresias_por_grupo(valores, inicios, minimos, maximos, out=None):
+
+    # Grados de pertenencia baja/media/alta de cada valor respecto de los trapecios de
+    # su (mes, región), evaluados en forma cerrada (app.membresia).
+    #   - valores: (time, píxeles) agrupados por región
+    #   - inicios: posición donde comienza cada región dentro de los píxeles
+    #   - minimos, maximos: (time, regiones)
+    #   - out: tupla opcional de tres buffers (time, píxeles)
+    # Cada región es un bloque contiguo de columnas, así que sus parámetros (time, 1)
+    # se aplican por broadcasting sin replicarlos píxel a píxel.
+
+    if out is None:
+        out = tuple(np.empty(valores.shape, dtype=valores.dtype) for _ in membresia.CATEGORIAS)
+    fines = np.append(inicios[1:], valores.shape[1])
+    for r, (ini, fin) in enumerate(zip(inicios, fines)):
+        membresia.membresias(
+            valores[:, ini:fin],
+            minimos[:, r:r+1],
+            maximos[:, r:r+1],
+            out=tuple(buf[:, ini:fin] for buf in out)
+        )
+    return out
+
+
+def calcular_indice_riesgo_fuzzy(pr_path, t2m_path, carpeta_salida="uploads/riesgo_fuzzy", presupuesto=None, perfil=None,
+                                 ventana=None, ruta_salida=None, anexar=False, variables=None, base=None):
+    # Genera un NetCDF con el índice de riesgo fuzzy según la base de reglas compilada
+    # 'base' (por defecto la activa, ver app.reglas): una componente por regla, un
+    # agregado por clase y la salida final (riesgo_fuzzy).
+    # 'variables' elige cuáles se guardan (por defecto según SALIDA_RIESGO_FUZZY); las
+    # componentes que no se piden no se materializan.
+    # El cálculo se hace por bloques de tiempo (ver app.bloques) con buffers que se
+    # reservan una vez y se reutilizan en cada bloque; sólo se leen las membresías que
+    # aparecen en los antecedentes.
+    # Con ventana=(inicio_pr, inicio_t2m, pasos) se combinan sólo esos pasos de cada
+    # entrada (pasos=None: hasta el final de la más corta); 'ruta_salida' y 'anexar'
+    # funcionan como en generar_capas_fuzzy.
+
+    if base is None:
+        base = reglas.base_activa()
+    if variables is None:
+        variables = variables_riesgo_fuzzy(base)
+    desconocidas = [v for v in variables if v not in base['variables']]
+    if desconocidas:
+        raise ValueError(f"Variable de riesgo fuzzy desconocida: {', '.join(desconocidas)}")
+    variables  = [v for v in base['variables'] if v in variables]
+    calculadas = [v for v in base['variables'] if v in variables or v in base['agregados']]
 
     os.makedirs(carpeta_salida, exist_ok=True)
-    pr_ds  = xr.open_dataset(pr_path,  decode_times=False)
-    t2m_ds = xr.open_dataset(t2m_path, decode_times=False)
-
-    # Extraer arrays numpy directamente como en la versión original para evitar alineación
-    pr_baja   = pr_ds['pr_baja'].values
-    pr_media  = pr_ds['pr_media'].values
-    pr_alta   = pr_ds['pr_alta'].values
-    t2m_baja  = t2m_ds['t2m_baja'].values
-    t2m_media = t2m_ds['t2m_media'].values
-    t2m_alta  = t2m_ds['t2m_alta'].values
-
-    # Calcular las componentes solicitadas
-    """riesgo_alto_A  = np.minimum(t2m_alta,  pr_baja)  # Tem Alta + Pr Baja 
-    riesgo_alto_B  = np.minimum(t2m_media, pr_baja)  # Tem Media + Pr Baja
-
-    riesgo_medio_A = np.minimum(t2m_baja,  pr_baja)  # Tem Baja + Pr Baja
-    riesgo_medio_B = np.minimum(t2m_alta,  pr_media) # Tem Alta + Pr Media
-    riesgo_medio_C = np.minimum(t2m_media, pr_media) # Tem Media + Pr Media
-    riesgo_medio_D = np.minimum(t2m_baja,  pr_media) # Tem Baja + Pr Media
-    riesgo_medio_E = np.minimum(t2m_alta,  pr_alta)  # Tem Alta + Pr Alta
-
-    riesgo_bajo_A  = np.minimum(t2m_media, pr_alta)  # Tem Media + Pr Alta
-    riesgo_bajo_B  = np.minimum(t2m_baja,  pr_alta)  # Tem Baja + Pr Alta"""
-
-    riesgo_alto_A  = (t2m_alta + pr_baja)/2  # Tem Alta + Pr Baja 
-    riesgo_alto_B  = (t2m_media + pr_baja)/2  # Tem Media + Pr Baja
-
-    riesgo_medio_A = (t2m_baja + pr_baja)/2  # Tem Baja + Pr Baja
-    riesgo_medio_B = (t2m_alta + pr_media)/2 # Tem Alta + Pr Media
-    riesgo_medio_C = (t2m_media + pr_media)/2 # Tem Media + Pr Media
-    riesgo_medio_D = (t2m_baja + pr_media)/2 # Tem Baja + Pr Media
-    riesgo_medio_E = (t2m_alta + pr_alta)/2  # Tem Alta + Pr Alta
-
-    riesgo_bajo_A  = (t2m_media + pr_alta)/2  # Tem Media + Pr Alta
-    riesgo_bajo_B  = (t2m_baja + pr_alta)/2  # Tem Baja + Pr Alta
-
-    riesgo_alto  = np.maximum(riesgo_alto_A, riesgo_alto_B)
-    riesgo_medio = np.maximum.reduce([
-        riesgo_medio_A,
-        riesgo_medio_B,
-        riesgo_medio_C,
-        riesgo_medio_D,
-        riesgo_medio_E
-    ])
-    riesgo_bajo  = np.maximum(riesgo_bajo_A, riesgo_bajo_B)
-
-    riesgo_fuzzy = np.maximum.reduce([riesgo_alto, riesgo_medio, riesgo_bajo])
-
-    coords = pr_ds.coords
-
-    ds_r = xr.Dataset({
-        "riesgo_alto_A":   (("time", "lat", "lon"), riesgo_alto_A),
-        "riesgo_alto_B":   (("time", "lat", "lon"), riesgo_alto_B),
-        "riesgo_medio_A":  (("time", "lat", "lon"), riesgo_medio_A),
-        "riesgo_medio_B":  (("time", "lat", "lon"), riesgo_medio_B),
-        "riesgo_medio_C":  (("time", "lat", "lon"), riesgo_medio_C),
-        "riesgo_medio_D":  (("time", "lat", "lon"), riesgo_medio_D),
-        "riesgo_medio_E":  (("time", "lat", "lon"), riesgo_medio_E),
-        "riesgo_bajo_A":   (("time", "lat", "lon"), riesgo_bajo_A),
-        "riesgo_bajo_B":   (("time", "lat", "lon"), riesgo_bajo_B),
-        "riesgo_alto":   (("time", "lat", "lon"), riesgo_alto),
-        "riesgo_medio":  (("time", "lat", "lon"), riesgo_medio),
-        "riesgo_bajo":   (("time", "lat", "lon"), riesgo_bajo),
-        "riesgo_fuzzy":  (("time", "lat", "lon"), riesgo_fuzzy),
-    }, coords=coords)
-
-    ds_r = limpiar_atributos_conflictivos(ds_r)
-    nombre_base = generar_nombre_base(pr_ds)
-    ruta_salida = os.path.join(carpeta_salida, f"riesgo_fuzzy_{nombre_base}.nc")
-    ds_r.to_netcdf(ruta_salida)
-
-    pr_ds.close()
-    t2m_ds.close()
-    ds_r.close()
+    pr_abierto  = pool_datasets.abrir_dataset(pr_path)
+    t2m_abierto = pool_datasets.abrir_dataset(t2m_path)
+    try:
+        pr_ds, t2m_ds = ventanas_pareadas(pr_abierto, t2m_abierto, ventana)
+        ds_entrada = {'pr': pr_ds, 't2m': t2m_ds}
+
+        T, Y, X = pr_ds['pr_baja'].shape
+        copias = COPIAS_RIESGO_FUZZY + len(base['antecedentes']) + len(calculadas)
+        paso = bloques.pasos_por_bloque(T, bloques.bytes_por_paso(pr_ds['pr_baja'], copias), presupuesto)
+        dtype = np.result_type(pr_ds['pr_baja'].dtype, t2m_ds['t2m_baja'].dtype)
+
+        def bloques_riesgo():
+            # Los Datasets que se entregan envuelven los buffers, que se sobrescriben en el
+            # bloque siguiente: bloques.guardar_bloques escribe cada uno antes de pedir otro
+            buffers  = {v: np.empty((paso, Y, X), dtype=dtype) for v in calculadas}
+            aux      = np.empty((paso, Y, X), dtype=dtype)
+            temporal = np.empty((paso, Y, X), dtype=dtype)
+            for t0, t1 in bloques.iterar_bloques(T, paso):
+                tiempo = slice(t0, t1)
+                n = t1 - t0
+
+                # Extraer arrays numpy directamente como en la versión original para evitar alineación
+                entradas = {
+                    (var, cat): ds_entrada[var][f"{var}_{cat}"][tiempo].values
+                    for var, cat in base['antecedentes']
+                }
+
+                salidas = base['kernel'](
+                    entradas, {v: buf[:n] for v, buf in buffers.items()}, aux[:n], temporal[:n]
+                )
+
+                coords = pr_ds.isel(time=tiempo).coords
+                atributos = dict(indice_zonas.atributos_guardados(pr_ds), huella_reglas=base['huella'])
+                ds_r = xr.Dataset(
+                    {v: (("time", "lat", "lon"), salidas[v]) for v in variables},
+                    coords=coords, attrs=atributos
+                )
+
+                yield limpiar_atributos_conflictivos(ds_r)
+
+        nombre_base = generar_nombre_base(pr_ds)
+        if ruta_salida is None:
+            ruta_salida = os.path.join(carpeta_salida, f"riesgo_fuzzy_{nombre_base}.nc")
+        if anexar:
+            bloques.anexar_bloques(bloques_riesgo(), ruta_salida)
+        else:
+            encoding = almacenamiento.codificacion_capas(variables, perfil)
+            bloques.guardar_bloques(bloques_riesgo(), ruta_salida, encoding=encoding)
+    finally:
+        pool_datasets.liberar_dataset(pr_abierto)
+        pool_datasets.liberar_dataset(t2m_abierto)
 
     return {'archivo': ruta_salida, 'nombre_base': nombre_base, 'mensaje': 'Índice fuzzy descompuesto generado'}
 
 
-def calcular_indice_riesgo_crisp(pr_path, t2m_path, carpeta_salida="uploads/riesgo_crisp"):
+def evaluar_lote_riesgo_fuzzy(pr_path, t2m_path, bases, resumen=False, ventana=None, presupuesto=None):
+
+    # Evalúa N bases de reglas (p.ej. variantes de operadores o pesos para un análisis
+    # de sensibilidad) sobre una sola lectura de las membresías de pr_path y t2m_path,
+    # sin escribir archivos (ver reglas.compilar_lote). Cada base puede llevar un
+    # 'nombre' que la identifica en el resultado.
+    #   - resumen=False: DataArray (config, time, lat, lon) con la salida final de cada
+    #     base (ocupa N cubos; el presupuesto sólo limita la memoria de trabajo)
+    #   - resumen=True: Dataset (config, time) con la media, el mínimo y el máximo
+    #     espaciales de cada mes, sin guardar los cubos
+    # El cálculo se hace por bloques de tiempo según 'presupuesto' (ver app.bloques);
+    # 'ventana' funciona como en calcular_indice_riesgo_fuzzy.
+
+    lote = reglas.compilar_lote(bases)
+    nombres = [base.get('nombre', f"config_{i}") for i, base in enumerate(bases)]
+    N = lote['n']
+
+    pr_abierto  = pool_datasets.abrir_dataset(pr_path)
+    t2m_abierto = pool_datasets.abrir_dataset(t2m_path)
+    try:
+        pr_ds, t2m_ds = ventanas_pareadas(pr_abierto, t2m_abierto, ventana)
+        ds_entrada = {'pr': pr_ds, 't2m': t2m_ds}
+
+        T, Y, X = pr_ds['pr_baja'].shape
+        dtype = np.result_type(pr_ds['pr_baja'].dtype, t2m_ds['t2m_baja'].dtype)
+        forma_trabajo = (lote['clases_maximas'] + 2, lote['grupo_maximo'])
+        copias = (len(lote['antecedentes']) + lote['n_activaciones']
+                  + int(np.prod(forma_trabajo)) + (2 * N if resumen else 0))
+        paso = bloques.pasos_por_bloque(T, bloques.bytes_por_paso(pr_ds['pr_baja'], copias), presupuesto)
+
+        # Buffers planos: cada bloque usa un prefijo contiguo con su forma
+        plano_activaciones = np.empty(lote['n_activaciones'] * paso * Y * X, dtype=dtype)
+        plano_trabajo      = np.empty(int(np.prod(forma_trabajo)) * paso * Y * X, dtype=dtype)
+        if resumen:
+            plano_salida = np.empty(N * paso * Y * X, dtype=dtype)
+            estadisticas = {e: np.full((N, T), np.nan) for e in ('media', 'minimo', 'maximo')}
+        else:
+            cubo = np.empty((N, T, Y, X), dtype=dtype)
+
+        for t0, t1 in bloques.iterar_bloques(T, paso):
+            tiempo = slice(t0, t1)
+            n = t1 - t0
+            entradas = {
+                (var, cat): ds_entrada[var][f"{var}_{cat}"][tiempo].values
+                for var, cat in lote['antecedentes']
+            }
+            activaciones = plano_activaciones[:lote['n_activaciones'] * n * Y * X].reshape(-1, n, Y, X)
+            trabajo = plano_trabajo[:int(np.prod(forma_trabajo)) * n * Y * X].reshape(forma_trabajo + (n, Y, X))
+
+            if not resumen:
+                lote['kernel'](entradas, cubo[:, tiempo], activaciones, trabajo)
+                continue
+
+            salida = plano_salida[:N * n * Y * X].reshape(N, n, Y, X)
+            lote['kernel'](entradas, salida, activaciones, trabajo)
+            valores = salida.reshape(N, n, -1)
+            validos = np.count_nonzero(~np.isnan(valores), axis=2)
+            suma = np.nansum(valores, axis=2)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                estadisticas['media'][:, tiempo] = np.where(validos > 0, suma / validos, np.nan)
+            estadisticas['minimo'][:, tiempo] = np.fmin.reduce(valores, axis=2)
+            estadisticas['maximo'][:, tiempo] = np.fmax.reduce(valores, axis=2)
+
+        coords = {'config': nombres, 'time': pr_ds['time'].values}
+        atributos = dict(indice_zonas.atributos_guardados(pr_ds), huellas_reglas=",".join(lote['huellas']))
+        if resumen:
+            return xr.Dataset(
+                {e: (("config", "time"), valores) for e, valores in estadisticas.items()},
+                coords=coords, attrs=atributos
+            )
+        coords.update(lat=pr_ds['lat'].values, lon=pr_ds['lon'].values)
+        return xr.DataArray(
+            cubo, dims=("config", "time", "lat", "lon"), coords=coords, name='riesgo_fuzzy', attrs=atributos
+        )
+    finally:
+        pool_datasets.liberar_dataset(pr_abierto)
+        pool_datasets.liberar_dataset(t2m_abierto)
+
+
+def origen_extremos(pr_path, t2m_path, ventana=None):
+
+    # Identifica las entradas de los extremos de un índice crisp: ruta, tamaño y fecha
+    # de modificación de cada archivo (las escrituras por bloques reemplazan el archivo,
+    # así que cambian si cambia su contenido) y la ventana usada.
+
+    partes = []
+    for ruta in (pr_path, t2m_path):
+        info = os.stat(ruta)
+        partes.append(f"{os.path.abspath(ruta)}:{info.st_size}:{info.st_mtime_ns}")
+    partes.append(str(tuple(ventana) if ventana is not None else None))
+    return "|".join(partes)
+
+
+def extremos_guardados(ruta, origen):
+
+    # Extremos (pr_min, pr_max, t2m_min, t2m_max) guardados como atributos en el índice
+    # crisp 'ruta', si éste se generó con las mismas entradas ('origen'); si no, None.
+
+    if not os.path.exists(ruta):
+        return None
+    try:
+        ds = pool_datasets.abrir_dataset(ruta)
+    except (OSError, ValueError):
+        return None
+    try:
+        if ds.attrs.get('origen_extremos') != origen:
+            return None
+        return tuple(float(ds.attrs[k]) for k in ATRIBUTOS_EXTREMOS)
+    except KeyError:
+        return None
+    finally:
+        pool_datasets.liberar_dataset(ds)
+
+
+def calcular_extremos(ds_pr, ds_t2m, paso):
+
+    # Primera pasada: mínimos y máximos globales de pr y t2m recorriendo la serie por
+    # bloques de 'paso' meses. Se reduce en el tipo del archivo (sin copiar a float64);
+    # fmin/fmax ignoran NaN, igual que nanmin/nanmax.
+
+    pr_min = pr_max = t_min = t_max = np.nan
+    for t0, t1 in bloques.iterar_bloques(ds_pr.sizes['time'], paso):
+        pr  = ds_pr['pr'][t0:t1].values
+        t2m = ds_t2m['t2m'][t0:t1].values
+        pr_min = np.fmin(pr_min, float(np.fmin.reduce(pr, axis=None)))
+        pr_max = np.fmax(pr_max, float(np.fmax.reduce(pr, axis=None)))
+        t_min  = np.fmin(t_min,  float(np.fmin.reduce(t2m, axis=None)))
+        t_max  = np.fmax(t_max,  float(np.fmax.reduce(t2m, axis=None)))
+    return pr_min, pr_max, t_min, t_max
+
+
+def calcular_indice_riesgo_crisp(pr_path, t2m_path, carpeta_salida="uploads/riesgo_crisp", presupuesto=None, perfil=None,
+                                 ventana=None):
     
     # Genera un NetCDF con índice de riesgo crisp:
     # riesgo_crisp = max(1 - pr_norm, t2m_norm)
+    # Se recorre la serie por bloques de tiempo en dos pasadas: la primera obtiene los
+    # extremos globales de pr y t2m, la segunda normaliza y escribe cada bloque.
+    # Los extremos quedan como atributos del archivo (ATRIBUTOS_EXTREMOS, junto con
+    # 'origen_extremos'); si el archivo anterior se generó con las mismas entradas, se
+    # reutilizan y se omite la primera pasada.
+    # Con ventana=(inicio_pr, inicio_t2m, pasos) se usa sólo ese tramo de cada entrada.
+    # La normalización depende de los extremos de todo el tramo, así que el índice
+    # siempre se recalcula completo (no se anexa).
     
     os.makedirs(carpeta_salida, exist_ok=True)
-    ds_pr  = xr.open_dataset(pr_path,  decode_times=False)
-    ds_t2m = xr.open_dataset(t2m_path, decode_times=False)
+    pr_abierto  = pool_datasets.abrir_dataset(pr_path)
+    t2m_abierto = pool_datasets.abrir_dataset(t2m_path)
+    try:
+        ds_pr, ds_t2m = ventanas_pareadas(pr_abierto, t2m_abierto, ventana)
+
+        T = ds_pr.sizes['time']
+        paso = bloques.pasos_por_bloque(T, bloques.bytes_por_paso(ds_pr['pr'], COPIAS_CRISP), presupuesto)
+
+        nombre_base = generar_nombre_base(ds_pr)
+        ruta_salida = os.path.join(carpeta_salida, f"riesgo_crisp_{nombre_base}.nc")
+
+        # 1) Extremos globales
+        origen = origen_extremos(pr_path, t2m_path, ventana)
+        extremos = extremos_guardados(ruta_salida, origen)
+        if extremos is None:
+            extremos = calcular_extremos(ds_pr, ds_t2m, paso)
+        pr_min, pr_max, t_min, t_max = extremos
+        atributos = dict(indice_zonas.atributos_guardados(ds_pr), origen_extremos=origen)
+        atributos.update(zip(ATRIBUTOS_EXTREMOS, extremos))
+
+        # 2) Normalizar y escribir por bloques
+        def bloques_crisp():
+            for t0, t1 in bloques.iterar_bloques(T, paso):
+                pr   = ds_pr['pr'][t0:t1].values.astype(float)
+                t2m  = ds_t2m['t2m'][t0:t1].values.astype(float)
+                coords = ds_pr.isel(time=slice(t0, t1)).coords
+
+                pr_norm = (pr - pr_min) / (pr_max - pr_min + 1e-9)
+                t_norm  = (t2m - t_min) / (t_max - t_min  + 1e-9)
+
+                crisp = np.maximum(1 - pr_norm, t_norm)
+
+                ds_crisp = xr.Dataset(
+                    {"riesgo_crisp": (("time","lat","lon"), crisp)},
+                    coords=coords, attrs=atributos
+                )
+                yield limpiar_atributos_conflictivos(ds_crisp)
+
+        encoding = almacenamiento.codificacion_capas(["riesgo_crisp"], perfil)
+        bloques.guardar_bloques(bloques_crisp(), ruta_salida, encoding=encoding)
+    finally:
+        pool_datasets.liberar_dataset(pr_abierto)
+        pool_datasets.liberar_dataset(t2m_abierto)
 
-    pr   = ds_pr['pr'].values.astype(float)
-    t2m  = ds_t2m['t2m'].values.astype(float)
-    coords = ds_pr.coords
+    return {'archivo': ruta_salida, 'nombre_base': nombre_base, 'mensaje': 'Índice crisp generado'}
 
-    pr_min, pr_max = np.nanmin(pr), np.nanmax(pr)
-    t_min,  t_max  = np.nanmin(t2m), np.nanmax(t2m)
-    pr_norm = (pr - pr_min) / (pr_max - pr_min + 1e-9)
-    t_norm  = (t2m - t_min) / (t_max - t_min  + 1e-9)
 
-    crisp = np.maximum(1 - pr_norm, t_norm)
+def ventana_tiempo(ds, inicio=0, pasos=None):
 
-    ds_crisp = xr.Dataset({"riesgo_crisp": (("time","lat","lon"), crisp)}, coords=coords)
-    ds_crisp = limpiar_atributos_conflictivos(ds_crisp)
-    nombre_base = generar_nombre_base(ds_pr)
-    ruta_salida = os.path.join(carpeta_salida, f"riesgo_crisp_{nombre_base}.nc")
-    ds_crisp.to_netcdf(ruta_salida)
+    # Vista (perezosa) de los pasos [inicio, inicio + pasos) de ds; pasos=None hasta el final.
 
-    ds_pr.close()
-    ds_t2m.close()
-    ds_crisp.close()
+    if inicio == 0 and pasos is None:
+        return ds
+    return ds.isel(time=slice(inicio, None if pasos is None else inicio + pasos))
 
-    return {'archivo': ruta_salida, 'nombre_base': nombre_base, 'mensaje': 'Índice crisp generado'}
+
+def ventanas_pareadas(ds_pr, ds_t2m, ventana=None):
+
+    # Aplica ventana=(inicio_pr, inicio_t2m, pasos) a las dos entradas de un índice de
+    # riesgo. Sin 'pasos' ambas se cortan al largo de la más corta.
+
+    if ventana is None:
+        return ds_pr, ds_t2m
+    inicio_pr, inicio_t2m, pasos = ventana
+    if pasos is None:
+        pasos = min(ds_pr.sizes['time'] - inicio_pr, ds_t2m.sizes['time'] - inicio_t2m)
+    return ventana_tiempo(ds_pr, inicio_pr, pasos), ventana_tiempo(ds_t2m, inicio_t2m, pasos)
 
 
 def calcular_fecha_desde_indice(nombre_base, indice):
@@ -327,149 +709,213 @@ def calcular_fecha_desde_indice(nombre_base, indice):
     return f"{año}-{mes:02d}"
 
 
-def generar_geotiff_zona(zona_gdf, ruta_netcdf, indice_tiempo, var_name):
+def generar_geotiff_zona(zona, valor, ruta_netcdf, indice_tiempo, var_name):
     
-    # Genera un GeoTIFF recortado a la geometría zona_gdf, a partir de la variable var_name
+    # Genera un GeoTIFF recortado a la zona (zona, valor), a partir de la variable var_name
     # en el netCDF ruta_netcdf en el paso temporal indice_tiempo.
-    # Corrige la orientación de eje X e Y para que se muestre correctamente en Leaflet.
+    # Retorna los bytes del TIFF (ver geotiff_zona).
     
 
-    # 1) Asegurar CRS de la zona
-    if zona_gdf.crs is None or zona_gdf.crs.to_string() != "EPSG:4326":
-        zona_gdf = zona_gdf.to_crs(epsg=4326)
-
-    # 2) Abrir el netCDF y extraer la capa (no decodificamos time)
-    ds = xr.open_dataset(ruta_netcdf, decode_times=False)
-    if var_name not in ds.data_vars:
-        ds.close()
-        raise KeyError(f"Variable {var_name} no encontrada en {ruta_netcdf}")
-    data = ds[var_name].isel(time=indice_tiempo).values.astype(np.float32)
-    lons = ds["lon"].values.copy()
-    lats = ds["lat"].values.copy()
-    ds.close()
-
-    # 3) Forzar orientación de Z:
-    #    latitudes de Norte→Sur (descendiente)
-    if lats[0] < lats[-1]:
-        data = data[::-1, :]
-        lats = lats[::-1]
-    #    longitudes de Oeste→Este (ascendiente)
-    if lons[0] > lons[-1]:
-        data = data[:, ::-1]
-        lons = lons[::-1]
-
-    # 4) Calcular resolución y transform
-    dx = float(lons[1] - lons[0])
-    dy = float(lats[0] - lats[1])  # lats[0]>lats[1] tras invertir
-    transform = from_origin(
-        west=lons.min(),
-        north=lats.max(),
-        xsize=dx,
-        ysize=dy
+    ds = pool_datasets.abrir_dataset(ruta_netcdf)
+    try:
+        if var_name not in ds.data_vars:
+            raise KeyError(f"Variable {var_name} no encontrada en {ruta_netcdf}")
+        return geotiff_zona(
+            zona, valor, ds[var_name].isel(time=indice_tiempo),
+            rejilla=indice_zonas.rejilla_dataset(ds)
+        )
+    finally:
+        pool_datasets.liberar_dataset(ds)
+
+
+def generar_geotiff_capas(zona, valor, capas, reducir=None):
+
+    # Genera un GeoTIFF multibanda recortado a la zona, con una banda por capa.
+    #   - capas: lista de (ruta_netcdf, var_name, indice_tiempo); indice_tiempo puede
+    #     ser un slice si 'reducir' colapsa el tiempo (p.ej. promedios)
+    # Cada NetCDF se abre una sola vez y la máscara/ventana de la zona se calcula una
+    # sola vez para todas las bandas (todas las capas deben compartir rejilla).
+    # Retorna los bytes del TIFF; con más de una banda, cada una lleva como descripción
+    # su variable.
+
+    abiertos = {}
+    try:
+        for ruta, _, _ in capas:
+            if ruta not in abiertos:
+                abiertos[ruta] = pool_datasets.abrir_dataset(ruta)
+
+        ventanas = {}
+        bandas = []
+        for ruta, var_name, indice_tiempo in capas:
+            ds = abiertos[ruta]
+            if var_name not in ds.data_vars:
+                raise KeyError(f"Variable {var_name} no encontrada en {ruta}")
+            rejilla = indice_zonas.rejilla_dataset(ds)
+            if ventanas and rejilla['firma'] not in {f for f, _, _ in ventanas}:
+                raise ValueError("Las capas pedidas no comparten la misma rejilla")
+            clave = (rejilla['firma'], rejilla['voltear_lat'], rejilla['voltear_lon'])
+            if clave not in ventanas:
+                ventanas[clave] = ventana_zona(zona, valor, rejilla)
+            ventana = ventanas[clave]
+            bandas.append(leer_ventana(
+                ds[var_name].isel(time=indice_tiempo), ventana, rejilla, reducir
+            ))
+    finally:
+        for ds in abiertos.values():
+            pool_datasets.liberar_dataset(ds)
+
+    return escribir_geotiff(
+        np.stack(bandas).astype(np.float32),
+        ventana['mask'],
+        ventana['transform'],
+        descripciones=[var_name for _, var_name, _ in capas] if len(capas) > 1 else None
     )
 
-    # 5) Rasterizar la zona (1 dentro, 0 fuera)
-    mask = features.rasterize(
-        ((geom, 1) for geom in zona_gdf.geometry),
-        out_shape=data.shape,
-        transform=transform,
-        fill=0,
-        dtype="uint8"
-    )
 
-    # 6) Aplicar máscara: fuera de zona → nodata
-    data_mask = np.where(mask == 1, data, np.nan)
+def geotiff_zona(zona, valor, da, reducir=None, rejilla=None):
+
+    # Genera en memoria un GeoTIFF de la capa da (DataArray con dims (..., lat, lon))
+    # recortado a la zona (zona, valor) y retorna sus bytes.
+    # 'rejilla' es la del dataset de origen (indice_zonas.rejilla_dataset); si falta se
+    # calcula desde las coordenadas de da, corrigiendo la orientación si hace falta.
+    # La máscara de la zona sale del índice de zonas de la rejilla (ver app.indice_zonas)
+    # y el TIFF cubre sólo la ventana (bounding box en píxeles) de la zona; de da se lee
+    # únicamente esa ventana. 'reducir' (opcional) se aplica a la ventana antes de leerla,
+    # p.ej. para promediar en el tiempo.
+
+    # 1) Leer la ventana de la zona (orientada Norte→Sur / Oeste→Este), su
+    #    máscara (1 dentro, 0 fuera) y el transform de la ventana
+    data, mask, transform = leer_ventana_zona(da, zona, valor, reducir, rejilla)
+
+    # 2-3) Aplicar la máscara y escribir el GeoTIFF
+    return escribir_geotiff(data.astype(np.float32)[np.newaxis], mask, transform)
+
+
+def escribir_geotiff(bandas, mask, transform, descripciones=None):
+
+    # Escribe en memoria un GeoTIFF float32 con las bandas (n, lat, lon) y retorna sus
+    # bytes. Fuera de la máscara (booleana, (lat, lon)) los píxeles quedan en nodata.
+
+    mask = mask.astype("uint8")
+
+    # Aplicar máscara: fuera de zona → nodata
+    data_mask = np.where(mask == 1, bandas, np.nan).astype(np.float32)
 
-    # 7) Crear GeoTIFF temporal
-    tmp = tempfile.NamedTemporaryFile(suffix=".tif", delete=False)
     profile = {
         "driver": "GTiff",
-        "height": data_mask.shape[0],
-        "width": data_mask.shape[1],
-        "count": 1,
+        "height": data_mask.shape[1],
+        "width": data_mask.shape[2],
+        "count": data_mask.shape[0],
         "dtype": "float32",
         "crs": CRS.from_epsg(4326),
         "transform": transform,
         "nodata": np.nan,
         # Opciones de rendimiento
         "compress": "lzw",
-        "tiled": True,
+        # Teselas de 256x256 sólo si la ventana es al menos de ese tamaño
+        "tiled": min(data_mask.shape[1:]) >= 256,
     }
 
-    with rasterio.open(tmp.name, "w", **profile) as dst:
-        dst.write(data_mask, 1)
-        # Escribimos la máscara interna (0 transparente, 255 opaco)
-        dst.write_mask((mask * 255).astype("uint8"))
+    with MemoryFile() as memfile:
+        with memfile.open(**profile) as dst:
+            dst.write(data_mask)
+            if descripciones:
+                for banda, descripcion in enumerate(descripciones, start=1):
+                    dst.set_band_description(banda, descripcion)
+            # Escribimos la máscara interna (0 transparente, 255 opaco)
+            dst.write_mask((mask * 255).astype("uint8"))
+        return memfile.read()
+
+
+def leer_ventana_zona(da, zona, valor, reducir=None, rejilla=None):
 
-    return tmp.name
+    # Lee de da (DataArray (..., lat, lon), idealmente perezoso) sólo el hiperslab
+    # (lat, lon) que encierra la zona, ubicada con el índice de zonas de la rejilla.
+    # 'reducir' se aplica después de recortar.
+    # Retorna (datos, máscara booleana, transform), en orientación Norte→Sur / Oeste→Este.
 
+    if rejilla is None:
+        rejilla = indice_zonas.rejilla_dataset(da)
+    ventana = ventana_zona(zona, valor, rejilla)
+    return leer_ventana(da, ventana, rejilla, reducir), ventana['mask'], ventana['transform']
 
-def calcular_stats_fuzzy(zona_gdf, ruta_netcdf, indice_tiempo, var_name):
+
+def ventana_zona(zona, valor, rejilla):
+
+    # Ventana de la zona sobre la rejilla, como dict con:
+    #   - 'mask': máscara booleana de la zona dentro de la ventana (orientación canónica)
+    #   - 'lat', 'lon': slices de la ventana en índices del archivo
+    #   - 'transform': transform de la ventana
+
+    mask = indice_zonas.mascara_zona(rejilla, zona, valor)
+    filas, columnas = indice_zonas.ventana_mascara(mask)
+
+    # Transform de la ventana: el de la rejilla desplazado a su primer píxel
+    fila0, _, _ = filas.indices(mask.shape[0])
+    columna0, _, _ = columnas.indices(mask.shape[1])
+    return {
+        'mask': mask[filas, columnas],
+        # Misma ventana en índices del archivo (si el eje está invertido se refleja)
+        'lat': indice_zonas.ventana_en_origen(filas, mask.shape[0], rejilla['voltear_lat']),
+        'lon': indice_zonas.ventana_en_origen(columnas, mask.shape[1], rejilla['voltear_lon']),
+        'transform': rejilla['transform'] * Affine.translation(columna0, fila0),
+    }
+
+
+def leer_ventana(da, ventana, rejilla, reducir=None):
+
+    # Lee de da la ventana (ver ventana_zona) y aplica 'reducir'. En archivos de la
+    # ingesta (orientación canónica) la ventana se lee tal cual; los anteriores se
+    # invierten al vuelo.
+
+    recorte = da.isel(lat=ventana['lat'], lon=ventana['lon'])
+    if reducir is not None:
+        recorte = reducir(recorte)
+    data = recorte.transpose(..., 'lat', 'lon').values
+    if rejilla['voltear_lat']:
+        data = data[..., ::-1, :]
+    if rejilla['voltear_lon']:
+        data = data[..., ::-1]
+    return data
+
+
+def calcular_stats_fuzzy(zona, valor, ruta_netcdf, indice_tiempo, var_name):
     
     # Calcula las funciones de pertenencia (baja, media, alta) para la variable var_name
-    # ('pr' o 't2m') en el NetCDF ruta_netcdf, recortada a la geometría zona_gdf
+    # ('pr' o 't2m') en el NetCDF ruta_netcdf, recortada a la zona (zona, valor)
     # y al paso temporal indice_tiempo. Devuelve un dict con:
     #   - 'categories': dominio de entrada (100 puntos)
     #   - 'baja', 'media', 'alta': listas con el grado de pertenencia [0–1]
     
 
-    # 1) Asegurar CRS en EPSG:4326
-    if zona_gdf.crs is None or zona_gdf.crs.to_string() != "EPSG:4326":
-        zona_gdf = zona_gdf.to_crs(epsg=4326)
-
-    # 2) Abrir NetCDF y extraer la capa deseada
-    ds = xr.open_dataset(ruta_netcdf, decode_times=False)
-    if var_name not in ds.data_vars:
-        ds.close()
-        raise KeyError(f"Variable '{var_name}' no encontrada en {ruta_netcdf}")
-    da = ds[var_name].isel(time=indice_tiempo)  # DataArray (lat, lon)
-    data2d = da.values.astype(float)
-    lons = da["lon"].values
-    lats = da["lat"].values
-    ds.close()
-
-    # 3) Forzar orientación: lat Norte→Sur, lon Oeste→Este
-    if lats[0] < lats[-1]:
-        data2d = data2d[::-1, :]
-        lats = lats[::-1]
-    if lons[0] > lons[-1]:
-        data2d = data2d[:, ::-1]
-        lons = lons[::-1]
-
-    # 4) Rasterizar la zona (1 dentro, 0 fuera)
-    transform = from_bounds(
-        lons.min(), lats.min(),
-        lons.max(), lats.max(),
-        width=data2d.shape[1],
-        height=data2d.shape[0]
-    )
-    mask2d = features.rasterize(
-        [(geom, 1) for geom in zona_gdf.geometry],
-        out_shape=data2d.shape,
-        transform=transform,
-        fill=0,
-        dtype="uint8"
-    )
+    # 1-4) Leer sólo la ventana de la zona y su máscara (índice de zonas de la rejilla)
+    ds = pool_datasets.abrir_dataset(ruta_netcdf)
+    try:
+        if var_name not in ds.data_vars:
+            raise KeyError(f"Variable '{var_name}' no encontrada en {ruta_netcdf}")
+        data2d, mask2d, _ = leer_ventana_zona(
+            ds[var_name].isel(time=indice_tiempo), zona, valor,
+            rejilla=indice_zonas.rejilla_dataset(ds)
+        )
+    finally:
+        pool_datasets.liberar_dataset(ds)
+    data2d = data2d.astype(float)
 
     # 5) Extraer valores válidos dentro de la zona
-    vals = data2d[mask2d == 1]
+    vals = data2d[mask2d]
     vals = vals[~np.isnan(vals)]
     if vals.size == 0:
         raise ValueError("No hay datos válidos en esa zona/fecha")
 
     # 6) Calcular parámetros trapezoidales
     m, M = float(vals.min()), float(vals.max())
-    L8 = (M - m) / 8.0
-    L2 = (M + m) / 2.0
-    TL_low  = [m,      m,       m+L8,    m+3*L8]
-    TL_med  = [L2-3*L8, L2-L8,  L2+L8,   L2+3*L8]
-    TL_high = [M-3*L8,  M-L8,   M,       M]
+    vertices = membresia.vertices_trapecios(m, M)
 
-    # 7) Generar las MFs sobre un dominio de 100 puntos
+    # 7) Evaluar las MFs sobre un dominio de 100 puntos (para el gráfico)
     uni    = np.linspace(m, M, 100)
-    baja   = fuzz.trapmf(uni, TL_low).tolist()
-    media  = fuzz.trapmf(uni, TL_med).tolist()
-    alta   = fuzz.trapmf(uni, TL_high).tolist()
+    baja   = membresia.trapmf(uni, *vertices['baja']).tolist()
+    media  = membresia.trapmf(uni, *vertices['media']).tolist()
+    alta   = membresia.trapmf(uni, *vertices['alta']).tolist()
 
     return {
         "categories": uni.tolist(),
@@ -0,0 +1,326 @@
+import os
+import json
+import hashlib
+import threading
+
+import numpy as np
+
+from app import membresia
+
+# Base de reglas del índice de riesgo fuzzy.
+#
+# Las reglas se declaran como datos (BASE_REGLAS, o un JSON con la misma forma en
+# BASE_REGLAS_RUTA) y se compilan a un kernel que evalúa todas las reglas de un bloque
+# de meses en una sola pasada sobre las membresías de entrada, escribiendo con out= en
+# buffers reservados por quien lo llama (ver procesar.calcular_indice_riesgo_fuzzy).
+# Los operadores se eligen al compilar, así que cambiar de t-norma o s-norma no agrega
+# pasadas sobre los datos.
+#
+# Forma de la base:
+#   'tnorma' : conjunción de los antecedentes de cada regla (ver TNORMAS)
+#   'snorma' : agregación de las reglas de cada clase y de las clases en la salida
+#              (ver SNORMAS)
+#   'salida' : nombre de la variable final
+#   'clases' : clase → lista de reglas {'nombre': componente, 'si': {variable: categoría},
+#              'peso': opcional, multiplica el grado de activación de la regla}
+#   'nombre' : opcional, identifica la base en los lotes (ver compilar_lote)
+# Las variables de entrada son 'pr' y 't2m' y las categorías las de app.membresia.
+#
+# Para análisis de sensibilidad, compilar_lote evalúa N bases a la vez sobre la misma
+# lectura de las membresías (ver procesar.evaluar_lote_riesgo_fuzzy).
+
+# Reglas originales del proyecto: media de las membresías y máximo por clase
+BASE_REGLAS = {
+    'tnorma': 'media',
+    'snorma': 'max',
+    'salida': 'riesgo_fuzzy',
+    'clases': {
+        'riesgo_alto': [
+            {'nombre': 'riesgo_alto_A',  'si': {'t2m': 'alta',  'pr': 'baja'}},   # Tem Alta + Pr Baja
+            {'nombre': 'riesgo_alto_B',  'si': {'t2m': 'media', 'pr': 'baja'}},   # Tem Media + Pr Baja
+        ],
+        'riesgo_medio': [
+            {'nombre': 'riesgo_medio_A', 'si': {'t2m': 'baja',  'pr': 'baja'}},   # Tem Baja + Pr Baja
+            {'nombre': 'riesgo_medio_B', 'si': {'t2m': 'alta',  'pr': 'media'}},  # Tem Alta + Pr Media
+            {'nombre': 'riesgo_medio_C', 'si': {'t2m': 'media', 'pr': 'media'}},  # Tem Media + Pr Media
+            {'nombre': 'riesgo_medio_D', 'si': {'t2m': 'baja',  'pr': 'media'}},  # Tem Baja + Pr Media
+            {'nombre': 'riesgo_medio_E', 'si': {'t2m': 'alta',  'pr': 'alta'}},   # Tem Alta + Pr Alta
+        ],
+        'riesgo_bajo': [
+            {'nombre': 'riesgo_bajo_A',  'si': {'t2m': 'media', 'pr': 'alta'}},   # Tem Media + Pr Alta
+            {'nombre': 'riesgo_bajo_B',  'si': {'t2m': 'baja',  'pr': 'alta'}},   # Tem Baja + Pr Alta
+        ],
+    },
+}
+
+VARIABLES_ENTRADA = ('pr', 't2m')
+
+# Base compilada según BASE_REGLAS_RUTA y mtime del archivo (ver base_activa)
+COMPILADA = {'clave': None, 'base': None}
+CANDADO_COMPILADA = threading.Lock()
+
+
+def tnorma_min(entradas, out):
+    np.copyto(out, entradas[0])
+    for x in entradas[1:]:
+        np.minimum(out, x, out=out)
+
+
+def tnorma_producto(entradas, out):
+    np.copyto(out, entradas[0])
+    for x in entradas[1:]:
+        np.multiply(out, x, out=out)
+
+
+def tnorma_media(entradas, out):
+
+    # Media aritmética (no es una t-norma estricta; es la conjunción original del
+    # proyecto). Con dos antecedentes da exactamente (a + b) / 2.
+
+    if len(entradas) == 1:
+        np.copyto(out, entradas[0])
+        return
+    np.add(entradas[0], entradas[1], out=out)
+    for x in entradas[2:]:
+        np.add(out, x, out=out)
+    np.divide(out, len(entradas), out=out)
+
+
+def snorma_max(acumulado, x, temporal):
+    np.maximum(acumulado, x, out=acumulado)
+
+
+def snorma_suma_probabilistica(acumulado, x, temporal):
+
+    # a + b - a·b
+
+    np.multiply(acumulado, x, out=temporal)
+    np.add(acumulado, x, out=acumulado)
+    np.subtract(acumulado, temporal, out=acumulado)
+
+
+def snorma_suma_acotada(acumulado, x, temporal):
+
+    # min(1, a + b)
+
+    np.add(acumulado, x, out=acumulado)
+    np.minimum(acumulado, 1.0, out=acumulado)
+
+
+TNORMAS = {
+    'min'     : tnorma_min,
+    'producto': tnorma_producto,
+    'media'   : tnorma_media,
+}
+
+SNORMAS = {
+    'max'                : snorma_max,
+    'suma_probabilistica': snorma_suma_probabilistica,
+    'suma_acotada'       : snorma_suma_acotada,
+}
+
+
+def validar(base):
+
+    # Lanza ValueError si la base no tiene la forma esperada.
+
+    if base.get('tnorma') not in TNORMAS:
+        raise ValueError(f"t-norma desconocida: {base.get('tnorma')} (use {', '.join(TNORMAS)})")
+    if base.get('snorma') not in SNORMAS:
+        raise ValueError(f"s-norma desconocida: {base.get('snorma')} (use {', '.join(SNORMAS)})")
+    if not base.get('clases'):
+        raise ValueError("La base de reglas no define clases de salida")
+
+    nombres = [base.get('salida')]
+    for clase, reglas in base['clases'].items():
+        if not reglas:
+            raise ValueError(f"La clase {clase} no tiene reglas")
+        nombres.append(clase)
+        for regla in reglas:
+            nombres.append(regla.get('nombre'))
+            if not regla.get('si'):
+                raise ValueError(f"La regla {regla.get('nombre')} no tiene antecedentes")
+            for variable, categoria in regla['si'].items():
+                if variable not in VARIABLES_ENTRADA or categoria not in membresia.CATEGORIAS:
+                    raise ValueError(f"Antecedente desconocido en {regla.get('nombre')}: {variable} {categoria}")
+            peso = regla.get('peso', 1.0)
+            if isinstance(peso, bool) or not isinstance(peso, (int, float)) or peso < 0:
+                raise ValueError(f"Peso inválido en {regla.get('nombre')}: {peso}")
+    if not all(nombres) or len(set(nombres)) != len(nombres):
+        raise ValueError("Los nombres de reglas, clases y salida deben existir y ser distintos")
+
+
+def huella_base(base):
+    return hashlib.sha256(json.dumps(base, sort_keys=True).encode()).hexdigest()
+
+
+def compilar(base):
+
+    # Compila la base a {'kernel', 'componentes', 'agregados', 'variables',
+    # 'antecedentes', 'huella'}:
+    #   - componentes: una variable por regla; agregados: las clases y la salida
+    #   - variables: todas, en el orden en que se guardan
+    #   - antecedentes: (variable, categoría) de entrada que usan las reglas
+    #   - kernel(entradas, salidas, aux, temporal): evalúa las reglas sobre un bloque
+    #       · entradas: (variable, categoría) → membresías (time, lat, lon)
+    #       · salidas: variable → buffer; deben estar los agregados y, si se piden,
+    #         componentes (las demás no se materializan)
+    #       · aux, temporal: buffers de trabajo de la misma forma
+
+    validar(base)
+    tnorma = TNORMAS[base['tnorma']]
+    snorma = SNORMAS[base['snorma']]
+    clases = [
+        (clase, [(regla['nombre'], tuple(regla['si'].items()), regla.get('peso', 1.0)) for regla in reglas])
+        for clase, reglas in base['clases'].items()
+    ]
+    componentes = [nombre for _, reglas in clases for nombre, _, _ in reglas]
+    agregados   = [clase for clase, _ in clases] + [base['salida']]
+    antecedentes = sorted({a for _, reglas in clases for _, ants, _ in reglas for a in ants})
+
+    def kernel(entradas, salidas, aux, temporal):
+        # Cada regla se escribe en el buffer de su componente (o en 'aux') y se
+        # acumula con la s-norma en el de su clase
+        for clase, reglas in clases:
+            destino = salidas[clase]
+            for i, (nombre, ants, peso) in enumerate(reglas):
+                buf = salidas.get(nombre)
+                if buf is None:
+                    buf = destino if i == 0 else aux
+                tnorma([entradas[a] for a in ants], buf)
+                if peso != 1:
+                    np.multiply(buf, peso, out=buf)
+                if buf is destino:
+                    continue
+                if i == 0:
+                    np.copyto(destino, buf)
+                else:
+                    snorma(destino, buf, temporal)
+
+        final = salidas[base['salida']]
+        np.copyto(final, salidas[clases[0][0]])
+        for clase, _ in clases[1:]:
+            snorma(final, salidas[clase], temporal)
+        return salidas
+
+    return {
+        'kernel'      : kernel,
+        'componentes' : componentes,
+        'agregados'   : agregados,
+        'variables'   : componentes + agregados,
+        'antecedentes': antecedentes,
+        'huella'      : huella_base(base),
+    }
+
+
+def compilar_lote(bases):
+
+    # Compila N bases para evaluarlas juntas a lo largo de un eje de configuraciones.
+    # Retorna {'kernel', 'n', 'n_activaciones', 'grupo_maximo', 'clases_maximas',
+    # 'antecedentes', 'huellas'}.
+    #
+    # Cada activación distinta (t-norma, antecedentes) se calcula una sola vez por
+    # bloque aunque la usen varias bases. Las bases con la misma s-norma y la misma
+    # forma (número de reglas por clase) forman un grupo que se agrega de una vez: para
+    # cada posición de regla se reúnen las activaciones de todas sus bases en un array
+    # (bases, time, lat, lon), se multiplican por los pesos por broadcasting y se
+    # acumulan con la s-norma. Así cambiar operadores o pesos no agrega lecturas.
+    #
+    # kernel(entradas, out, activaciones, trabajo) evalúa un bloque:
+    #   - entradas: (variable, categoría) → membresías (time, lat, lon)
+    #   - out: buffer (N, time, lat, lon) donde queda la salida final de cada base
+    #   - activaciones: buffer (n_activaciones, time, lat, lon)
+    #   - trabajo: buffer (clases_maximas + 2, grupo_maximo, time, lat, lon)
+
+    if not bases:
+        raise ValueError("No se indicó ninguna base de reglas")
+    for base in bases:
+        validar(base)
+
+    claves = []
+    grupos = {}
+    for i, base in enumerate(bases):
+        forma = []
+        for reglas in base['clases'].values():
+            forma.append([])
+            for regla in reglas:
+                clave = (base['tnorma'], tuple(regla['si'].items()))
+                if clave not in claves:
+                    claves.append(clave)
+                forma[-1].append((claves.index(clave), regla.get('peso', 1.0)))
+        firma = (base['snorma'], tuple(len(reglas) for reglas in forma))
+        grupos.setdefault(firma, []).append((i, forma))
+
+    # Por grupo: índices de sus bases y, por clase y posición de regla, los índices de
+    # activación y los pesos de cada base
+    compilados = []
+    for (snorma, _), miembros in grupos.items():
+        indices = np.array([i for i, _ in miembros])
+        clases = []
+        for k in range(len(miembros[0][1])):
+            reglas = []
+            for r in range(len(miembros[0][1][k])):
+                activaciones = np.array([forma[k][r][0] for _, forma in miembros])
+                pesos = np.array([forma[k][r][1] for _, forma in miembros], dtype=float)
+                reglas.append((activaciones, pesos.reshape(-1, 1, 1, 1), bool(np.all(pesos == 1))))
+            clases.append(reglas)
+        compilados.append((SNORMAS[snorma], indices, clases))
+
+    def kernel(entradas, out, activaciones, trabajo):
+        for d, (tnorma, ants) in enumerate(claves):
+            TNORMAS[tnorma]([entradas[a] for a in ants], activaciones[d])
+
+        for snorma, indices, clases in compilados:
+            n = len(indices)
+            aux, temporal = trabajo[0, :n], trabajo[1, :n]
+            acumulados = []
+            for k, reglas in enumerate(clases):
+                destino = trabajo[2 + k, :n]
+                for r, (indices_act, pesos, sin_peso) in enumerate(reglas):
+                    buf = destino if r == 0 else aux
+                    np.take(activaciones, indices_act, axis=0, out=buf)
+                    if not sin_peso:
+                        np.multiply(buf, pesos, out=buf)
+                    if r > 0:
+                        snorma(destino, buf, temporal)
+                acumulados.append(destino)
+
+            final = aux
+            np.copyto(final, acumulados[0])
+            for destino in acumulados[1:]:
+                snorma(final, destino, temporal)
+            out[indices] = final
+        return out
+
+    return {
+        'kernel'        : kernel,
+        'n'             : len(bases),
+        'n_activaciones': len(claves),
+        'grupo_maximo'  : max(len(indices) for _, indices, _ in compilados),
+        'clases_maximas': max(len(clases) for _, _, clases in compilados),
+        'antecedentes'  : sorted({a for _, ants in claves for a in ants}),
+        'huellas'       : [huella_base(base) for base in bases],
+    }
+
+
+def ruta_base():
+    return os.getenv("BASE_REGLAS_RUTA", "").strip()
+
+
+def base_activa():
+
+    # Base compilada en uso: la del JSON de BASE_REGLAS_RUTA si está definida (se
+    # recompila cuando cambia el archivo) o BASE_REGLAS.
+
+    ruta = ruta_base()
+    clave = (ruta, os.path.getmtime(ruta)) if ruta else None
+    with CANDADO_COMPILADA:
+        if COMPILADA['base'] is None or COMPILADA['clave'] != clave:
+            if ruta:
+                with open(ruta, encoding='utf-8') as f:
+                    base = json.load(f)
+            else:
+                base = BASE_REGLAS
+            COMPILADA['base']  = compilar(base)
+            COMPILADA['clave'] = clave
+        return COMPILADA['base']
@@ -0,0 +1,207 @@
+import os
+import datetime
+
+import numpy as np
+from dateutil.relativedelta import relativedelta
+
+from app import almacenamiento, bloques, indice_zonas, pool_datasets
+from app.procesar import (
+    COPIAS_RECORTE,
+    limpiar_atributos_conflictivos,
+    generar_nombre_base,
+    calcular_fecha_desde_indice
+)
+
+# Series extensibles para la ingesta incremental.
+#
+# En vez de escribir en cada subida copias nuevas de 60 meses (recortado, fuzzy y
+# riesgo fuzzy), cada variable tiene un NetCDF por serie en uploads/series con 'time'
+# ilimitado: al llegar un archivo que extiende la serie sólo se calculan y anexan los
+# meses nuevos. Las membresías y el riesgo fuzzy se calculan mes a mes, así que los
+# meses ya guardados no cambian. El catálogo expone cada serie como una ventana móvil
+# de los últimos VENTANA_MESES meses (archivos.desfase = primer paso de la ventana).
+#
+# Los meses se identifican por el valor entero de 'time' (meses desde 1978-12-15).
+
+CARPETA_SERIES = 'uploads/series'
+
+# Meses de la ventana móvil que se publica en el catálogo (lo que antes era cada copia)
+VENTANA_MESES = 60
+
+
+def ruta_serie(nombre):
+
+    # Ruta del NetCDF de la serie 'nombre' ('pr', 'fuzzy_pr', 'riesgo_fuzzy', …).
+
+    return os.path.join(CARPETA_SERIES, f"{nombre}_serie.nc")
+
+
+def meses(ds):
+    return np.rint(ds['time'].values).astype(int)
+
+
+def meses_serie(ruta):
+
+    # Meses guardados en la serie (array vacío si no existe).
+
+    if not os.path.exists(ruta):
+        return np.array([], dtype=int)
+    ds = pool_datasets.abrir_dataset(ruta)
+    try:
+        return meses(ds)
+    finally:
+        pool_datasets.liberar_dataset(ds)
+
+
+def perfil_coincide(ruta, variable, perfil=None):
+
+    # True si la capa 'variable' de la serie está guardada con el perfil de
+    # almacenamiento vigente (anexar con otro perfil mezclaría codificaciones).
+
+    ds = pool_datasets.abrir_dataset(ruta)
+    try:
+        return str(ds[variable].encoding.get('dtype')) == almacenamiento.dtype_perfil(perfil)
+    finally:
+        pool_datasets.liberar_dataset(ds)
+
+
+def descartar(*rutas):
+
+    # Borra series que dejaron de ser válidas (p.ej. al reconstruir su entrada). Dos
+    # etapas que corren a la vez pueden descartar la misma serie.
+
+    for ruta in rutas:
+        if os.path.exists(ruta):
+            pool_datasets.invalidar_dataset(ruta)
+            try:
+                os.remove(ruta)
+            except FileNotFoundError:
+                pass
+
+
+def copiar_bloques(ds, presupuesto=None):
+
+    # Bloques de tiempo de ds listos para escribir (como en recortar_ultimos_5_anos).
+
+    T = ds.sizes['time']
+    paso = bloques.pasos_por_bloque(T, bloques.bytes_por_paso(ds, COPIAS_RECORTE), presupuesto)
+    for t0, t1 in bloques.iterar_bloques(T, paso):
+        yield limpiar_atributos_conflictivos(ds.isel(time=slice(t0, t1)))
+
+
+def solapados_iguales(ds_serie, ds, variable, presupuesto=None):
+
+    # True si los meses que ds comparte con la serie tienen exactamente los mismos
+    # valores (NaN incluidos). Se compara por bloques de tiempo.
+
+    comunes, i_serie, i_ds = np.intersect1d(meses(ds_serie), meses(ds), return_indices=True)
+    if len(comunes) == 0:
+        return True
+    paso = bloques.pasos_por_bloque(
+        len(comunes), bloques.bytes_por_paso(ds[variable], 2), presupuesto
+    )
+    for t0, t1 in bloques.iterar_bloques(len(comunes), paso):
+        guardados = ds_serie[variable].isel(time=i_serie[t0:t1]).values
+        nuevos    = ds[variable].isel(time=i_ds[t0:t1]).values
+        if not np.array_equal(guardados, nuevos, equal_nan=True):
+            return False
+    return True
+
+
+def actualizar_serie(ruta_archivo, presupuesto=None):
+
+    # Incorpora un NetCDF subido (pr o t2m) a la serie de su variable:
+    #   - si la serie no existe, o el archivo no calza con ella (otra rejilla, un hueco
+    #     de meses o valores distintos en los meses que comparten), la serie se
+    #     reconstruye con los últimos VENTANA_MESES meses del archivo
+    #   - si calza, sólo se anexan los meses posteriores al último guardado
+    # Retorna {'variable', 'ruta', 'accion': 'creada' | 'reconstruida' | 'anexada' |
+    # 'sin_cambios', 'nuevos': meses agregados}.
+
+    os.makedirs(CARPETA_SERIES, exist_ok=True)
+    ds_abierto = pool_datasets.abrir_dataset(ruta_archivo)
+    try:
+        if 'pr' in ds_abierto.data_vars:
+            variable = 'pr'
+        elif 't2m' in ds_abierto.data_vars:
+            variable = 't2m'
+        else:
+            raise ValueError("No se reconoce variable 'pr' o 't2m'")
+        if 'time' not in ds_abierto.dims:
+            raise ValueError("El archivo no tiene dimensión de tiempo")
+
+        ds = indice_zonas.orientar_dataset(ds_abierto[[variable]])
+        ruta = ruta_serie(variable)
+        meses_archivo = meses(ds)
+        accion = 'creada'
+
+        if os.path.exists(ruta):
+            ds_serie = pool_datasets.abrir_dataset(ruta)
+            try:
+                meses_guardados = meses(ds_serie)
+                calza = (
+                    ds_serie.attrs.get('firma_rejilla') == ds.attrs.get('firma_rejilla')
+                    and meses_archivo[0] <= meses_guardados[-1] + 1
+                    and solapados_iguales(ds_serie, ds, variable, presupuesto)
+                )
+            finally:
+                pool_datasets.liberar_dataset(ds_serie)
+
+            if calza:
+                nuevos = int(np.sum(meses_archivo > meses_guardados[-1]))
+                if nuevos == 0:
+                    return {'variable': variable, 'ruta': ruta, 'accion': 'sin_cambios', 'nuevos': 0}
+                ds_nuevos = ds.isel(time=slice(ds.sizes['time'] - nuevos, None))
+                bloques.anexar_bloques(copiar_bloques(ds_nuevos, presupuesto), ruta)
+                return {'variable': variable, 'ruta': ruta, 'accion': 'anexada', 'nuevos': nuevos}
+
+            if meses_archivo[-1] < meses_guardados[-1]:
+                raise ValueError(
+                    "El archivo termina antes que la serie guardada y no coincide con ella; "
+                    "súbalo en modo de ingesta completa"
+                )
+            accion = 'reconstruida'
+
+        if ds.sizes['time'] < VENTANA_MESES:
+            raise ValueError(f"El archivo no tiene al menos {VENTANA_MESES} pasos de tiempo")
+        ds_ventana = ds.isel(time=slice(-VENTANA_MESES, None))
+        bloques.guardar_bloques(copiar_bloques(ds_ventana, presupuesto), ruta)
+        return {'variable': variable, 'ruta': ruta, 'accion': accion, 'nuevos': VENTANA_MESES}
+    finally:
+        pool_datasets.liberar_dataset(ds_abierto)
+
+
+def etiqueta_mes(mes):
+
+    # 'YYYY-MM' del mes 'mes' (meses desde 1978-12-15), igual que generar_nombre_base.
+
+    fecha = datetime.datetime(1978, 12, 15) + relativedelta(months=+int(mes))
+    return f"{fecha.year}-{fecha.month:02d}"
+
+
+def vista_ventana(nombre_base, pasos, desfase=0):
+
+    # Fila de catálogo de una ventana de 'pasos' meses (≤ VENTANA_MESES) que termina en
+    # 'nombre_base' y comienza en el paso 'desfase' del archivo.
+
+    return {
+        'nombre_base'  : nombre_base,
+        'fecha_inicial': calcular_fecha_desde_indice(nombre_base, VENTANA_MESES - pasos + 1),
+        'fecha_final'  : nombre_base,
+        'desfase'      : desfase,
+    }
+
+
+def vista(ruta):
+
+    # Ventana móvil de la serie para el catálogo: los últimos VENTANA_MESES meses (o
+    # todos, si la serie es más corta). Ver vista_ventana.
+
+    ds = pool_datasets.abrir_dataset(ruta)
+    try:
+        total = ds.sizes['time']
+        nombre_base = generar_nombre_base(ds)
+    finally:
+        pool_datasets.liberar_dataset(ds)
+    pasos = min(VENTANA_MESES, total)
+    return vista_ventana(nombre_base, pasos, total - pasos)
@@ -0,0 +1,188 @@
+import os
+import json
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from app import ingesta
+from app.database import obtener_conexion, liberar_conexion
+
+# Cola de trabajos de ingesta.
+#
+# /upload guarda el archivo, crea un trabajo y responde de inmediato con su id; un pool
+# local de hilos ejecuta las etapas (ver app.ingesta) y va registrando su avance en la
+# tabla 'trabajos', que se consulta por /api/trabajos/<id>. Como el estado vive en la
+# BD, los trabajos que quedaron pendientes o a medias al detener el servidor se
+# retoman al arrancar (reanudar_trabajos); la ingesta es idempotente, así que repetir
+# una etapa ya hecha no duplica registros.
+
+# Estados de un trabajo: pendiente → en_proceso → completado | error
+ESTADOS_ACTIVOS = ('pendiente', 'en_proceso')
+
+EJECUTOR = None
+CANDADO_EJECUTOR = threading.Lock()
+
+
+def ingesta_workers():
+
+    # Trabajos de ingesta que se ejecutan a la vez (INGESTA_WORKERS). Se lee al crear
+    # el pool para respetar el .env, que server.py carga después de importar los módulos.
+
+    return max(1, int(os.getenv("INGESTA_WORKERS", "1")))
+
+
+def obtener_ejecutor():
+
+    # Pool de hilos compartido (se crea en el primer uso).
+
+    global EJECUTOR
+    with CANDADO_EJECUTOR:
+        if EJECUTOR is None:
+            EJECUTOR = ThreadPoolExecutor(max_workers=ingesta_workers(), thread_name_prefix='ingesta')
+        return EJECUTOR
+
+
+def etapas_iniciales():
+    return {etapa: 'pendiente' for etapa in ingesta.ETAPAS}
+
+
+def actualizar(id_trabajo, **campos):
+
+    # Guarda en la BD los campos indicados del trabajo (etapas y resultado como JSON).
+
+    for campo in ('etapas', 'resultado'):
+        if campo in campos and campos[campo] is not None:
+            campos[campo] = json.dumps(campos[campo])
+
+    asignaciones = ", ".join(f"{campo}=%s" for campo in campos)
+    conn = obtener_conexion()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            f"UPDATE trabajos SET {asignaciones}, actualizado=CURRENT_TIMESTAMP WHERE id=%s",
+            (*campos.values(), id_trabajo)
+        )
+        conn.commit()
+        cur.close()
+    finally:
+        liberar_conexion(conn)
+
+
+def crear_trabajo(archivo, ruta, hash_subida=None):
+
+    # Registra un trabajo pendiente para ingerir 'ruta' (el NetCDF ya guardado, con
+    # sha256 'hash_subida').
+    # Retorna el trabajo como dict (ver obtener_trabajo).
+
+    id_trabajo = uuid.uuid4().hex
+    conn = obtener_conexion()
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO trabajos (id, archivo, ruta, hash, estado, etapas, creado, actualizado)
+            VALUES (%s,%s,%s,%s,%s,%s,CURRENT_TIMESTAMP,CURRENT_TIMESTAMP)
+        """, (id_trabajo, archivo, ruta, hash_subida, 'pendiente', json.dumps(etapas_iniciales())))
+        conn.commit()
+        cur.close()
+    finally:
+        liberar_conexion(conn)
+    return obtener_trabajo(id_trabajo)
+
+
+def obtener_trabajo(id_trabajo):
+
+    # Estado del trabajo: {'id', 'archivo', 'estado', 'etapas': [{'etapa', 'estado'}, …]
+    # en orden de ejecución (con 'motivo' si la etapa se reconstruyó porque cambiaron
+    # sus entradas), 'resultado', 'error', 'creado', 'actualizado'}, o None si no existe.
+
+    conn = obtener_conexion()
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT id, archivo, estado, etapas, resultado, error, creado, actualizado
+            FROM trabajos WHERE id=%s
+        """, (id_trabajo,))
+        fila = cur.fetchone()
+        cur.close()
+    finally:
+        liberar_conexion(conn)
+
+    if fila is None:
+        return None
+    etapas = json.loads(fila[3]) if fila[3] else etapas_iniciales()
+    motivos = etapas.get('motivos', {})
+    lista_etapas = []
+    for e in ingesta.ETAPAS:
+        etapa = {'etapa': e, 'estado': etapas.get(e, 'pendiente')}
+        if e in motivos:
+            etapa['motivo'] = motivos[e]
+        lista_etapas.append(etapa)
+    return {
+        'id'         : fila[0],
+        'archivo'    : fila[1],
+        'estado'     : fila[2],
+        'etapas'     : lista_etapas,
+        'resultado'  : json.loads(fila[4]) if fila[4] else None,
+        'error'      : fila[5],
+        'creado'     : str(fila[6]) if fila[6] is not None else None,
+        'actualizado': str(fila[7]) if fila[7] is not None else None
+    }
+
+
+def ejecutar(id_trabajo, ruta, hash_subida=None):
+
+    # Corre la ingesta de un trabajo en un hilo del pool, registrando cada cambio de
+    # etapa. Un error queda guardado en el trabajo (no se propaga al pool).
+
+    etapas = etapas_iniciales()
+
+    def avisar(etapa, estado, motivo=None):
+        etapas[etapa] = estado
+        if motivo:
+            etapas.setdefault('motivos', {})[etapa] = motivo
+        actualizar(id_trabajo, etapas=etapas)
+
+    try:
+        actualizar(id_trabajo, estado='en_proceso', etapas=etapas, error=None)
+        if not os.path.exists(ruta):
+            raise FileNotFoundError(f"No se encontró el archivo subido: {os.path.basename(ruta)}")
+        resultado = ingesta.procesar_archivo(ruta, avisar, hash_subida)
+        actualizar(id_trabajo, estado='completado', resultado=resultado)
+    except Exception as e:
+        for etapa, estado in etapas.items():
+            if estado == 'en_proceso':
+                etapas[etapa] = 'error'
+        try:
+            actualizar(id_trabajo, estado='error', etapas=etapas, error=str(e))
+        except Exception as e_bd:
+            print(f"No se pudo registrar el error del trabajo {id_trabajo}: {e_bd}")
+
+
+def encolar(id_trabajo, ruta, hash_subida=None):
+
+    # Envía el trabajo al pool de ingesta.
+
+    obtener_ejecutor().submit(ejecutar, id_trabajo, ruta, hash_subida)
+
+
+def reanudar_trabajos():
+
+    # Vuelve a encolar, en orden de creación, los trabajos que quedaron pendientes o en
+    # proceso (p.ej. porque el servidor se detuvo). Retorna cuántos se encolaron.
+
+    conn = obtener_conexion()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT id, ruta, hash FROM trabajos WHERE estado IN (%s,%s) ORDER BY creado",
+            ESTADOS_ACTIVOS
+        )
+        filas = cur.fetchall()
+        cur.close()
+    finally:
+        liberar_conexion(conn)
+
+    for id_trabajo, ruta, hash_subida in filas:
+        actualizar(id_trabajo, estado='pendiente', etapas=etapas_iniciales())
+        encolar(id_trabajo, ruta, hash_subida)
+    return len(filas)
@@ -1,5 +1,52 @@
+import os
+import threading
+
 import geopandas as gpd
 
+# Shapefile y campo de nombre para cada nivel de zona
+ZONE_MAP = {
+    'region':    ('shapefiles/regiones/Regional.shp',     'Region'),
+    'provincia': ('shapefiles/provincias/Provincias.shp', 'Provincia'),
+    'comuna':    ('shapefiles/comunas/comunas.shp',       'Comuna')
+}
+
+# Listas de nombres de región para cada macro-zona
+REG_NORTE = [
+    "Región de Arica y Parinacota",
+    "Región de Tarapacá",
+    "Región de Antofagasta",
+    "Región de Atacama",
+    "Región de Coquimbo"
+]
+REG_CENTRO = [
+    "Región de Valparaíso",
+    "Región Metropolitana de Santiago",
+    "Región del Libertador Bernardo O'Higgins",
+    "Región del Maule",
+    "Región de Ñuble",
+    "Región del Bío-Bío",
+]
+REG_SUR = [
+    "Región de La Araucanía",
+    "Región de Los Ríos",
+    "Región de Los Lagos",
+    "Región de Aysén del Gral.Ibañez del Campo",
+    "Región de Magallanes y Antártica Chilena",
+    "Zona sin demarcar"
+]
+
+MACROZONAS = {
+    'norte':  REG_NORTE,
+    'centro': REG_CENTRO,
+    'sur':    REG_SUR,
+}
+
+# Registro de geometrías en memoria: por nivel, el shapefile ya reproyectado a
+# EPSG:4326, su índice por nombre y (para regiones) las uniones de país/macro-zonas.
+# Se carga una vez por proceso y se recarga sólo si cambia el mtime del shapefile.
+REGISTRO = {}
+CANDADO_REGISTRO = threading.Lock()
+
 def cargar_jerarquia_ubicaciones(ruta_shapefile='shapefiles/comunas/comunas.shp'):
 
     # Lee un shapefile de comunas (que incluye columnas Region, Provincia y Comuna)
@@ -45,87 +92,91 @@ def cargar_jerarquia_ubicaciones(ruta_shapefile='shapefiles/comunas/comunas.shp'
     return jerarquia
 
 
+def normalizar_nombre(nombre):
+    return str(nombre).strip().lower()
+
+
+def cargar_capa(nivel):
+
+    # Lee el shapefile del nivel ('region', 'provincia' o 'comuna'), lo reproyecta a
+    # EPSG:4326 y arma el índice nombre normalizado → GeoDataFrame con sus filas.
+    # Para las regiones también precalcula las uniones de país y macro-zonas.
+
+    shp, campo = ZONE_MAP[nivel]
+    mtime = os.path.getmtime(shp)
+    gdf = gpd.read_file(shp).to_crs(epsg=4326)
+
+    nombres = gdf[campo].map(normalizar_nombre)
+    indice = {nombre: gdf[nombres == nombre] for nombre in nombres.unique()}
+
+    uniones = {}
+    if nivel == 'region':
+        uniones['pais'] = union_gdf(gdf)
+        for macro, lista in MACROZONAS.items():
+            sel = gdf[gdf["Region"].isin(lista)]
+            if not sel.empty:
+                uniones[macro] = union_gdf(sel)
+
+    return {'mtime': mtime, 'gdf': gdf, 'indice': indice, 'uniones': uniones}
+
+
+def union_gdf(gdf):
+
+    # GeoDataFrame de una sola fila con la unión de todas las geometrías de gdf.
+
+    return gpd.GeoDataFrame(
+        {'geometry': [gdf.geometry.unary_union]},
+        geometry='geometry',
+        crs="EPSG:4326"
+    )
+
+
+def registro_capa(nivel):
+
+    # Devuelve la capa del nivel desde el registro en memoria; sólo se vuelve a leer
+    # el shapefile si su fecha de modificación cambió.
+
+    shp, _ = ZONE_MAP[nivel]
+    capa = REGISTRO.get(nivel)
+    if capa is not None and capa['mtime'] == os.path.getmtime(shp):
+        return capa
+
+    with CANDADO_REGISTRO:
+        capa = REGISTRO.get(nivel)
+        if capa is None or capa['mtime'] != os.path.getmtime(shp):
+            capa = cargar_capa(nivel)
+            REGISTRO[nivel] = capa
+    return capa
+
+
+def capa_zonas(nivel):
+
+    # GeoDataFrame completo (EPSG:4326) del nivel. Es compartido: no modificarlo.
+
+    return registro_capa(nivel)['gdf']
+
+
 def obtener_zona_gdf(zona, valor):
     
-    # Lee el shapefile correspondiente a la zona (comuna/provincia/región/pais/norte/centro/sur)
-    # y devuelve un GeoDataFrame con la(s) geometría(s) filtrada(s).
+    # Devuelve un GeoDataFrame (EPSG:4326) con la(s) geometría(s) de la zona
+    # (comuna/provincia/región/pais/norte/centro/sur), servido desde el registro en
+    # memoria. El GeoDataFrame es compartido entre peticiones: no modificarlo.
     
     z = zona.strip().lower()
 
-    # 1) Casos puntuales: país, zonas
-    if z == 'pais':
-        # Unimos todas las regiones
-        regiones = gpd.read_file("shapefiles/regiones/Regional.shp").to_crs(epsg=4326)
-        union_geom = regiones.geometry.unary_union
-        return gpd.GeoDataFrame(
-            {'geometry': [union_geom]},
-            geometry='geometry',
-            crs="EPSG:4326"
-        )
-
-    # Definimos listas de nombres de región para cada “zona”
-    REG_NORTE = [
-        "Región de Arica y Parinacota",
-        "Región de Tarapacá",
-        "Región de Antofagasta",
-        "Región de Atacama",
-        "Región de Coquimbo"
-    ]
-    REG_CENTRO = [
-        "Región de Valparaíso",
-        "Región Metropolitana de Santiago",
-        "Región del Libertador Bernardo O'Higgins",
-        "Región del Maule",
-        "Región de Ñuble",
-        "Región del Bío-Bío",
-    ]
-    REG_SUR = [
-        "Región de La Araucanía",
-        "Región de Los Ríos",
-        "Región de Los Lagos",
-        "Región de Aysén del Gral.Ibañez del Campo",
-        "Región de Magallanes y Antártica Chilena",
-        "Zona sin demarcar"
-    ]
-
-    if z in ('norte', 'centro', 'sur'):
-        regiones = gpd.read_file("shapefiles/regiones/Regional.shp").to_crs(epsg=4326)
-        if z == 'norte':
-            sel = regiones[regiones["Region"].isin(REG_NORTE)]
-        elif z == 'centro':
-            sel = regiones[regiones["Region"].isin(REG_CENTRO)]
-        else:  # sur
-            sel = regiones[regiones["Region"].isin(REG_SUR)]
-
-        if sel.empty:
+    # 1) Casos puntuales: país, zonas (uniones precalculadas)
+    if z == 'pais' or z in MACROZONAS:
+        uniones = registro_capa('region')['uniones']
+        if z not in uniones:
             raise ValueError(f"No se encontraron regiones para la zona '{zona}'")
-
-        union_geom = sel.geometry.unary_union
-        return gpd.GeoDataFrame(
-            {'geometry': [union_geom]},
-            geometry='geometry',
-            crs="EPSG:4326"
-        )
+        return uniones[z]
 
     # 2) Casos por nombre: comuna, provincia, región
-    if z == 'comuna':
-        shp = "shapefiles/comunas/comunas.shp"
-        campo = "Comuna"
-    elif z == 'provincia':
-        shp = "shapefiles/provincias/Provincias.shp"
-        campo = "Provincia"
-    elif z == 'region':
-        shp = "shapefiles/regiones/Regional.shp"
-        campo = "Region"
-    else:
+    if z not in ZONE_MAP:
         raise ValueError(f"Zona inválida: {zona}")
 
-    gdf = gpd.read_file(shp)
-    mask = gdf[campo].str.strip().str.lower() == valor.strip().lower()
-    gdf = gdf[mask]
-
-    if gdf.empty:
+    gdf = registro_capa(z)['indice'].get(normalizar_nombre(valor))
+    if gdf is None:
         raise ValueError(f"No se encontró {zona} con nombre '{valor}'")
 
-    return gdf.to_crs(epsg=4326)
-
+    return gdf
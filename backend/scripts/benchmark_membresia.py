@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# Micro-benchmarks del núcleo de pertenencia trapezoidal (app.membresia) frente al
+# camino anterior con scikit-fuzzy (trapmf sobre un universo discreto +
+# interp_membership). Requiere scikit-fuzzy sólo para la comparación:
+#   pip install scikit-fuzzy
+#   python scripts/benchmark_membresia.py
+import sys
+import os
+import time
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+
+from app import membresia
+
+try:
+    import skfuzzy as fuzz
+except ImportError:
+    fuzz = None
+
+
+def medir(nombre, funcion, repeticiones=5):
+    tiempos = []
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - t0)
+    print(f"  {nombre:<42} {min(tiempos) * 1000:9.2f} ms")
+    return min(tiempos)
+
+
+def skfuzzy_muestreado(x, m, M, n_puntos):
+    # Camino anterior: muestrear las tres MFs y leerlas con interp_membership
+    v = membresia.vertices_trapecios(m, M)
+    uni = np.linspace(m, M, n_puntos)
+    return tuple(
+        fuzz.interp_membership(uni, fuzz.trapmf(uni, list(v[cat])), x)
+        for cat in membresia.CATEGORIAS
+    )
+
+
+def main():
+    rng = np.random.default_rng(0)
+
+    # Un mes de una región en la rejilla CR2MET 0.05° (~35 mil píxeles) y una
+    # rejilla nacional completa (~180 mil píxeles), con 10% de NaN
+    for n in (35_000, 180_000):
+        x = rng.gamma(2.0, 30.0, n)
+        x[rng.random(n) < 0.1] = np.nan
+        validos = x[~np.isnan(x)]
+        m, M = float(validos.min()), float(validos.max())
+        x32 = x.astype(np.float32)
+        buffers = tuple(np.empty_like(x) for _ in membresia.CATEGORIAS)
+        buffers32 = tuple(np.empty_like(x32) for _ in membresia.CATEGORIAS)
+
+        print(f"\n{n} valores")
+        if fuzz is not None:
+            medir("skfuzzy trapmf + interp (1000 puntos)",
+                  lambda: skfuzzy_muestreado(validos, m, M, 1000))
+            medir("skfuzzy trapmf + interp (100 puntos)",
+                  lambda: skfuzzy_muestreado(validos, m, M, 100))
+        medir("membresia.membresias float64",
+              lambda: membresia.membresias(x, m, M))
+        medir("membresia.membresias float64 out=",
+              lambda: membresia.membresias(x, m, M, out=buffers))
+        medir("membresia.membresias float32 out=",
+              lambda: membresia.membresias(x32, m, M, out=buffers32))
+
+        if fuzz is not None:
+            # Error de discretización del camino muestreado respecto del analítico
+            exacto = membresia.membresias(validos, m, M)
+            for n_puntos in (100, 1000):
+                muestreado = skfuzzy_muestreado(validos, m, M, n_puntos)
+                error = max(np.abs(a - b).max() for a, b in zip(exacto, muestreado))
+                print(f"  error máx. skfuzzy ({n_puntos} puntos) vs analítico: {error:.2e}")
+
+    if fuzz is None:
+        print("\n(scikit-fuzzy no instalado: se omite la comparación)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+# Genera las sumas acumuladas (app.acumulados) de los NetCDF de riesgo ya registrados
+# que no las tengan al día, p.ej. los ingeridos antes de que existieran. La ingesta las
+# genera sola para lo que procesa de ahora en adelante. Se ejecuta desde backend/:
+#   python scripts/generar_acumulados.py [--todos]
+import sys
+import os
+import argparse
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from app import acumulados, catalogo
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera los acumulados de los archivos de riesgo registrados")
+    parser.add_argument('--todos', action='store_true', help="regenera también los que están al día")
+    args = parser.parse_args()
+
+    for fila in catalogo.leer_archivos():
+        if fila['tipo_archivo'] not in ('riesgo_crisp', 'riesgo_fuzzy') or not os.path.exists(fila['ruta']):
+            continue
+        if not args.todos and acumulados.vigente(fila['ruta']):
+            print(f"al día    {fila['ruta']}")
+            continue
+        destino = acumulados.generar_acumulado(fila['ruta'], acumulados.variables_riesgo(fila['tipo_archivo']))
+        print(f"generado  {fila['ruta']} → {destino}")
+
+
+if __name__ == '__main__':
+    main()
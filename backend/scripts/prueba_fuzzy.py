@@ -7,6 +7,8 @@ from app.procesar import generar_capas_fuzzy
 ruta_archivo = "uploads/recortado/recortado_CR2MET_pr_v2.0_mon_1979_2019_005deg.nc"
 # ruta_archivo = "uploads/recortado/recortado_CR2MET_t2m_v2.0_mon_1979_2019_005deg.nc"
 
-resultado = generar_capas_fuzzy(ruta_archivo)
-print("✅ FUNCIONÓ:")
-print(resultado)
+# Con FUZZY_WORKERS > 1 los procesos de cálculo vuelven a importar este archivo
+if __name__ == '__main__':
+    resultado = generar_capas_fuzzy(ruta_archivo)
+    print("✅ FUNCIONÓ:")
+    print(resultado)
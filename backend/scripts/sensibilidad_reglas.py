@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# Análisis de sensibilidad del riesgo fuzzy: evalúa varias bases de reglas (un JSON
+# con una lista de bases como las de app.reglas) sobre los mismos archivos fuzzy, en
+# una sola lectura (ver procesar.evaluar_lote_riesgo_fuzzy).
+#   python scripts/sensibilidad_reglas.py uploads/fuzzy/fuzzy_pr_2019-05.nc \
+#       uploads/fuzzy/fuzzy_t2m_2019-05.nc bases.json [--cubo salida.nc]
+# Sin --cubo imprime, por base, la media espacial promedio y los extremos del periodo;
+# con --cubo guarda además el resultado (config, time, lat, lon).
+import sys
+import os
+import json
+import argparse
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+
+from app.procesar import evaluar_lote_riesgo_fuzzy
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara el riesgo fuzzy con varias bases de reglas")
+    parser.add_argument('pr_fuzzy')
+    parser.add_argument('t2m_fuzzy')
+    parser.add_argument('bases', help="JSON con una lista de bases de reglas")
+    parser.add_argument('--cubo', help="NetCDF donde guardar el resultado (config, time, lat, lon)")
+    parser.add_argument('--presupuesto-mb', type=float, default=512, help="memoria de trabajo por bloque (MB)")
+    args = parser.parse_args()
+
+    with open(args.bases, encoding='utf-8') as f:
+        bases = json.load(f)
+    presupuesto = int(args.presupuesto_mb * 1024 * 1024)
+
+    if args.cubo:
+        cubo = evaluar_lote_riesgo_fuzzy(args.pr_fuzzy, args.t2m_fuzzy, bases, presupuesto=presupuesto)
+        cubo.to_netcdf(args.cubo)
+        print(f"Resultado guardado en {args.cubo}")
+
+    resumen = evaluar_lote_riesgo_fuzzy(args.pr_fuzzy, args.t2m_fuzzy, bases, resumen=True, presupuesto=presupuesto)
+    print(f"{'config':<32} {'media':>8} {'mínimo':>8} {'máximo':>8}")
+    for i, nombre in enumerate(resumen['config'].values):
+        media  = np.nanmean(resumen['media'].values[i]) if np.any(~np.isnan(resumen['media'].values[i])) else np.nan
+        minimo = np.fmin.reduce(resumen['minimo'].values[i])
+        maximo = np.fmax.reduce(resumen['maximo'].values[i])
+        print(f"{str(nombre):<32} {media:8.4f} {minimo:8.4f} {maximo:8.4f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,11 @@
 
 # Importa el blueprint que contiene todas las rutas de la API
 from app.routes import routes
+from app.indice_zonas import cargar_indices_guardados
+from app.migraciones import aplicar_migraciones
+from app.trabajos import reanudar_trabajos
+
+import os
 
 # ImportaFlask para crear la aplicación y CORS para permitir peticiones desde el frontend
 from flask import Flask
@@ -21,6 +26,33 @@ CORS(app)
 # Todas las rutas definidas ahí quedarán montadas en la aplicación principal.
 app.register_blueprint(routes)
 
+# Los procesos de cálculo de las capas fuzzy (FUZZY_WORKERS, ver app.procesar) se
+# inician con 'spawn' y vuelven a importar este archivo como '__mp_main__': en ellos
+# no se prepara el servidor (índices, catálogo ni cola de ingesta).
+PROCESO_SERVIDOR = __name__ != '__mp_main__'
+
+# Abre (con memory-map) los índices de zonas ya construidos en uploads/indices_zonas,
+# para que las primeras peticiones no tengan que rasterizar los shapefiles.
+if PROCESO_SERVIDOR:
+    cargar_indices_guardados()
+
+# Crea o actualiza el esquema del catálogo (PostgreSQL o SQLite, según CATALOGO_BACKEND).
+# Si la BD no está disponible el servidor arranca igual y el error se verá en /upload.
+if PROCESO_SERVIDOR:
+    try:
+        aplicar_migraciones()
+    except Exception as e:
+        print(f"No se pudieron aplicar las migraciones del catálogo: {e}")
+
+# Retoma los trabajos de ingesta que quedaron pendientes al detener el servidor.
+# Con debug=True el recargador ejecuta este archivo en dos procesos y sólo el hijo
+# (WERKZEUG_RUN_MAIN) atiende peticiones, así que sólo él retoma la cola.
+if PROCESO_SERVIDOR and (__name__ != '__main__' or os.environ.get("WERKZEUG_RUN_MAIN") == "true"):
+    try:
+        reanudar_trabajos()
+    except Exception as e:
+        print(f"No se pudieron retomar los trabajos de ingesta: {e}")
+
 # Punto de entrada de la aplicación: si se ejecuta este archivo directamente,
 # arranca el servidor en modo debug (con recarga automática y mensajes detallados).
 if __name__ == '__main__':
@@ -3,13 +3,42 @@ import axios from 'axios';
 
 /*
   Permite al usuario seleccionar y subir exactamente dos archivos NetCDF (.nc)
-  al servidor, muestra el estado de cada subida y, tras un upload exitoso,
-  invoca onUploadSuccess() para que el selector de fechas se recargue.
+  al servidor. Cada subida deja un trabajo de ingesta en cola en el backend;
+  el componente consulta su avance (/api/trabajos/<id>) y muestra el estado de
+  cada etapa. Cuando ambos trabajos terminan bien invoca onUploadSuccess()
+  para que el selector de fechas se recargue.
 */
 
+const API = 'http://localhost:5000';
+
+// Cada cuánto se consulta el avance de los trabajos (ms)
+const INTERVALO_CONSULTA = 2000;
+
+const ICONOS_ETAPA = {
+  pendiente: '⏳',
+  en_proceso: '🔄',
+  completada: '✅',
+  reutilizada: '♻️',
+  omitida: '➖',
+  error: '❌',
+};
+
+const esperar = (ms) => new Promise(resolve => setTimeout(resolve, ms));
+
 function FileUpload({ onUploadSuccess }) {
   const [status, setStatus] = useState("");
 
+  const describirTrabajos = (trabajos) =>
+    trabajos.map(({ nombre, trabajo, error }) => {
+      if (error) return `❌ Error al subir ${nombre}: ${error}`;
+      const etapas = trabajo.etapas
+        .map(e => `   ${ICONOS_ETAPA[e.estado] || ''} ${e.etapa}`)
+        .join('\n');
+      let linea = `${nombre}: ${trabajo.estado}`;
+      if (trabajo.estado === 'error') linea += ` (${trabajo.error})`;
+      return `${linea}\n${etapas}`;
+    }).join('\n');
+
   const handleUpload = async (event) => {
     const files = event.target.files;
 
@@ -20,25 +49,45 @@ function FileUpload({ onUploadSuccess }) {
 
     setStatus("Subiendo archivos...");
 
-    let allOk = true;
+    // 1) Subir cada archivo: el backend responde de inmediato con el trabajo en cola
+    const trabajos = [];
     for (let i = 0; i < files.length; i++) {
       const formData = new FormData();
       formData.append('file', files[i]);
 
       try {
         const res = await axios.post(
-          'http://localhost:5000/upload', 
-          formData, 
+          `${API}/upload`,
+          formData,
           { headers: { 'Content-Type': 'multipart/form-data' } }
         );
-        setStatus(prev => prev + `\n✅ ${files[i].name} subido correctamente`);
+        trabajos.push({ nombre: files[i].name, trabajo: res.data });
       } catch (error) {
         console.error(`❌ Error al subir ${files[i].name}:`, error);
-        setStatus(prev => prev + `\n❌ Error al subir ${files[i].name}`);
-        allOk = false;
+        trabajos.push({
+          nombre: files[i].name,
+          error: error.response?.data?.error || error.message,
+        });
+      }
+      setStatus(describirTrabajos(trabajos));
+    }
+
+    // 2) Consultar el avance hasta que todos los trabajos terminen
+    const activos = (t) => t.trabajo && ['pendiente', 'en_proceso'].includes(t.trabajo.estado);
+    while (trabajos.some(activos)) {
+      await esperar(INTERVALO_CONSULTA);
+      for (const t of trabajos.filter(activos)) {
+        try {
+          const res = await axios.get(`${API}/api/trabajos/${t.trabajo.id}`);
+          t.trabajo = res.data;
+        } catch (error) {
+          console.error(`❌ Error al consultar el trabajo de ${t.nombre}:`, error);
+        }
       }
+      setStatus(describirTrabajos(trabajos));
     }
 
+    const allOk = trabajos.every(t => t.trabajo && t.trabajo.estado === 'completado');
     if (allOk) {
       setStatus(prev => prev + `\n Ambos archivos fueron procesados con éxito.`);
       // Disparamos la recarga de fechas en App.jsx
@@ -33,30 +33,25 @@ export default function MapaImagen({ tipo, zona, valor, fecha }) {
     return colorRamp[Math.min(9, Math.floor(v*10))];
   };
 
-  // 3) URLs de capas
+  // 3) Capas: todas las de una vista se piden juntas a /api/layer como un único
+  //    GeoTIFF multibanda; cada mapa dibuja su banda
   const capas = useMemo(() => {
     const enc = encodeURIComponent;
-    const urls = [];
+    let nombres = [];
+    let keys = [];
     if (tipo === "riesgo") {
-      if (verPromedio) {
-        urls.push({ key:"normal", url:`${API_BASE}/api/promedio-riesgo-crisp-zona?zona=${zona}&valor=${enc(valor)}` });
-        urls.push({ key:"fuzzy",  url:`${API_BASE}/api/promedio-riesgo-fuzzy-zona?zona=${zona}&valor=${enc(valor)}` });
-      } else {
-        urls.push({ key:"normal", url:`${API_BASE}/api/riesgo-crisp-geotiff?zona=${zona}&valor=${enc(valor)}&fecha=${fecha}` });
-        urls.push({ key:"fuzzy",  url:`${API_BASE}/api/riesgo-fuzzy-geotiff?zona=${zona}&valor=${enc(valor)}&fecha=${fecha}` });
-      }
+      nombres = ["riesgo_crisp", "riesgo_fuzzy"];
+      keys    = ["normal", "fuzzy"];
     }
     if (tipo === "precipitacion"|| tipo==="temperatura") {
-      const base = tipo==="precipitacion"? "precipitacion" : "temperatura";
-      urls.push({ key:"normal", url:`${API_BASE}/api/${base}-geotiff?zona=${zona}&valor=${enc(valor)}&fecha=${fecha}` });
-      ["baja","media","alta"].forEach(level => {
-        urls.push({
-          key: level,
-          url: `${API_BASE}/api/${base}-${level}-fuzzy-geotiff?zona=${zona}&valor=${enc(valor)}&fecha=${fecha}`
-        });
-      });
+      const base = tipo==="precipitacion"? "pr" : "t2m";
+      nombres = [base, `${base}_baja`, `${base}_media`, `${base}_alta`];
+      keys    = ["normal", "baja", "media", "alta"];
     }
-    return urls;
+    if (!nombres.length) return [];
+    const periodo = tipo === "riesgo" && verPromedio ? "promedio=24" : `fecha=${fecha}`;
+    const url = `${API_BASE}/api/layer?capas=${nombres.join(",")}&zona=${zona}&valor=${enc(valor)}&${periodo}`;
+    return keys.map((key, banda) => ({ key, url, banda }));
   }, [tipo, zona, valor, fecha, verPromedio]);
 
   // 4) Etiquetas
@@ -77,121 +72,129 @@ export default function MapaImagen({ tipo, zona, valor, fecha }) {
     return {};
   }, [tipo]);
 
-  // 5) Renderizar cada capa
+  // 5) Renderizar cada capa (un solo fetch por URL; cada capa usa su banda)
   useEffect(() => {
     if (!capas.length) return;
 
-    capas.forEach(({ key, url }) => {
+    const grupos = {};
+    capas.forEach(capa => { (grupos[capa.url] = grupos[capa.url] || []).push(capa); });
+
+    Object.entries(grupos).forEach(([url, grupo]) => {
       (async () => {
         const res = await fetch(url);
         if (!res.ok) throw new Error(`No se pudo cargar ${url}`);
         const buf = await res.arrayBuffer();
         const raster = await georaster(buf);
+        await Promise.all(grupo.map(({ key, banda }) =>
+          dibujarCapa(key, banda, raster).catch(err => console.error(`Error capa ${key}:`, err))
+        ));
+      })().catch(err => console.error(`Error capas ${url}:`, err));
+    });
 
-        // colorfn dinámico si no es riesgo crisp
-        let colorFn = pixelValuesToColorFn;
-        if (key==="normal" && tipo!=="riesgo") {
-          const [min,max] = [raster.mins[0], raster.maxs[0]];
-          colorFn = v => {
-            if (v==null||isNaN(v)) return null;
-            return colorRamp[Math.min(9,Math.floor((v-min)/(max-min)*10))];
-          };
-        }
+    async function dibujarCapa(key, banda, raster) {
+      // colorfn dinámico si no es riesgo crisp
+      let colorFn = values => pixelValuesToColorFn(values[banda]);
+      if (key==="normal" && tipo!=="riesgo") {
+        const [min,max] = [raster.mins[banda], raster.maxs[banda]];
+        colorFn = values => {
+          const v = values[banda];
+          if (v==null||isNaN(v)) return null;
+          return colorRamp[Math.min(9,Math.floor((v-min)/(max-min)*10))];
+        };
+      }
 
-        // init / limpiar mapa
-        let entry = mapRefs.current[key];
-        if (!entry) {
-          const map = L.map(`map-${key}`, { zoomControl:true, maxZoom:13, minZoom:4 })
-                     .setView([-30,-70],5);
-          L.tileLayer("https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png", {
-            attribution: "© OpenStreetMap contributors"
-          }).addTo(map);
-          entry = mapRefs.current[key] = { map, legend:null };
-        } else {
-          entry.map.eachLayer(l => { if (!(l instanceof L.TileLayer)) entry.map.removeLayer(l) });
-        }
+      // init / limpiar mapa
+      let entry = mapRefs.current[key];
+      if (!entry) {
+        const map = L.map(`map-${key}`, { zoomControl:true, maxZoom:13, minZoom:4 })
+                   .setView([-30,-70],5);
+        L.tileLayer("https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png", {
+          attribution: "© OpenStreetMap contributors"
+        }).addTo(map);
+        entry = mapRefs.current[key] = { map, legend:null };
+      } else {
+        entry.map.eachLayer(l => { if (!(l instanceof L.TileLayer)) entry.map.removeLayer(l) });
+      }
 
-        // añadir raster
-        new GeoRasterLayer({
-          georaster:            raster,
-          opacity:              0.8,
-          resolution:           64,
-          pixelValuesToColorFn: colorFn
-        }).addTo(entry.map);
+      // añadir raster
+      new GeoRasterLayer({
+        georaster:            raster,
+        opacity:              0.8,
+        resolution:           64,
+        pixelValuesToColorFn: colorFn
+      }).addTo(entry.map);
 
-        // Parámetro geojson según zona
-        const zonaParam =
-          zona==="pais"      ? `pais=${encodeURIComponent(valor)}` :
-          zona==="norte"     ? `norte=${encodeURIComponent(valor)}` :
-          zona==="centro"    ? `centro=${encodeURIComponent(valor)}` :
-          zona==="sur"       ? `sur=${encodeURIComponent(valor)}` :
-          zona==="comuna"    ? `comuna=${encodeURIComponent(valor)}` :
-          zona==="provincia"? `provincia=${encodeURIComponent(valor)}` :
-                              `region=${encodeURIComponent(valor)}`;
+      // Parámetro geojson según zona
+      const zonaParam =
+        zona==="pais"      ? `pais=${encodeURIComponent(valor)}` :
+        zona==="norte"     ? `norte=${encodeURIComponent(valor)}` :
+        zona==="centro"    ? `centro=${encodeURIComponent(valor)}` :
+        zona==="sur"       ? `sur=${encodeURIComponent(valor)}` :
+        zona==="comuna"    ? `comuna=${encodeURIComponent(valor)}` :
+        zona==="provincia"? `provincia=${encodeURIComponent(valor)}` :
+                            `region=${encodeURIComponent(valor)}`;
 
-        // fetch geojson y dibujar contorno
-        const gj = await fetch(`${API_BASE}/api/geojson?${zonaParam}`).then(r=>r.json());
-        const zoneLayer = L.geoJSON(gj, {
-          style:{ color:"#3f3f40", weight:0.8, fillOpacity:0 }
-        }).addTo(entry.map);
-        if (zoneLayer.getBounds().isValid()) {
-          entry.map.fitBounds(zoneLayer.getBounds(), { padding:[20,20], maxZoom:10 });
-        }
+      // fetch geojson y dibujar contorno
+      const gj = await fetch(`${API_BASE}/api/geojson?${zonaParam}`).then(r=>r.json());
+      const zoneLayer = L.geoJSON(gj, {
+        style:{ color:"#3f3f40", weight:0.8, fillOpacity:0 }
+      }).addTo(entry.map);
+      if (zoneLayer.getBounds().isValid()) {
+        entry.map.fitBounds(zoneLayer.getBounds(), { padding:[20,20], maxZoom:10 });
+      }
 
-        // leyenda
-        if (entry.legend) { entry.map.removeControl(entry.legend); entry.legend=null; }
-        const legend = L.control({ position:"bottomright" });
-        legend.onAdd = () => {
-          const div = L.DomUtil.create("div","info legend");
-          Object.assign(div.style,{
-            background:"rgba(255,255,255,0.8)",
-            padding:"6px",
-            borderRadius:"4px",
-            boxShadow:"0 0 15px rgba(0,0,0,0.2)",
-            lineHeight:"1.2em",
-            fontSize:"0.9em"
-          });
-          div.innerHTML = `<strong style="display:block;text-align:center;margin-bottom:4px;">
-                             ${labelMap[key]}
-                           </strong>`;
-          if (key==="normal" && tipo==="precipitacion") {
-            const [min,max] = [raster.mins[0], raster.maxs[0]];
-            const step = (max-min)/10;
-            for (let i=0;i<10;i++){
-              const f=(min+step*i).toFixed(1),
-                    t=(min+step*(i+1)).toFixed(1);
-              div.innerHTML +=
-                `<i style="background:${colorRamp[i]};width:18px;height:8px;display:inline-block;margin-right:4px"></i>
-                 ${f}–${t} mm<br>`;
-            }
+      // leyenda
+      if (entry.legend) { entry.map.removeControl(entry.legend); entry.legend=null; }
+      const legend = L.control({ position:"bottomright" });
+      legend.onAdd = () => {
+        const div = L.DomUtil.create("div","info legend");
+        Object.assign(div.style,{
+          background:"rgba(255,255,255,0.8)",
+          padding:"6px",
+          borderRadius:"4px",
+          boxShadow:"0 0 15px rgba(0,0,0,0.2)",
+          lineHeight:"1.2em",
+          fontSize:"0.9em"
+        });
+        div.innerHTML = `<strong style="display:block;text-align:center;margin-bottom:4px;">
+                           ${labelMap[key]}
+                         </strong>`;
+        if (key==="normal" && tipo==="precipitacion") {
+          const [min,max] = [raster.mins[banda], raster.maxs[banda]];
+          const step = (max-min)/10;
+          for (let i=0;i<10;i++){
+            const f=(min+step*i).toFixed(1),
+                  t=(min+step*(i+1)).toFixed(1);
+            div.innerHTML +=
+              `<i style="background:${colorRamp[i]};width:18px;height:8px;display:inline-block;margin-right:4px"></i>
+               ${f}–${t} mm<br>`;
           }
-          else if (key==="normal" && tipo==="temperatura") {
-            const [min,max] = [raster.mins[0], raster.maxs[0]];
-            const step = (max-min)/10;
-            for (let i=0;i<10;i++){
-              const f=(min+step*i).toFixed(1),
-                    t=(min+step*(i+1)).toFixed(1);
-              div.innerHTML +=
-                `<i style="background:${colorRamp[i]};width:18px;height:8px;display:inline-block;margin-right:4px"></i>
-                 ${f}–${t} °C<br>`;
-            }
+        }
+        else if (key==="normal" && tipo==="temperatura") {
+          const [min,max] = [raster.mins[banda], raster.maxs[banda]];
+          const step = (max-min)/10;
+          for (let i=0;i<10;i++){
+            const f=(min+step*i).toFixed(1),
+                  t=(min+step*(i+1)).toFixed(1);
+            div.innerHTML +=
+              `<i style="background:${colorRamp[i]};width:18px;height:8px;display:inline-block;margin-right:4px"></i>
+               ${f}–${t} °C<br>`;
           }
-          else {
-            for (let i=0;i<10;i++){
-              const f=(i/10).toFixed(1),
-                    t=((i+1)/10).toFixed(1);
-              div.innerHTML +=
-                `<i style="background:${colorRamp[i]};width:18px;height:8px;display:inline-block;margin-right:4px"></i>
-                 ${f}–${t}<br>`;
-            }
+        }
+        else {
+          for (let i=0;i<10;i++){
+            const f=(i/10).toFixed(1),
+                  t=((i+1)/10).toFixed(1);
+            div.innerHTML +=
+              `<i style="background:${colorRamp[i]};width:18px;height:8px;display:inline-block;margin-right:4px"></i>
+               ${f}–${t}<br>`;
           }
-          return div;
-        };
-        legend.addTo(entry.map);
-        entry.legend = legend;
-
-      })().catch(err => console.error(`Error capa ${key}:`, err));
-    });
+        }
+        return div;
+      };
+      legend.addTo(entry.map);
+      entry.legend = legend;
+    }
   }, [capas, tipo, zona, valor]);
 
   // 6) Botón de stats fuzzy